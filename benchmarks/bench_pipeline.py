@@ -0,0 +1,166 @@
+"""
+Times every stage of the MIDI to waveform pipeline on generated MIDI files, from a few notes up to 100k events. The
+hardware is simulated, so this runs on any machine.
+
+Usage: python benchmarks/bench_pipeline.py [--quick] [--columnar] [--output results.json] [--baseline FILE]
+                                          [--update-baseline]
+
+The results are written as JSON. With a baseline, the benchmark fails when a stage takes more than --tolerance times
+its baseline time. Baselines depend on the machine, so update the baseline when switching machines.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+from random import Random
+from time import perf_counter
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import mido
+from musicpuncher.keyboard import Keyboard
+from musicpuncher.music import parse_midi, adjust, autotranspose, autofit, consolidate, write_midi, NoteArray
+from tests.helpers import CONFIG, simulated_puncher
+
+KEYBOARD = [48, 50, 52, 53, 55, 57, 59, 60, 62, 64, 65, 67, 69, 71, 72]
+CONFIG = dict(CONFIG, **{'waveform-cache-size': 0, 'waveform-engine': 'array',
+                         'planner': {'strategy': 'lookahead', 'depth': 8}})
+WAVEFORM_STEPS = 500  # number of planned moves to create waveforms for
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline_pipeline.json')
+
+
+def generate_midi(events: int, chord: int = 1, sustain: float = 0.2, seed: int = 1) -> bytes:
+    """
+    Returns a MIDI file with the given number of note events, played in chords of the given size. Every note lasts
+    sustain beats, so long sustains overlap with the next notes.
+    """
+    random = Random(seed)
+    messages = []  # (absolute tick, message)
+    tick = 0
+    for _ in range(0, events, chord):
+        for note in random.sample(range(40, 84), chord):
+            messages.append((tick, mido.Message('note_on', note=note, velocity=64)))
+            messages.append((tick + round(sustain * 480), mido.Message('note_off', note=note, velocity=0)))
+        tick += random.choice([60, 120, 240, 480])
+    messages.sort(key=lambda message: message[0])
+
+    mid = mido.MidiFile(ticks_per_beat=480)
+    track = mido.MidiTrack()
+    mid.tracks.append(track)
+    last = 0
+    for tick, message in messages:
+        track.append(message.copy(time=tick - last))
+        last = tick
+
+    file = io.BytesIO()
+    mid.save(file=file)
+    return file.getvalue()
+
+
+SCENARIOS = {
+    'few-notes': dict(events=16),
+    'melody-1k': dict(events=1000),
+    'chords-10k': dict(events=10000, chord=6),
+    'sustained-10k': dict(events=10000, chord=2, sustain=8),
+    'melody-100k': dict(events=100000),
+}
+QUICK_SCENARIOS = ['few-notes', 'melody-1k', 'chords-10k', 'sustained-10k']
+
+
+def measure(stage, repeat: int):
+    """Returns the result of the stage and its fastest time in seconds"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = perf_counter()
+        result = stage()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def run_scenario(data: bytes, repeat: int, columnar: bool):
+    keyboard = Keyboard(KEYBOARD)
+    puncher = simulated_puncher(CONFIG, keyboard)
+    puncher.position = CONFIG['idle-position']
+    steppers = puncher.steppers
+    times = {}
+
+    def parse():
+        notes = parse_midi(file=io.BytesIO(data))
+        return NoteArray.of(notes) if columnar else notes
+
+    notes, times['parse_midi'] = measure(parse, repeat)
+    notes, times['adjust'] = measure(lambda: adjust(notes, '40+,41+'), repeat)
+    _, times['autotranspose'] = measure(lambda: autotranspose(notes, keyboard, best_effort=True), repeat)
+    notes, times['autofit'] = measure(lambda: autofit(notes, keyboard), repeat)
+    notes, times['consolidate'] = measure(lambda: consolidate(notes), repeat)
+    steps, times['calculate_all_steps'] = measure(lambda: puncher.compile(notes).steps, repeat)
+
+    def waveforms():
+        steppers.waveform_cache.clear()  # build the waveforms of every repeat
+        for step in steps[:WAVEFORM_STEPS]:
+            steppers.synchronized_waveforms(list(step))
+
+    _, times['waveforms'] = measure(waveforms, repeat)
+    _, times['write_midi'] = measure(lambda: write_midi(notes, file=io.BytesIO()), repeat)
+    return {'notes': len(notes), 'steps': len(steps), 'times': times}
+
+
+def run(scenarios, columnar: bool = False):
+    results = {}
+    for name in scenarios:
+        data = generate_midi(**SCENARIOS[name])
+        repeat = 3 if SCENARIOS[name]['events'] <= 10000 else 1
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[name] = run_scenario(data, repeat, columnar)
+        times = results[name]['times']
+        print(f"{name:>14}: " + ", ".join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in times.items()))
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'columnar': columnar,
+            'scenarios': results}
+
+
+def regressions(results, baseline, tolerance: float, minimum: float):
+    """Returns the stages that take more than tolerance times their baseline, ignoring stages below minimum seconds"""
+    failed = []
+    for name, result in results['scenarios'].items():
+        expected = baseline['scenarios'].get(name, {}).get('times', {})
+        for stage, seconds in result['times'].items():
+            if stage in expected and seconds > minimum and seconds > expected[stage] * tolerance:
+                failed.append(f"{name} {stage}: {seconds * 1000:.1f}ms, baseline {expected[stage] * 1000:.1f}ms")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the MIDI to waveform pipeline')
+    parser.add_argument('--quick', action='store_true', help='Skip the 100k event scenario')
+    parser.add_argument('--columnar', action='store_true', help='Run the stages on a NoteArray instead of a list')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline results to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='Allowed slowdown factor per stage')
+    parser.add_argument('--update-baseline', action='store_true', help='Store the results as the new baseline')
+    args = parser.parse_args()
+
+    results = run(QUICK_SCENARIOS if args.quick else list(SCENARIOS), args.columnar)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Updated baseline {args.baseline}")
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline) as file:
+            failed = regressions(results, json.load(file), args.tolerance, 0.005)
+        if failed:
+            print("Regressions:\n  " + "\n  ".join(failed))
+            sys.exit(1)
+        print(f"No regressions compared to {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Compares the 'pulses' and 'array' waveform engines for move lengths from 1 to 12000 steps.
+
+Usage: python benchmarks/bench_waveform.py
+"""
+import os
+import struct
+import sys
+from timeit import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pigpio
+import pigpio_mock
+from musicpuncher.music_puncher import PiGPIOStepperMotor
+from tests.helpers import CONFIG
+
+LENGTHS = [1, 10, 100, 1000, 3000, 6000, 12000]
+
+
+def pulses_stages(stepper, steps):
+    def create():
+        return stepper.create_move_waveform(steps)
+
+    wave = create()
+
+    def scale():
+        # same as Steppers.__synchronize
+        return [pigpio.pulse(pulse.gpio_on, pulse.gpio_off, round(pulse.delay * 1.5)) for pulse in wave]
+
+    def length():
+        return sum(pulse.delay for pulse in wave)
+
+    def pack():
+        # same as pigpio.pi.wave_add_generic
+        ext = bytearray()
+        for p in wave:
+            ext.extend(struct.pack("III", p.gpio_on, p.gpio_off, p.delay))
+        return ext
+
+    return create, scale, length, pack
+
+
+def array_stages(stepper, steps):
+    def create():
+        return stepper.create_move_array(steps)
+
+    wave = create()
+    return create, lambda: wave.scaled(1.5), wave.length, wave.pack
+
+
+def measure(stages, number):
+    return [timeit(stage, number=number) / number * 1000 for stage in stages]
+
+
+def run():
+    pi = pigpio_mock.pi()
+    pulses_stepper = PiGPIOStepperMotor(pi, CONFIG['feed-stepper'], engine='pulses')
+    array_stepper = PiGPIOStepperMotor(pi, CONFIG['feed-stepper'], engine='array')
+
+    print("All times in ms per move: create / scale / length / pack = total")
+    print(f"{'steps':>6}  {'pulses':>40}  {'array':>40}  {'speedup':>7}")
+    for steps in LENGTHS:
+        number = max(3, 20000 // steps)
+        pulses_times = measure(pulses_stages(pulses_stepper, steps), number)
+        array_times = measure(array_stages(array_stepper, steps), number)
+
+        def format(times):
+            return " / ".join(f"{t:6.3f}" for t in times) + f" = {sum(times):7.3f}"
+
+        print(f"{steps:>6}  {format(pulses_times):>40}  {format(array_times):>40}  "
+              f"{sum(pulses_times) / sum(array_times):6.1f}x")
+
+
+if __name__ == '__main__':
+    run()
@@ -8,7 +8,7 @@ import yaml
 if os.getenv("MOCK_PIGPIO") == 'true':
     sys.modules['pigpio'] = __import__('pigpio_mock')
 
-from musicpuncher.runner import punch, calibrate, serve
+from musicpuncher.runner import punch, punch_job, calibrate, serve
 
 
 def run():
@@ -22,11 +22,23 @@ def run():
                                          " (+ one octave) and 99 by 75 (- two octaves)", default='')
     parser.add_argument("--autofit", help="Transposes with given value and auto-adjust notes if possible", type=int)
     parser.add_argument("-o", "--out", help="Write the resulting midi to the given midi file instead of punching it")
+    parser.add_argument("--simulate", action='store_true',
+                        help="Runs on a simulated pi with a virtual clock, and reports the machine time and travel")
+    parser.add_argument("--metrics", action='store_true',
+                        help="Measures the time spent per phase of punching, and prints a summary at the end")
+    parser.add_argument("--trace", metavar='FILE',
+                        help="Writes a timeline of the run to the file, in Chrome trace format (chrome://tracing)")
+    parser.add_argument("--compile", metavar='JOB',
+                        help="Compiles the midi file into a job file instead of punching it, see --job")
+    parser.add_argument("--waveforms", action='store_true',
+                        help="Includes the waveforms in the compiled job, which makes it larger but faster to start")
 
     group = parser.add_mutually_exclusive_group(required=True)
 
     group.add_argument('file', metavar='FILE', nargs='?', type=str, help='midi file to punch')
 
+    group.add_argument('--job', metavar='JOB', help="Punches a job compiled with --compile")
+
     group.add_argument("--calibrate", action='store_true',
                        help="Punches a hole on the first and last row, feeds 2 seconds and punches again")
 
@@ -39,13 +51,20 @@ def run():
         config = yaml.load(file, Loader=yaml.FullLoader)
 
     puncher_config = config['music-puncher']
+    if args.metrics:
+        puncher_config['metrics'] = True
+    if args.trace:
+        puncher_config['trace'] = args.trace
 
     if args.calibrate:
-        calibrate(puncher_config)
+        calibrate(puncher_config, simulate=args.simulate)
     elif args.serve:
         serve(puncher_config)
+    elif args.job:
+        punch_job(args.job, puncher_config, simulate=args.simulate)
     else:
-        punch(args.file, args.adjust, args.autofit, puncher_config, outfile=args.out)
+        punch(args.file, args.adjust, args.autofit, puncher_config, outfile=args.out, simulate=args.simulate,
+              jobfile=args.compile, waveforms=args.waveforms)
 
 
 run()
@@ -0,0 +1,28 @@
+import time as _time
+
+
+class Clock(object):
+    """The wall clock. All timing of the puncher goes through a clock, so a simulation can replace it"""
+
+    def time(self) -> float:
+        return _time.time()
+
+    def sleep(self, seconds: float):
+        _time.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """A clock that only advances by sleeping, which makes a simulated run instantaneous and deterministic"""
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            self.now += seconds
+
+
+SYSTEM_CLOCK = Clock()
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import struct
+import sys
+from array import array
+from typing import Dict, List, Tuple
+
+from .keyboard import Keyboard
+from .planner import Step
+from .waveform import ArrayWaveform
+
+MAGIC = b'MPJOB\0'
+VERSION = 1
+HEADER = struct.Struct('<6sH32sdII')  # magic, version, fingerprint, feed steps, steps, waveforms
+WAVEFORM_HEADER = struct.Struct('<iiII')  # feed steps, tone steps, length in microseconds, waves
+WAVE_HEADER = struct.Struct('<I')  # pulses
+
+# The configuration that determines the steps and the waveforms of a job
+FINGERPRINT_KEYS = ['idle-position', 'row0', 'tone-steps', 'feed-steps', 'minimal-feed', 'planner', 'feed-stepper',
+                    'tone-stepper']
+
+Waveforms = Tuple[list, int]  # synchronized waves and their length in microseconds
+
+
+def config_fingerprint(config, keyboard: Keyboard) -> bytes:
+    """Returns a hash of the keyboard and the configuration that a compiled job depends on"""
+    relevant = {key: config.get(key) for key in FINGERPRINT_KEYS}
+    relevant['keyboard'] = keyboard.keyboard
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode()).digest()
+
+
+class CompiledJob(object):
+    """
+    The planned steps of a card, with the feed scaling they were planned with and optionally the synchronized
+    waveforms of the moves, so the same card can be punched again without parsing, planning or creating waveforms.
+    A job only fits the configuration with the same fingerprint.
+    """
+
+    def __init__(self, fingerprint: bytes, feed_steps: float, steps: List[Step],
+                 waveforms: Dict[Step, Waveforms] = None):
+        self.fingerprint = fingerprint
+        self.feed_steps = feed_steps
+        self.steps = steps
+        self.waveforms = waveforms or {}
+
+    def verify(self, fingerprint: bytes):
+        if fingerprint != self.fingerprint:
+            raise RuntimeError("The compiled job does not match the keyboard and stepper configuration, compile it again")
+
+    def to_bytes(self) -> bytes:
+        parts = [HEADER.pack(MAGIC, VERSION, self.fingerprint, self.feed_steps, len(self.steps), len(self.waveforms))]
+        steps = array('i', [s for step in self.steps for s in step])
+        parts.append(_little_endian(steps).tobytes())
+        for (feed, tone), (waves, length) in self.waveforms.items():
+            parts.append(WAVEFORM_HEADER.pack(feed, tone, length, len(waves)))
+            for wave in waves:
+                if not isinstance(wave, ArrayWaveform):
+                    wave = ArrayWaveform(array('I', [pulse.gpio_on for pulse in wave]),
+                                         array('I', [pulse.gpio_off for pulse in wave]),
+                                         array('I', [pulse.delay for pulse in wave]))
+                parts.append(WAVE_HEADER.pack(len(wave)))
+                parts.append(_little_endian(array('I', wave.pack())).tobytes())
+        return b''.join(parts)
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'CompiledJob':
+        if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+            raise RuntimeError("Not a compiled job")
+        magic, version, fingerprint, feed_steps, step_count, waveform_count = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise RuntimeError(f"Unsupported compiled job version {version}, compile it again")
+        offset = HEADER.size
+
+        steps = _read_array('i', data, offset, 2 * step_count)
+        offset += 8 * step_count
+        waveforms = {}
+        for _ in range(waveform_count):
+            feed, tone, length, wave_count = WAVEFORM_HEADER.unpack_from(data, offset)
+            offset += WAVEFORM_HEADER.size
+            waves = []
+            for _ in range(wave_count):
+                pulses, = WAVE_HEADER.unpack_from(data, offset)
+                offset += WAVE_HEADER.size
+                words = _read_array('I', data, offset, 3 * pulses)
+                offset += 12 * pulses
+                waves.append(ArrayWaveform(words[0::3], words[1::3], words[2::3]))
+            waveforms[(feed, tone)] = (waves, length)
+        return CompiledJob(fingerprint, feed_steps, list(zip(steps[0::2], steps[1::2])), waveforms)
+
+    def save(self, filename: str):
+        with open(filename, 'wb') as file:
+            file.write(self.to_bytes())
+
+    @staticmethod
+    def load(filename: str) -> 'CompiledJob':
+        with open(filename, 'rb') as file:
+            return CompiledJob.from_bytes(file.read())
+
+
+def _little_endian(values: array) -> array:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def _read_array(typecode: str, data: bytes, offset: int, count: int) -> array:
+    values = array(typecode)
+    values.frombytes(data[offset:offset + count * values.itemsize])
+    if len(values) != count:
+        raise RuntimeError("Compiled job is truncated")
+    return _little_endian(values)
@@ -0,0 +1,247 @@
+import json
+import os
+import threading
+import uuid
+
+from .job import CompiledJob
+from .midi_cache import MidiCache
+from .music_puncher import MusicPuncher
+
+QUEUED = 'queued'
+PUNCHING = 'punching'
+ERROR = 'error'
+
+INDEX_FILE = 'queue.json'
+
+
+class QueuedJob(object):
+    """A card in the queue: an uploaded MIDI file with its settings, or a compiled job if settings is None"""
+
+    def __init__(self, id: str, filename: str, data: bytes, settings=None, status: str = QUEUED, error: str = None):
+        self.id = id
+        self.filename = filename
+        self.data = data
+        self.settings = settings  # keyword arguments of MidiCache.prepare
+        self.status = status
+        self.error = error
+        self.job = None  # the compiled job, once compiled
+        self.cancelled = False
+        self.started = False  # punching started, cancelling stops the puncher
+        self.lock = threading.Lock()  # held while compiling
+
+    def data_file(self) -> str:
+        return f"{self.id}.mid" if self.settings is not None else f"{self.id}.mpjob"
+
+    def as_dict(self):
+        return {'id': self.id, 'filename': self.filename, 'status': self.status, 'error': self.error,
+                'compiled': self.job is not None}
+
+
+class JobQueue(object):
+    """
+    A persistent FIFO queue of cards, punched one after another by a single worker thread. A compiler thread parses
+    and compiles the next 'precompile' queued cards while a card is punching, so the next card starts right away.
+    The queue is stored in a directory, and survives a restart. After a card fails or is stopped, the queue pauses
+    until it is resumed.
+    """
+
+    def __init__(self, puncher: MusicPuncher, midi_cache: MidiCache, directory: str, precompile: int = 2):
+        self.puncher = puncher
+        self.midi_cache = midi_cache
+        self.directory = directory
+        self.precompile = precompile
+        self.entries = []  # in punching order, the punching card first
+        self.current = None  # the punching card
+        self.paused = False
+        self.version = 0  # changes with every change of the list, so clients only fetch the list when it changed
+        self.condition = threading.Condition()
+        self.__load()
+
+    def start(self):
+        threading.Thread(target=self.__work, daemon=True).start()
+        threading.Thread(target=self.__compile_ahead, daemon=True).start()
+
+    def add(self, filename: str, data: bytes, settings=None) -> QueuedJob:
+        """
+        Adds a card to the end of the queue. Raises TransposeError if the notes do not fit, or RuntimeError if a
+        compiled job does not fit the configuration.
+        """
+        entry = QueuedJob(uuid.uuid4().hex[:12], filename, data, settings)
+        if settings is None:
+            entry.job = CompiledJob.from_bytes(data)
+            entry.job.verify(self.puncher.fingerprint)
+        else:
+            self.midi_cache.prepare(data, **settings)  # fails early, and is cached for the compiler
+
+        with open(os.path.join(self.directory, entry.data_file()), 'wb') as file:
+            file.write(data)
+        with self.condition:
+            self.entries.append(entry)
+            self.__save()
+            self.__changed()
+        return entry
+
+    def list(self):
+        with self.condition:
+            return {'paused': self.paused, 'jobs': [entry.as_dict() for entry in self.entries]}
+
+    def move(self, id: str, position: int):
+        """Moves a waiting card to the given position in the queue, behind the punching card"""
+        with self.condition:
+            entry = self.__find(id)
+            if entry is self.current:
+                raise RuntimeError("Can not move the card that is punching")
+            self.entries.remove(entry)
+            first = 1 if self.current is not None else 0
+            self.entries.insert(min(max(position, first), len(self.entries)), entry)
+            self.__save()
+            self.__changed()
+
+    def cancel(self, id: str):
+        """Removes a waiting card, or stops the card that is punching"""
+        with self.condition:
+            entry = self.__find(id)
+            if entry is self.current:
+                entry.cancelled = True
+                if entry.started:
+                    self.puncher.stop()
+                return
+            self.__remove(entry)
+            self.__changed()
+
+    def resume(self):
+        with self.condition:
+            self.paused = False
+            self.__changed()
+
+    def join(self, timeout: float = None) -> bool:
+        """Waits until no card is punching or waiting to be punched, returns False on a timeout"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.current is None and (self.paused or self.__next() is None),
+                                           timeout)
+
+    def __changed(self):
+        """Wakes the waiting threads and the status stream, call while holding the condition"""
+        self.version += 1
+        self.condition.notify_all()
+        self.puncher.notifier.notify()
+
+    def __find(self, id: str) -> QueuedJob:
+        for entry in self.entries:
+            if entry.id == id:
+                return entry
+        raise KeyError(f"No job {id} in the queue")
+
+    def __next(self):
+        return next((entry for entry in self.entries if entry.status == QUEUED), None)
+
+    def __work(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: not self.paused and self.__next() is not None)
+                entry = self.__next()
+                entry.status = PUNCHING
+                self.current = entry
+                self.__save()
+                self.__changed()
+
+            try:
+                job = self.__compile(entry)
+            except Exception as e:
+                with self.condition:
+                    self.__fail(entry, e)
+                    self.current = None
+                    self.__changed()
+                continue
+
+            with self.condition:
+                # a cancel from now on stops the puncher, which keeps the stop when the run starts
+                entry.started = not entry.cancelled
+            try:
+                if entry.started:
+                    print(f"Punching {entry.filename}")
+                    self.puncher.run_job(job)
+            except Exception as e:
+                print(f"Failed to punch {entry.filename}: {repr(e)}")
+            with self.condition:
+                self.current = None
+                if entry.cancelled or self.puncher.error is not None:
+                    print(f"Pausing the queue: {self.puncher.error or 'cancelled'}")
+                    self.paused = True
+                self.__remove(entry)
+                self.__changed()
+
+    def __compile_ahead(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.__to_compile() is not None)
+                entry = self.__to_compile()
+            try:
+                self.__compile(entry)
+            except Exception as e:
+                with self.condition:
+                    self.__fail(entry, e)
+            with self.condition:
+                self.__changed()
+
+    def __to_compile(self):
+        waiting = [entry for entry in self.entries if entry.status == QUEUED][:self.precompile]
+        return next((entry for entry in waiting if entry.job is None and not entry.lock.locked()), None)
+
+    def __compile(self, entry: QueuedJob) -> CompiledJob:
+        with entry.lock:
+            if entry.job is None:
+                if entry.settings is None:
+                    job = CompiledJob.from_bytes(entry.data)
+                    job.verify(self.puncher.fingerprint)
+                else:
+                    notes = self.midi_cache.prepare(entry.data, **entry.settings)
+                    job = self.puncher.compile(notes, waveforms=True)
+                entry.job = job
+            return entry.job
+
+    def __fail(self, entry: QueuedJob, error: Exception):
+        print(f"Failed to compile {entry.filename}: {repr(error)}")
+        entry.status = ERROR
+        entry.error = str(error)
+        self.__save()
+
+    def __remove(self, entry: QueuedJob):
+        self.entries.remove(entry)
+        self.__save()
+        path = os.path.join(self.directory, entry.data_file())
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def __save(self):
+        index = [{'id': entry.id, 'filename': entry.filename, 'settings': entry.settings, 'status': entry.status,
+                  'error': entry.error} for entry in self.entries]
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(index, file)
+        os.replace(path + '.tmp', path)
+
+    def __load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.isfile(path):
+            return
+        with open(path) as file:
+            index = json.load(file)
+        for item in index:
+            entry = QueuedJob(item['id'], item['filename'], None, item['settings'], item['status'], item['error'])
+            path = os.path.join(self.directory, entry.data_file())
+            if not os.path.isfile(path):
+                print(f"Missing {path} of {entry.filename} in the queue")
+                entry.status = ERROR
+                entry.error = "The file of the job is missing, cancel it and add it again"
+                self.entries.append(entry)
+                continue
+            with open(path, 'rb') as file:
+                entry.data = file.read()
+            if entry.status == PUNCHING:
+                # never continue punching a card automatically after a restart
+                entry.status = ERROR
+                entry.error = "Interrupted by a restart, cancel it and add it again"
+            self.entries.append(entry)
+        print(f"Loaded {len(self.entries)} jobs from the queue in {self.directory}")
@@ -1,11 +1,50 @@
 import sys
-from typing import Set, Iterator, Dict
+from bisect import bisect_left
+from typing import Set, Iterator, Dict, List, NamedTuple
+
+from .lru import LRUCache
 
 
 class TransposeError(Exception):
     pass
 
 
+def note_mask(notes) -> int:
+    """Returns the notes as a bit mask, bit n is set for note n. Notes outside the MIDI range 0..127 are skipped."""
+    mask = 0
+    for note in notes:
+        if 0 <= note <= 127:
+            mask |= 1 << note
+    return mask
+
+
+def mask_notes(mask: int) -> Set[int]:
+    notes = set()
+    while mask:
+        low = mask & -mask
+        notes.add(low.bit_length() - 1)
+        mask ^= low
+    return notes
+
+
+def shift_mask(mask: int, shift: int) -> int:
+    return mask << shift if shift >= 0 else mask >> -shift
+
+
+class Transposition(NamedTuple):
+    """A candidate transposition and the notes that do not fit on the keyboard after transposing"""
+
+    transposition: int
+    unmapped_count: int
+    unmapped_mask: int  # bit mask of the unmapped notes, before transposing
+
+    def unmapped_notes(self) -> Set[int]:
+        return mask_notes(self.unmapped_mask)
+
+    def rank(self) -> int:
+        return self.unmapped_count * 100 + abs(self.transposition)
+
+
 class Keyboard(object):
     def __init__(self, keyboard: Iterator[int], reverse: bool = False):
         self.keyboard = list(keyboard)
@@ -13,6 +52,10 @@ class Keyboard(object):
             self.keyboard.reverse()
 
         self.indexed = {note: idx for idx, note in enumerate(self.keyboard)}
+        self.mask = note_mask(self.keyboard)
+        # the keys per pitch class, sorted by note
+        self.pitch_classes = [sorted(key for key in self.keyboard if key % 12 == pitch_class) for pitch_class in range(12)]
+        self.rankings = LRUCache(32)
 
     def size(self):
         return len(self.keyboard)
@@ -21,33 +64,45 @@ class Keyboard(object):
         """Returns the index of the note in the keyboard array"""
         return self.indexed[note]
 
-    def calculate_transposition(self, noteset: Set[int], best_effort=False) -> int:
-        minimum = min(self.keyboard) - min(noteset) - 12
-        maximum = max(self.keyboard) - max(noteset) + 12
+    def rank_transpositions(self, noteset: Set[int]) -> List[Transposition]:
+        """
+        Returns all transpositions from an octave below the lowest fit to an octave above the highest fit, best first:
+        the least unmapped notes and then the smallest transposition. The ranking is cached per note set. Notes
+        outside the MIDI range 0..127 are not ranked.
+        """
+        notes = note_mask(noteset)
+        lowest = (notes & -notes).bit_length() - 1 if notes else min(self.keyboard)
+        highest = notes.bit_length() - 1 if notes else max(self.keyboard)
+        return self.rankings.get_or_create(notes, lambda: self.__rank_transpositions(notes, lowest, highest))
 
+    def __rank_transpositions(self, notes: int, lowest: int, highest: int) -> List[Transposition]:
+        minimum = min(self.keyboard) - lowest - 12
+        maximum = max(self.keyboard) - highest + 12
         result = []
         for transposition in range(minimum, maximum + 1):
-            unmapped = self.__get_unmapped_notes(noteset, transposition)
-            result.append((transposition, unmapped))
-        result.sort(key=lambda tp: len(tp[1]) * 100 + abs(tp[0]))
+            # the keyboard shifted down, so the mapped notes are the notes in the (untransposed) mask
+            unmapped = notes & ~shift_mask(self.mask, -transposition)
+            result.append(Transposition(transposition, bin(unmapped).count('1'), unmapped))
+        result.sort(key=Transposition.rank)
+        return result
+
+    def calculate_transposition(self, noteset: Set[int], best_effort=False) -> int:
+        result = self.rank_transpositions(noteset)
 
-        if len(result) > 0 and len(result[0][1]) == 0:
-            return result[0][0]
+        if len(result) > 0 and result[0].unmapped_count == 0:
+            return result[0].transposition
 
         if best_effort:
-            return result[0][0]
+            return result[0].transposition
 
         raise TransposeError(
-            f"Cannot fit notes on keyboard. Try Autofit. Suggested transpositions: {[tp[0] for tp in result[:5]]}")
+            f"Cannot fit notes on keyboard. Try Autofit. Suggested transpositions: "
+            f"{[tp.transposition for tp in result[:5]]}")
 
     def calculate_adjustments(self, noteset: Set[int]) -> Dict[int, int]:
         adjustments = dict()
         for note in noteset:
-            adjustment = sys.maxsize
-            for key in self.keyboard:
-                diff = key - note
-                if diff % 12 == 0 and abs(diff) < abs(adjustment):
-                    adjustment = diff
+            adjustment = self.__nearest_octave(note)
             if adjustment == sys.maxsize:
                 print(f"Can not fit note {note} on the keyboard, skipping!")
                 adjustments[note] = sys.maxsize
@@ -55,8 +110,22 @@ class Keyboard(object):
                 adjustments[note] = note + adjustment
         return adjustments
 
-    def __get_unmapped_notes(self, notes, transposition: int) -> Set[int]:
-        return {note for note in notes if not (note + transposition) in self.indexed}
+    def __nearest_octave(self, note: int) -> int:
+        """
+        Returns the difference to the nearest key with the same pitch class, or sys.maxsize if there is none. Of two
+        keys at the same distance, the first one on the keyboard wins.
+        """
+        keys = self.pitch_classes[note % 12]
+        idx = bisect_left(keys, note)
+        candidates = keys[max(0, idx - 1):idx + 1]
+        if len(candidates) == 0:
+            return sys.maxsize
+        key = min(candidates, key=lambda key: (abs(key - note), self.indexed[key]))
+        return key - note
 
     def does_fit(self, notes) -> bool:
-        return len(self.__get_unmapped_notes(notes, 0)) == 0
+        """Returns whether all notes are on the keyboard, notes outside the MIDI range 0..127 never are"""
+        if any(note < 0 or note > 127 for note in notes):
+            return False
+        mask = note_mask(notes)
+        return mask & self.mask == mask
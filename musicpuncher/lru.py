@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+from time import time
+
+
+class LRUCache(object):
+    """A bounded cache that evicts the least recently used entry, with hit/miss/eviction counters"""
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.build_time = 0.0  # seconds spent creating the missing entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_create(self, key, factory):
+        """Returns the cached value for key, or creates, caches and returns it by calling factory()"""
+        marker = self.entries  # never a cached value
+        value = self.get(key, marker)
+        if value is marker:
+            start = time()
+            value = factory()
+            self.build_time += time() - start
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        saved_time = self.hits * self.build_time / self.misses if self.misses > 0 else 0.0
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups > 0 else 0.0,
+            'build_time': self.build_time,
+            'saved_time': saved_time,  # estimated from the average build time of a miss
+        }
@@ -0,0 +1,92 @@
+from time import perf_counter
+
+from .stats import Histogram
+
+
+class Metrics(object):
+    """
+    Counters and duration histograms of the phases of punching a card, by name. Timers measure the host time with
+    perf_counter, other durations (like sleeps) are observed as they are.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.durations = {}
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        histogram = self.durations.get(name)
+        if histogram is None:
+            histogram = self.durations[name] = Histogram()
+        histogram.add(seconds)
+
+    def timer(self, name: str):
+        """Returns a context manager that observes the time spent in its block"""
+        return _Timer(self, name)
+
+    def as_dict(self):
+        return {'enabled': True, 'counters': dict(self.counters),
+                'durations': {name: histogram.as_dict() for name, histogram in list(self.durations.items())}}
+
+    def summary(self) -> str:
+        lines = [f"  {name}: {value}" for name, value in sorted(self.counters.items())]
+        lines += [f"  {name}: {histogram}" for name, histogram in sorted(self.durations.items())]
+        return "Metrics:\n" + "\n".join(lines)
+
+
+class NullMetrics(Metrics):
+    """Metrics that are disabled: every call does nothing"""
+
+    enabled = False
+
+    def count(self, name: str, value: int = 1):
+        pass
+
+    def observe(self, name: str, seconds: float):
+        pass
+
+    def timer(self, name: str):
+        return _NULL_TIMER
+
+    def as_dict(self):
+        return {'enabled': False}
+
+    def summary(self) -> str:
+        return "Metrics are disabled"
+
+
+class _Timer(object):
+    __slots__ = ['metrics', 'name', 'start']
+
+    def __init__(self, metrics: Metrics, name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, perf_counter() - self.start)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+NULL_METRICS = NullMetrics()
+
+
+def create_metrics(enabled: bool) -> Metrics:
+    return Metrics() if enabled else NULL_METRICS
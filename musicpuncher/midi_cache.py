@@ -0,0 +1,52 @@
+import hashlib
+from typing import Set, Tuple
+
+from .keyboard import Keyboard, TransposeError
+from .lru import LRUCache
+from .music import NoteArray, iter_midi
+
+
+class MidiCache(object):
+    """
+    Caches uploaded MIDI files by the SHA-256 of their bytes: the parsed notes with their note set, and the final
+    consolidated notes per (hash, transposition, autofit). Re-testing the same file with other settings only redoes
+    the stages that changed, and repeating a request redoes nothing.
+    """
+
+    def __init__(self, keyboard: Keyboard, maxsize: int = 16):
+        self.keyboard = keyboard
+        self.parsed = LRUCache(maxsize)
+        self.results = LRUCache(4 * maxsize)
+
+    def prepare(self, data: bytes, transposition: int = 0, autotranspose: bool = False,
+                autofit: bool = False) -> NoteArray:
+        """
+        Returns the notes to punch for the MIDI file. Raises TransposeError if the notes do not fit on the keyboard
+        and autofit is off.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        notes, noteset = self.parsed.get_or_create(digest, lambda: self.__parse(data))
+
+        if autotranspose:
+            transposition = self.keyboard.calculate_transposition(noteset, best_effort=autofit)
+        transposed_set = {note + transposition for note in noteset}
+        if not autofit and not self.keyboard.does_fit(transposed_set):
+            raise TransposeError('Notes do not fit on the keyboard, try autofit')
+
+        key = (digest, transposition, autofit)
+        return self.results.get_or_create(key, lambda: self.__finish(notes, transposed_set, transposition, autofit))
+
+    def __parse(self, data: bytes) -> Tuple[NoteArray, Set[int]]:
+        notes = NoteArray.of(iter_midi(data=data))
+        return notes, notes.note_set()
+
+    def __finish(self, notes: NoteArray, noteset: Set[int], transposition: int, autofit: bool) -> NoteArray:
+        notes = notes.transposed(transposition)
+        if autofit:
+            adjustmentDict = self.keyboard.calculate_adjustments(noteset)
+            print(f"Adjustments: {adjustmentDict}")
+            notes = notes.adjusted(adjustmentDict)
+        return notes.consolidated()
+
+    def stats(self):
+        return {'parsed': self.parsed.stats(), 'results': self.results.stats()}
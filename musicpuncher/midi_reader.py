@@ -0,0 +1,121 @@
+import heapq
+import struct
+from typing import Iterator, Optional, Tuple
+
+DEFAULT_TEMPO = 500000  # microseconds per beat
+
+# Number of data bytes of the channel and system messages, by status (high nibble for channel messages)
+CHANNEL_DATA_BYTES = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+SYSTEM_DATA_BYTES = {0xF1: 1, 0xF2: 2, 0xF3: 1}
+
+MidiEvent = Tuple[float, Optional[int], int]  # (delta time in seconds, note or None, velocity)
+
+
+def read_midi_events(data: bytes) -> Iterator[MidiEvent]:
+    """
+    Yields the messages of a midi file in playback order, the same way as iterating a mido.MidiFile, but decoded lazily
+    from the raw bytes instead of loading all messages. Only note on messages are decoded, all other messages are
+    yielded with note None. End of track messages are skipped, except for the last one.
+    """
+    format, ticks_per_beat, tracks = __read_header(data)
+    if format == 2:
+        raise RuntimeError("Midi files of type 2 (asynchronous tracks) are not supported")
+
+    last_tick = 0
+    end_tick = 0
+    tempo = DEFAULT_TEMPO
+    for tick, _, tempo_change, note, velocity in heapq.merge(*tracks):
+        if note == -1:  # end of track
+            end_tick = max(end_tick, tick)
+            continue
+        delta = (tick - last_tick) * (tempo * 1e-6 / ticks_per_beat) if tick > last_tick else 0
+        last_tick = tick
+        yield delta, note, velocity
+        if tempo_change is not None:
+            tempo = tempo_change
+    yield ((end_tick - last_tick) * (tempo * 1e-6 / ticks_per_beat) if end_tick > last_tick else 0), None, 0
+
+
+def __read_header(data: bytes):
+    if data[:4] != b'MThd':
+        raise ValueError("MThd chunk not found, not a midi file")
+    if len(data) < 14:
+        raise ValueError("Truncated MThd chunk")
+    length, format, count, ticks_per_beat = struct.unpack_from('>IHHH', data, 4)
+    offset = 8 + length
+    tracks = []
+    while len(tracks) < count:
+        if offset + 8 > len(data):
+            raise ValueError(f"MTrk chunk {len(tracks)} not found, the file has {len(tracks)} of {count} tracks")
+        name = data[offset:offset + 4]
+        length = struct.unpack_from('>I', data, offset + 4)[0]
+        if offset + 8 + length > len(data):
+            raise ValueError(f"Truncated {name.decode('latin-1')} chunk {len(tracks)}: {length} bytes declared, "
+                             f"{len(data) - offset - 8} left in the file")
+        if name == b'MTrk':
+            tracks.append(__read_track(data, offset + 8, offset + 8 + length, len(tracks)))
+        offset += 8 + length
+    return format, ticks_per_beat, tracks
+
+
+def __read_variable_int(data: bytes, offset: int) -> Tuple[int, int]:
+    value = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, offset
+
+
+def __read_track(data: bytes, offset: int, end: int, track: int):
+    """
+    Yields (absolute tick, order, tempo change, note, velocity) per message. The order keeps messages with the same tick
+    in track order when the tracks are merged. Note is -1 for end of track messages.
+    """
+    tick = 0
+    order = track << 32
+    status = None  # running status
+    try:
+        while offset < end:
+            delta, offset = __read_variable_int(data, offset)
+            tick += delta
+            order += 1
+            byte = data[offset]
+            if byte < 0x80:
+                if status is None:
+                    raise ValueError(f"Running status without last status in MTrk chunk {track}")
+                byte = status
+            else:
+                offset += 1
+                if byte != 0xFF:
+                    status = byte
+
+            if byte == 0xFF:
+                kind = data[offset]
+                length, offset = __read_variable_int(data, offset + 1)
+                if kind == 0x2F:
+                    yield tick, order, None, -1, 0
+                elif kind == 0x51:
+                    yield tick, order, (data[offset] << 16) | (data[offset + 1] << 8) | data[offset + 2], None, 0
+                else:
+                    yield tick, order, None, None, 0
+                offset += length
+            elif byte == 0xF0 or byte == 0xF7:
+                length, offset = __read_variable_int(data, offset)
+                offset += length
+                yield tick, order, None, None, 0
+            elif byte >= 0xF0:
+                offset += SYSTEM_DATA_BYTES.get(byte, 0)
+                yield tick, order, None, None, 0
+            else:
+                kind = byte & 0xF0
+                if kind == 0x90:
+                    yield tick, order, None, data[offset], data[offset + 1]
+                else:
+                    yield tick, order, None, None, 0
+                offset += CHANNEL_DATA_BYTES[kind]
+    except IndexError:
+        raise ValueError(f"Truncated message in MTrk chunk {track}")
+    if offset > end:
+        raise ValueError(f"Truncated message at the end of MTrk chunk {track}")
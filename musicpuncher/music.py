@@ -1,12 +1,15 @@
 import re
 import sys
+from array import array
 from collections import deque
+from itertools import compress, islice
 from types import SimpleNamespace
-from typing import List, Set, Dict, Iterable
+from typing import Callable, List, Set, Dict, Iterable, Iterator
 
 from mido import MidiFile, MidiTrack, Message, second2tick, MetaMessage
 
 from .keyboard import Keyboard
+from .midi_reader import read_midi_events
 
 MIN_VELOCITY = 20  # PPP
 
@@ -31,43 +34,183 @@ class DelayNotes(object):
 NoteSequence = List[DelayNotes]
 
 
-def get_notes(notes: NoteSequence) -> Set[int]:
+class NoteArray(object):
+    """
+    A compact, columnar note sequence: an array of delays, and the notes of all events packed in one array with the
+    notes of event i at notes[offsets[i]:offsets[i + 1]], sorted ascending. Iterating, indexing and comparing behave
+    like a list of DelayNotes. get_notes, apply_transposition, autofit and consolidate work on the arrays directly.
+    """
+
+    __slots__ = ['delays', 'offsets', 'notes']
+
+    def __init__(self, delays: array, offsets: array, notes: array):
+        self.delays = delays
+        self.offsets = offsets
+        self.notes = notes
+
+    @staticmethod
+    def of(noteseq: Iterable[DelayNotes]) -> 'NoteArray':
+        """Packs any note sequence, including a NoteStream, into a NoteArray"""
+        delays = array('d')
+        offsets = array('I', [0])
+        notes = array('h')
+        for delayNotes in noteseq:
+            delays.append(delayNotes.delay)
+            notes.extend(delayNotes.notes)
+            offsets.append(len(notes))
+        return NoteArray(delays, offsets, notes)
+
+    def __len__(self):
+        return len(self.delays)
+
+    def __iter__(self) -> Iterator[DelayNotes]:
+        notes = self.notes
+        offsets = self.offsets
+        for idx, delay in enumerate(self.delays):
+            yield DelayNotes(delay, notes[offsets[idx]:offsets[idx + 1]])
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                return NoteArray.of(self[idx] for idx in range(start, stop, step))
+            stop = max(start, stop)
+            base = self.offsets[start]
+            offsets = array('I', [offset - base for offset in self.offsets[start:stop + 1]])
+            return NoteArray(self.delays[start:stop], offsets, self.notes[base:self.offsets[stop]])
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("NoteArray index out of range")
+        return DelayNotes(self.delays[item], self.notes[self.offsets[item]:self.offsets[item + 1]])
+
+    def __eq__(self, other):
+        if isinstance(other, NoteArray):
+            return self.delays == other.delays and self.offsets == other.offsets and self.notes == other.notes
+        if isinstance(other, list):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f"NoteArray({list(self)})"
+
+    def note_set(self) -> Set[int]:
+        return set(self.notes)
+
+    def transposed(self, transposition: int) -> 'NoteArray':
+        return NoteArray(self.delays, self.offsets, array('h', map(transposition.__add__, self.notes)))
+
+    def adjusted(self, adjustmentDict: Dict[int, int]) -> 'NoteArray':
+        """Maps every note through the adjustments, notes mapped to sys.maxsize are removed"""
+        present = sorted(set(self.notes))
+        mapping = {note: adjustmentDict.get(note, note) for note in present}
+        mapped = [mapping[note] for note in present]
+        if sys.maxsize not in mapped and all(a < b for a, b in zip(mapped, mapped[1:])):
+            # the mapping keeps the notes of every event unique and sorted, so it can be applied in bulk
+            return NoteArray(self.delays, self.offsets, array('h', map(mapping.__getitem__, self.notes)))
+
+        # Only the events with an adjusted note need to be mapped, sorted and deduplicated again
+        changed = {note for note in present if mapping[note] != note}
+        old = self.offsets
+        source = self.notes
+        notes = array('h')
+        extend = notes.extend
+        ends = []
+        start = 0
+        for end in old[1:]:
+            chord = source[start:end]
+            if changed.isdisjoint(chord):
+                extend(chord)
+            else:
+                chord = {mapping[note] for note in chord}
+                chord.discard(sys.maxsize)
+                extend(sorted(chord))
+            ends.append(len(notes))
+            start = end
+        offsets = array('I', [0])
+        offsets.extend(ends)
+        return NoteArray(self.delays, offsets, notes)
+
+    def consolidated(self) -> 'NoteArray':
+        """Adds the delay of every event without notes to the next event"""
+        offsets = self.offsets
+        keep = [offsets[idx + 1] > offsets[idx] for idx in range(len(self.delays))]
+        if all(keep):
+            return self
+        delays = array('d')
+        increment = 0
+        for delay, kept in zip(self.delays, keep):
+            if kept:
+                delays.append(delay + increment)
+                increment = 0
+            else:
+                increment += delay
+        new_offsets = array('I', [0])
+        new_offsets.extend(compress(offsets[1:], keep))
+        return NoteArray(delays, new_offsets, self.notes)
+
+
+def get_notes(notes: Iterable[DelayNotes]) -> Set[int]:
+    if isinstance(notes, NoteArray):
+        return notes.note_set()
     noteset = set()
     for tuple in notes:
         noteset.update(tuple.notes)
     return noteset
 
 
+def minimum_same_pitch_delta(notes: Iterable[DelayNotes]) -> float:
+    """Returns the shortest time in seconds between two notes of the same pitch, or sys.maxsize if there is none"""
+    last_timestamp_per_tone = {}
+    time = 0
+    minimum_delta = sys.maxsize
+    for delay_notes in notes:
+        time += delay_notes.delay
+        for note in delay_notes.notes:
+            if note in last_timestamp_per_tone:
+                minimum_delta = min(time - last_timestamp_per_tone[note], minimum_delta)
+            last_timestamp_per_tone[note] = time
+    return minimum_delta
+
+
 def parse_midi(filename: str = None, file=None) -> NoteSequence:
     """Returns a list of (timedelta, notelist) tuples"""
-    notes = []
-    with MidiFile(filename=filename, file=file) as mid:
-        notes_on = set()
-        delta = 0
-        for msg in mid:
-            # print(f"{msg.type}: {msg}")
-            # if (msg.type == 'note_on' or msg.type == 'note_off' or msg.type == 'time_signature') and msg.time != 0:
-            if msg.time != 0:
-                if len(notes_on) > 0:
-                    notes.append(DelayNotes(delta, list(notes_on)))
-                    delta = 0
-                delta += msg.time
-                notes_on.clear()
-            if msg.type == 'note_on' and msg.velocity >= MIN_VELOCITY:
-                notes_on.add(msg.note)
-    return notes
-
-
-def print_notes(noteseq: NoteSequence):
-    for notes in noteseq[:4]:
+    return list(iter_midi(filename=filename, file=file))
+
+
+def read_midi_data(filename: str = None, file=None, data: bytes = None) -> bytes:
+    """Returns the raw bytes of a midi file, given as a filename, a file or the bytes themselves"""
+    if data is not None:
+        return data
+    if file is not None:
+        return file.read()
+    with open(filename, 'rb') as midi_file:
+        return midi_file.read()
+
+
+def iter_midi(filename: str = None, file=None, data: bytes = None) -> Iterator[DelayNotes]:
+    """Yields the notes of a midi file while reading it. Only the raw bytes of the file are kept in memory."""
+    notes_on = set()
+    delta = 0
+    for time, note, velocity in read_midi_events(read_midi_data(filename, file, data)):
+        if time != 0:
+            if len(notes_on) > 0:
+                yield DelayNotes(delta, notes_on)
+                delta = 0
+            delta += time
+            notes_on.clear()
+        if note is not None and velocity >= MIN_VELOCITY:
+            notes_on.add(note)
+
+
+def print_notes(noteseq: Iterable[DelayNotes]):
+    for notes in islice(noteseq, 4):
         print(f"{notes.delay:0.4f}: {notes.notes}")
 
 
-def __parseAdjustments(adjustments: str) -> Dict[int, int]:
+def _parse_adjustments(adjustments: str) -> Dict[int, int]:
     adjustmentDict = dict()
-    if adjustments == '':
-        return adjustmentDict
-    splitted = adjustments.split(',')
+    splitted = adjustments.split(',') if adjustments != '' else []
     for split in splitted:
         matchObj = re.match(r'(\d+)([+]+|[-]+)', split)
         if matchObj:
@@ -82,13 +225,11 @@ def __parseAdjustments(adjustments: str) -> Dict[int, int]:
             adjustmentDict[note] = adjusted
         else:
             raise RuntimeError(f"Illegal adjustment specification: {adjustments}")
+    print(f"Adjustments: {adjustmentDict}")
     return adjustmentDict
 
 
-def __apply_adjustments(noteseq: NoteSequence, adjustmentDict: Dict[int, int]) -> NoteSequence:
-    print(f"Adjustments: {adjustmentDict}")
-
-    result = []
+def iter_adjusted(noteseq: Iterable[DelayNotes], adjustmentDict: Dict[int, int]) -> Iterator[DelayNotes]:
     for delayNotes in noteseq:
         newnotes = set()
         for note in delayNotes.notes:
@@ -97,52 +238,117 @@ def __apply_adjustments(noteseq: NoteSequence, adjustmentDict: Dict[int, int]) -
                     newnotes.add(adjustmentDict[note])
             else:
                 newnotes.add(note)
-        delayNotes.notes = newnotes
-        result.append(DelayNotes(delayNotes.delay, newnotes))
-    return result
+        yield DelayNotes(delayNotes.delay, newnotes)
 
 
-def apply_transposition(noteseq: NoteSequence, transposition: int) -> NoteSequence:
-    result = []
+def iter_transposed(noteseq: Iterable[DelayNotes], transposition: int) -> Iterator[DelayNotes]:
     for delayNotes in noteseq:
-        newnotes = set()
-        for note in delayNotes.notes:
-            newnotes.add(note + transposition)
-        result.append(DelayNotes(delayNotes.delay, newnotes))
-    return result
+        yield DelayNotes(delayNotes.delay, [note + transposition for note in delayNotes.notes])
 
 
-def consolidate(noteseq: NoteSequence) -> NoteSequence:
-    result = []
+def iter_consolidated(noteseq: Iterable[DelayNotes]) -> Iterator[DelayNotes]:
     increment = 0
-    for idx, delayNotes in enumerate(noteseq):
+    for delayNotes in noteseq:
         if len(delayNotes.notes) == 0:
             increment += delayNotes.delay
         else:
             newNotes = DelayNotes(delayNotes.delay + increment, delayNotes.notes)
             increment = 0
-            result.append(newNotes)
-    return result
+            yield newNotes
+
+
+def __apply_adjustments(noteseq: NoteSequence, adjustmentDict: Dict[int, int]) -> NoteSequence:
+    if isinstance(noteseq, NoteArray):
+        return noteseq.adjusted(adjustmentDict)
+    return list(iter_adjusted(noteseq, adjustmentDict))
+
+
+def apply_transposition(noteseq: NoteSequence, transposition: int) -> NoteSequence:
+    if isinstance(noteseq, NoteArray):
+        return noteseq.transposed(transposition)
+    return list(iter_transposed(noteseq, transposition))
+
+
+def consolidate(noteseq: NoteSequence) -> NoteSequence:
+    if isinstance(noteseq, NoteArray):
+        return noteseq.consolidated()
+    return list(iter_consolidated(noteseq))
 
 
 def adjust(noteseq: NoteSequence, adjustments: str) -> NoteSequence:
-    adjustmentDict = __parseAdjustments(adjustments)
+    adjustmentDict = _parse_adjustments(adjustments)
     return __apply_adjustments(noteseq, adjustmentDict)
 
 
 def autotranspose(noteseq: NoteSequence, keyboard: Keyboard, best_effort = False) -> NoteSequence:
+    return apply_transposition(noteseq, _calculate_transposition(noteseq, keyboard, best_effort))
+
+
+def autofit(noteseq: NoteSequence, keyboard: Keyboard) -> NoteSequence:
+    return __apply_adjustments(noteseq, _calculate_adjustments(noteseq, keyboard))
+
+
+def _calculate_transposition(noteseq: Iterable[DelayNotes], keyboard: Keyboard, best_effort: bool) -> int:
     noteset = get_notes(noteseq)
     transposition = keyboard.calculate_transposition(noteset, best_effort=best_effort)
     print(f"Calculated transposition: {transposition}")
-    return apply_transposition(noteseq, transposition)
+    return transposition
 
 
-def autofit(noteseq: NoteSequence, keyboard: Keyboard) -> NoteSequence:
+def _calculate_adjustments(noteseq: Iterable[DelayNotes], keyboard: Keyboard) -> Dict[int, int]:
     noteset = get_notes(noteseq)
     print(f"Notes: {sorted(noteset)}")
+    adjustmentDict = keyboard.calculate_adjustments(noteset)
+    print(f"Adjustments: {adjustmentDict}")
+    return adjustmentDict
+
+
+class NoteStream(object):
+    """
+    A note sequence that runs its stages lazily. Only the last stage keeps its result: its first iteration packs the
+    notes into a NoteArray, which the next iterations reuse. Earlier stages keep nothing but the raw MIDI bytes, so
+    their notes can be garbage-collected while they stream. Stages that need a global view (like the note set for a
+    transposition) do a pre-scan pass over the stream when they are added.
+    """
+
+    def __init__(self, source: Callable[[], Iterator[DelayNotes]]):
+        self.source = source
+        self.notes = None  # the packed notes, after the first iteration
+
+    @staticmethod
+    def midi(filename: str = None, file=None, data: bytes = None) -> 'NoteStream':
+        data = read_midi_data(filename, file, data)
+        return NoteStream(lambda: iter_midi(data=data))
+
+    def __iter__(self) -> Iterator[DelayNotes]:
+        if self.notes is None:
+            self.notes = NoteArray.of(self.source())
+        return iter(self.notes)
+
+    def __stream(self) -> Iterator[DelayNotes]:
+        """Runs the stages again without packing the result, unless the notes were packed already"""
+        return iter(self.notes) if self.notes is not None else self.source()
+
+    def then(self, stage: Callable[[Iterable[DelayNotes]], Iterator[DelayNotes]]) -> 'NoteStream':
+        """Returns a new stream that applies the stage to this stream"""
+        return NoteStream(lambda: stage(self.__stream()))
+
+    def adjust(self, adjustments: str) -> 'NoteStream':
+        adjustmentDict = _parse_adjustments(adjustments)
+        return self.then(lambda notes: iter_adjusted(notes, adjustmentDict))
+
+    def transpose(self, transposition: int) -> 'NoteStream':
+        return self.then(lambda notes: iter_transposed(notes, transposition))
+
+    def autotranspose(self, keyboard: Keyboard, best_effort=False) -> 'NoteStream':
+        return self.transpose(_calculate_transposition(self.__stream(), keyboard, best_effort))
+
+    def autofit(self, keyboard: Keyboard) -> 'NoteStream':
+        adjustmentDict = _calculate_adjustments(self.__stream(), keyboard)
+        return self.then(lambda notes: iter_adjusted(notes, adjustmentDict))
 
-    adjustments = keyboard.calculate_adjustments(noteset)
-    return __apply_adjustments(noteseq, adjustments)
+    def consolidate(self) -> 'NoteStream':
+        return self.then(iter_consolidated)
 
 
 def write_midi(noteseq: NoteSequence, filename: str = None, file=None):
@@ -1,32 +1,65 @@
 import math
+import sys
+from bisect import bisect_left
+import threading
+from array import array
+from collections import deque
 from enum import auto, Enum
-from time import sleep, time
-from typing import List
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
 import pigpio
 
+from .clock import Clock, SYSTEM_CLOCK
+from .job import CompiledJob, config_fingerprint
 from .keyboard import Keyboard
-from .music import NoteSequence
-
+from .lru import LRUCache
+from .metrics import Metrics, NULL_METRICS, create_metrics
+from .music import DelayNotes, minimum_same_pitch_delta
+from .planner import Chord, Step, chord_steps, create_planner, nearest_end_first
+from .progress import Estimate, ProgressModel
+from .stats import BufferStats, DurationStats
+from .status_stream import StatusNotifier
+from .step_stream import Prefetcher, StepStream
+from .tracer import LOOKAHEAD, NULL_TRACER, PLANNER, WAVES, Tracer, create_tracer
+from .waveform import ArrayWaveform, ChainPlan, chain_length, create_array_waveform, create_chain_plan, move_length, \
+    ramp_times, PULSES_PER_PART
+
+MAX_WAVES = 250  # PI_MAX_WAVES of pigpio
+CBS_PER_PULSE = 2  # control blocks that pigpio uses per pulse, to estimate the size of a chain before it is added
+SLOT_PERCENT = 50  # size of a padded wave, in percent of the wave memory: one slot sends while the other is created
 
 class MusicPuncher(object):
-    def __init__(self, config, keyboard: Keyboard):
-        pigpio_config = config['pigpio']
-        self.pi = pigpio.pi(pigpio_config['host'], pigpio_config['port'])
-        if not self.pi.connected:
-            raise RuntimeError(
-                f"PI Not connected, make sure the pi is available on {pigpio_config['host']} and is running pigpiod on port {pigpio_config['port']}")
+    def __init__(self, config, keyboard: Keyboard, pi: pigpio.pi = None, clock: Clock = SYSTEM_CLOCK):
+        """Connects to pigpiod as configured, unless another pi (like a simulator) is given"""
+        if pi is None:
+            pigpio_config = config['pigpio']
+            pi = pigpio.pi(pigpio_config['host'], pigpio_config['port'])
+            if not pi.connected:
+                raise RuntimeError(
+                    f"PI Not connected, make sure the pi is available on {pigpio_config['host']} and is running pigpiod on port {pigpio_config['port']}")
+        self.pi = pi
+        self.clock = clock
 
         self.keyboard = keyboard
-
-        feed_stepper = PiGPIOStepperMotor(self.pi, config['feed-stepper'])
-        tone_stepper = PiGPIOStepperMotor(self.pi, config['tone-stepper'])
-        self.steppers = Steppers(self.pi, [feed_stepper, tone_stepper])
+        self.metrics = create_metrics(config.get('metrics', False))
+        self.tracer = create_tracer(config.get('trace'), clock)
+
+        cache_size = config.get('waveform-cache-size', 256)
+        engine = config.get('waveform-engine', 'pulses')
+        feed_stepper = PiGPIOStepperMotor(self.pi, config['feed-stepper'], cache_size, engine, clock)
+        tone_stepper = PiGPIOStepperMotor(self.pi, config['tone-stepper'], cache_size, engine, clock)
+        completion = WaveCompletion(config.get('wave-completion'), clock, self.metrics)
+        self.steppers = Steppers(self.pi, [feed_stepper, tone_stepper], cache_size, completion,
+                                 config.get('chain-pulses', 5000), clock, self.metrics, self.tracer,
+                                 config.get('packed-pulses', False))
 
         self.zero_button = Button(self.pi, config['zero-button']) if 'zero-button' in config else None
         self.status_led = StatusLed(self.pi, config['status-led']) if 'status-led' in config else DummyStatusLed()
-        self.puncher = Puncher(self.pi, config['puncher'])
-        self.cutter = Cutter(self.pi, config['cutter'])
+        self.puncher = Puncher(self.pi, config['puncher'], clock, self.metrics, self.tracer)
+        self.cutter = Cutter(self.pi, config['cutter'], clock, self.metrics, self.tracer)
+        if self.cutter.hardware_timed and not self.puncher.hardware_timed:
+            # the cut would be in the wave of the move, before the punch after the wave
+            raise RuntimeError("The cutter can only be hardware-timed if the puncher is hardware-timed too")
 
         self.idle_position = config['idle-position']
         self.row0 = config['row0']
@@ -35,18 +68,35 @@ class MusicPuncher(object):
         self.minimal_feed = config['minimal-feed']
         self.cutter_position = config['cutter-position']
         self.end_feed = config['end-feed']
+        self.planner = create_planner(config.get('planner'))
+        self.step_buffer = config.get('step-buffer', 256)
+        self.waveform_lookahead = config.get('waveform-lookahead', 8)
+        self.lookahead_stats = BufferStats()
+        self.fingerprint = config_fingerprint(config, keyboard)
+        self.compile_lock = threading.Lock()  # the planner plans one card at a time
         self.position = None
         self.error = None
 
         self.active = False
         self.progress = 0.0
+        self.step = 0  # index of the current step of the card
+        self.steps = 0
+        self.progress_model = None  # of the card that is punching
         self.stopRequested = False
+        self.notifier = StatusNotifier()  # notified on every change of the status
 
     def status(self):
-        return {'active': self.active, 'progress': self.progress, 'error': self.error}
+        """The progress, and the elapsed and remaining time in seconds while a card is punching"""
+        model = self.progress_model
+        punching = self.active and model is not None
+        return {'active': self.active, 'progress': model.progress() if punching else self.progress,
+                'error': self.error, 'step': self.step, 'steps': self.steps,
+                'elapsed': round(model.elapsed(), 1) if punching else None,
+                'remaining': round(model.remaining(), 1) if punching else None}
 
     def clearError(self):
         self.error = None
+        self.notifier.notify()
 
     def on(self):
         print(f"Switching the music puncher ON")
@@ -54,8 +104,14 @@ class MusicPuncher(object):
         self.steppers.on()
         self.active = True
         self.progress = 0.0
-        self.stopRequested = False
+        self.step = 0
+        self.steps = 0
+        self.progress_model = None
         self.error = None
+        self.metrics.reset()
+        self.tracer.reset()
+        self.lookahead_stats = BufferStats()
+        self.notifier.notify()
 
     def off(self, reset=False):
         if reset:
@@ -67,6 +123,7 @@ class MusicPuncher(object):
         self.active = False
         self.progress = 0.0
         self.stopRequested = False
+        self.notifier.notify()
 
         print(f"Switching the music puncher OFF")
         try:
@@ -98,53 +155,168 @@ class MusicPuncher(object):
         self.off()
 
     def stop(self):
+        """Stops the card that is punching, or that is starting: the request is kept until the puncher is off"""
         self.stopRequested = True
 
-    def run(self, notesequence: NoteSequence, ):
+    def run(self, notesequence: Iterable[DelayNotes]):
+        """
+        Punches the notes. The notes are iterated more than once, so they can be a list or a NoteStream. Punching
+        starts as soon as the first steps are planned, the rest is planned while punching.
+        """
+        self.__run(lambda: self.__stream_steps(notesequence))
+
+    def run_job(self, job: CompiledJob):
+        """Punches a compiled job, which must be compiled with the same configuration"""
+        self.__run(lambda: self.__load_job(job))
+
+    def __load_job(self, job: CompiledJob):
+        job.verify(self.fingerprint)
+        self.steppers.preload(job.waveforms)
+        return job.steps
+
+    def __run(self, calculate_steps):
         self.on()
         try:
-            self.reset()
+            with self.tracer.span('reset'):
+                self.reset()
 
-            steps = self.__calculate_all_steps(notesequence)
+            with self.tracer.span('calculate steps'):
+                steps = calculate_steps()
             self.do_run(steps)
+            print(f"Waveform cache: {self.steppers.cache_stats()}")
+            print(f"Gaps between waves: {self.steppers.gap_stats()}")
+            print(f"Wave completion: {self.steppers.completion.stats()}")
+            print(f"Waveform lookahead: {self.lookahead_stats}")
+            print(f"Machine time: {self.progress_model}")
             self.off()
         except Exception as e:
             self.error = str(e)
             self.off()
             raise
+        finally:
+            self.tracer.save()
 
-    def __calculate_all_steps(self, notesequence: NoteSequence):
-        """returns a list of tuples with (delay, note) steps for each hole"""
+    def compile(self, notesequence: Iterable[DelayNotes], waveforms: bool = False) -> CompiledJob:
+        """
+        Plans the notes into a job that can be saved and punched again later with run_job. Optionally includes the
+        synchronized waveforms of all moves that are not sent as a chain. Compiling records no metrics, so compiling
+        the next card does not count in the metrics of the card that is punching.
+        """
         feed_steps = self.__calculate_feed_steps(notesequence)
-        position = self.position
-        steps = []
+        with self.compile_lock:
+            # the carriage always starts a card at the idle position
+            steps = list(self.planner.plan(self.idle_position, self.__chords(notesequence, feed_steps)))
+            print(f"Planned steps, {self.planner.stats}")
+        synchronized = {}
+        if waveforms:
+            for step in steps:
+                if step not in synchronized and not self.steppers.is_chained(step):
+                    synchronized[step] = self.steppers.synchronized_waveforms(step, NULL_METRICS)
+        return CompiledJob(self.fingerprint, feed_steps, steps, synchronized)
+
+    def __stream_steps(self, notesequence: Iterable[DelayNotes]) -> StepStream:
+        feed_steps = self.__calculate_feed_steps(notesequence)
+        # a cheap pre-pass over the chords for the totals and a first estimate of the machine time, the planner only
+        # changes the order of the holes within a chord
+        progress = ProgressModel(self.__estimate_chords(self.__chords(notesequence, feed_steps)), self.clock)
+
+        def plan():
+            with self.compile_lock:
+                start = self.clock.time()
+                # the carriage always starts a card at the idle position
+                chords = self.planner.plan_chords(self.idle_position, self.__chords(notesequence, feed_steps))
+                steps = self.__chord_ends(chords, progress)
+                for step, _, time in self.__step_times(steps, progress.estimate.total_feed):
+                    progress.planned(time)
+                    yield step
+                self.tracer.add('plan', start, self.clock.time(), PLANNER)
+                print(f"Planned steps, {self.planner.stats}")
+
+        return StepStream(plan, progress, self.step_buffer)
+
+    def __chord_ends(self, chords: Iterable[List[Step]], progress: ProgressModel) -> Iterator[Step]:
+        """Yields the steps of the planned chords, and marks a chord as planned once its last step is planned"""
+        for steps in chords:
+            yield from steps
+            progress.chord_planned()
+
+    def __estimate_chords(self, chords: Iterable[Chord]) -> Estimate:
+        """
+        Predicts the machine time per chord without planning it: the feed to the chord, and moves of equal length
+        over the chord to the other holes, each followed by a punch. The cut is added to the chord that is cut. The
+        steps are counted like the greedy planner plans them, the planner corrects the count.
+        """
+        times = array('d')
+        holes = array('I')
+        feeds = array('q')  # cumulative feed steps
+        total_feed = 0
+        position = self.idle_position
+        for chord in chords:
+            count = len(chord.positions)
+            time = self.__step_time((chord.delay, 0))
+            if count > 1:
+                span = chord.positions[-1] - chord.positions[0]
+                time += (count - 1) * self.__step_time((0, round(span / (count - 1))))
+            times.append(time)
+            ascending = nearest_end_first(position, chord)
+            holes.append(len(chord_steps(position, chord, ascending)))
+            total_feed += chord.delay
+            feeds.append(total_feed)
+            position = chord.positions[-1] if ascending else chord.positions[0]
+
+        cut_index = bisect_left(feeds, total_feed + self.cutter_position)  # like __with_cuts
+        if cut_index < len(times):
+            times[cut_index] += self.cutter.duration_us() / 1000000
+        return Estimate(times, holes, self.__tail_time(position, cut_index < len(times)), total_feed)
+
+    def __estimate(self, steps: List[Step]) -> Estimate:
+        """Predicts the machine time of planned steps, every step is a chord of its own"""
+        total_feed = sum(step[0] for step in steps)
+        times = array('d')
+        cut = False
+        position = self.idle_position
+        for step, is_cut, time in self.__step_times(steps, total_feed):
+            times.append(time)
+            cut = cut or is_cut
+            position += step[1]
+        return Estimate(times, array('I', [1] * len(times)), self.__tail_time(position, cut), total_feed)
+
+    def __step_times(self, steps: Iterable[Step], total_feed: int) -> Iterator[Tuple[Step, bool, float]]:
+        """Yields every step with whether the card is cut after it and its predicted time in seconds"""
+        for step, is_cut in self.__with_cuts(steps, total_feed):
+            time = self.__step_time(step)
+            if is_cut:
+                time += self.cutter.duration_us() / 1000000
+            yield step, is_cut, time
+
+    def __step_time(self, step: Step) -> float:
+        """Predicts the time of a move and the punch after it, in seconds"""
+        move = self.steppers.move_duration_us(step)
+        return (max(move, self.puncher.earliest_start_us()) + self.puncher.duration_us()) / 1000000
+
+    def __tail_time(self, position: int, cut: bool) -> float:
+        """Predicts the time after the last step in seconds: the cut if no step is cut, and the end moves"""
+        tail = 0
+        if not cut:
+            tail += self.cutter.duration_us()
+            if self.cutter_position > 0:
+                tail += self.steppers.move_duration_us([self.cutter_position, self.idle_position - position])
+                position = self.idle_position
+        for move in self.__end_moves(position):
+            tail += self.steppers.move_duration_us(move)
+        return tail / 1000000
+
+    def __chords(self, notesequence: Iterable[DelayNotes], feed_steps: float):
         for delayNotes in notesequence:
             if len(delayNotes.notes) == 0:
                 raise (RuntimeError("Empty note set is not supported, consolidate consecutive delays first"))
             positions = sorted(
                 [self.row0 + round(self.keyboard.get_index(note) * self.tone_steps) for note in delayNotes.notes])
-            if abs(position - positions[-1]) < abs(position - positions[0]):
-                positions.reverse()  # Start from nearest end
-            delay = round(delayNotes.delay * feed_steps)
-            for targetPosition in positions:
-                tuple = (delay, targetPosition - position)
-                if tuple != (0, 0):
-                    steps.append(tuple)
-                position = targetPosition
-                delay = 0
-        return steps
-
-    def __calculate_feed_steps(self, notesequence: NoteSequence):
-        last_timestamp_per_tone = {}
-        time = 0
-        import sys
-        minimum_delta = sys.maxsize  # shortest time in seconds between two notes of the same pitch
-        for delay_notes in notesequence:
-            time += delay_notes.delay
-            for note in delay_notes.notes:
-                if note in last_timestamp_per_tone:
-                    minimum_delta = min(time - last_timestamp_per_tone[note], minimum_delta)
-                last_timestamp_per_tone[note] = time
+            yield Chord(round(delayNotes.delay * feed_steps), positions)
+
+    def __calculate_feed_steps(self, notesequence: Iterable[DelayNotes]):
+        # a pre-scan pass, the notes are iterated again to calculate the steps
+        minimum_delta = minimum_same_pitch_delta(notesequence)
         feed_steps = self.feed_steps
         if minimum_delta < sys.maxsize:
             minimum_steps = math.ceil(self.minimal_feed / minimum_delta)
@@ -153,66 +325,145 @@ class MusicPuncher(object):
         return feed_steps
 
     def do_run(self, steps):
-        total_time_steps = 0
-        for step in steps:
-            # print(f"{step[1]}")
-            total_time_steps += step[0]
-
-        cutter_step = total_time_steps + self.cutter_position
-        did_cut = False
-
-        total_time_steps = 0
-        for idx, step in enumerate(steps):
+        """Punches a list of steps, or a StepStream that is still being planned"""
+        start = self.clock.time()
+        streams = [steps] if isinstance(steps, StepStream) else []
+        try:
+            if isinstance(steps, StepStream):
+                self.progress_model = steps.progress
+            else:
+                self.progress_model = ProgressModel(self.__estimate(steps), self.clock)
+                for time in self.progress_model.estimate.times:
+                    self.progress_model.planned(time)
+                    self.progress_model.chord_planned()
+            estimate = self.progress_model.estimate
+            cuts = self.__with_cuts(steps, estimate.total_feed)
+            if self.waveform_lookahead > 0:
+                moves = Prefetcher(lambda: self.__build_ahead(cuts), self.waveform_lookahead, self.lookahead_stats)
+                streams.insert(0, moves)
+            else:
+                moves = ((step, is_cut, None) for step, is_cut in cuts)
+            self.__do_run(iter(moves))
+        finally:
+            for stream in streams:
+                stream.close()
+            self.metrics.observe('card', self.clock.time() - start)
+
+    def __do_run(self, moves: Iterator[Tuple[Tuple[int, int], bool, object]]):
+        """Punches the moves: the steps, whether to cut after the step and the waveforms if they are built ahead"""
+        self.steps = self.progress_model.steps
+        current = next(moves, None)
+        queued = False
+        cut = False
+        idx = 0
+        while current is not None:
+            step, is_cut, waveforms = current
             if self.stopRequested:
+                if queued:  # the wave for this step is already running
+                    self.steppers.wait_for_wave()
+                    self.position += step[1]
+                    self.metrics.count('holes')
+                    if is_cut:
+                        self.metrics.count('cuts')
                 self.error = "Manually interrupted"
+                self.notifier.notify()
                 return
 
-            self.progress = idx / (len(steps) + 1)
+            self.progress = self.progress_model.progress()
+            self.steps = self.progress_model.steps
+            self.step = idx
+            self.notifier.notify()
             if idx == 0:
-                self.steppers.prepare_waveform(step)
-            self.steppers.create_and_send_wave()  # run wave prepared for previous step
-            if idx < len(steps) - 1:
-                self.steppers.prepare_waveform([steps[idx + 1][0], steps[idx + 1][1]])
+                self.steppers.prepare_waveform(step, self.__hole_actions(is_cut), waveforms)
+            if not queued:
+                self.steppers.create_and_send_wave()  # run wave prepared for previous step
+            queued = False
+            current = next(moves, None)  # waits for the planner if it is behind, while the wave is running
+            if current is not None:
+                self.steppers.prepare_waveform(list(current[0]), self.__hole_actions(current[1]), current[2])
+                if self.puncher.hardware_timed and (not is_cut or self.cutter.hardware_timed):
+                    # Nothing to do on the host after this wave, start the next one without any gap
+                    self.steppers.create_and_send_wave()
+                    queued = True
             self.steppers.wait_for_wave()
 
             # self.steppers.prepare_waveform(step)
             # self.steppers.create_and_send_wave()
             # self.steppers.wait_for_wave()
 
+            self.__count_steps(step[0], step[1])
             self.position += step[1]
-            self.puncher.punch()
-            total_time_steps += step[0]
+            if self.puncher.hardware_timed:
+                self.metrics.count('holes')  # punched by the wave that is done now
+            else:
+                self.puncher.punch()
 
-            if not did_cut and total_time_steps >= cutter_step:
+            if is_cut and self.cutter.hardware_timed:
+                self.metrics.count('cuts')
+            elif is_cut:
                 self.cutter.cut()
-                did_cut = True
+            cut = cut or is_cut
+            self.progress_model.step_done()
+            idx += 1
 
-        if not did_cut:
+        if not cut:
             if self.cutter_position > 0:
                 self.__move(self.cutter_position, self.idle_position - self.position)
             self.cutter.cut()
 
-        if self.end_feed > 0:
-            self.__move(self.end_feed, self.idle_position - self.position)
-
-        self.__move(0, self.idle_position - self.position)  # will do nothing if already in position
+        for feedsteps, tonesteps in self.__end_moves(self.position):
+            self.__move(feedsteps, tonesteps)
         self.progress = 1.0
+        self.step = self.steps = idx
+        self.notifier.notify()
+
+    def __with_cuts(self, steps: Iterable[Tuple[int, int]], total_feed: int):
+        """Yields every step with whether the card is cut after it. No step is cut if the card is cut at the end"""
+        cutter_step = total_feed + self.cutter_position
+        total_time_steps = 0
+        cut = False
+        for step in steps:
+            total_time_steps += step[0]
+            is_cut = not cut and total_time_steps >= cutter_step
+            cut = cut or is_cut
+            yield step, is_cut
+
+    def __build_ahead(self, cuts: Iterable[Tuple[Tuple[int, int], bool]]):
+        """Builds the waveforms of the moves on the lookahead thread, so the hardware thread only creates waves"""
+        for step, is_cut in cuts:
+            start = self.clock.time()
+            waveforms = self.steppers.build_waveforms(step)
+            self.tracer.add('build_waveforms', start, self.clock.time(), LOOKAHEAD, steps=step)
+            yield step, is_cut, waveforms
+
+    def __hole_actions(self, cut: bool):
+        """Returns the actions that are executed by the waveform after the move to a hole"""
+        actions = [self.puncher] if self.puncher.hardware_timed else []
+        if cut and self.cutter.hardware_timed:
+            actions.append(self.cutter)
+        return actions
+
+    def __end_moves(self, position: int) -> List[Step]:
+        """Returns the moves after the last punch and cut: the end feed, and the return to the idle position"""
+        if self.end_feed > 0:
+            return [(self.end_feed, self.idle_position - position)]
+        return [(0, self.idle_position - position)]
 
     def __move(self, feedsteps, tonesteps):
         if feedsteps == 0 and tonesteps == 0:
             return
 
-        if abs(feedsteps) + abs(tonesteps) > 6000 and feedsteps != 0 and tonesteps != 0:
-            # try to avoid limit of max 12000 pulses by executing the motions sequentially
-            self.__move(0, tonesteps)
-            self.__move(feedsteps, 0)
-            return
-
-        self.steppers.prepare_waveform([feedsteps, tonesteps])
-        self.steppers.create_and_send_wave()
-        self.steppers.wait_for_wave()
+        with self.tracer.span('move'):
+            self.steppers.prepare_waveform([feedsteps, tonesteps])
+            self.steppers.create_and_send_wave()
+            self.steppers.wait_for_wave()
+        self.__count_steps(feedsteps, tonesteps)
         self.position += tonesteps
 
+    def __count_steps(self, feedsteps, tonesteps):
+        self.metrics.count('steps.feed', abs(feedsteps))
+        self.metrics.count('steps.tone', abs(tonesteps))
+
     def reset(self):
         print('> reset')
         self.puncher.reset()
@@ -240,42 +491,103 @@ class Button:
         return self.pi.read(self.pin) == 0
 
 
+def solenoid_pulses(pin: int, on_length: float, off_length: float, offset_us: int) -> List[pigpio.pulse]:
+    """Returns the pulses to switch the pin on and off again, starting offset_us after the start of the wave"""
+    pulses = [pigpio.pulse(0, 0, offset_us)] if offset_us > 0 else []
+    pulses.append(pigpio.pulse(1 << pin, 0, round(on_length * 1000000)))
+    pulses.append(pigpio.pulse(0, 1 << pin, round(off_length * 1000000)))
+    return pulses
+
+
 class Puncher:
-    def __init__(self, pi: pigpio.pi, config):
+    def __init__(self, pi: pigpio.pi, config, clock: Clock = SYSTEM_CLOCK, metrics: Metrics = NULL_METRICS,
+                 tracer: Tracer = NULL_TRACER):
         self.pi = pi
+        self.clock = clock
+        self.metrics = metrics
+        self.tracer = tracer
         self.pin = config['pin']
         self.on_length = config['on-length']
         self.off_length = config['off-length']
+        self.clear_length = config.get('clear-length', self.off_length)
+        if self.clear_length > self.off_length:
+            raise RuntimeError("The clear-length of the puncher can not be longer than its off-length")
+        self.hardware_timed = config.get('hardware-timed', False)
+        self.ready_time = 0.0  # the next punch is not allowed before this time
         self.pi.set_mode(self.pin, pigpio.OUTPUT)
 
+    def pulses(self, offset_us: int) -> List[pigpio.pulse]:
+        """Returns the punch as pulses, to be appended to a waveform. The wave ends when the carriage may move."""
+        return solenoid_pulses(self.pin, self.on_length, self.clear_length, offset_us)
+
+    def duration_us(self) -> int:
+        return round(self.on_length * 1000000) + round(self.clear_length * 1000000)
+
+    def earliest_start_us(self) -> int:
+        """Returns the minimal time between the end of the previous punch wave and the start of the next punch"""
+        return round((self.off_length - self.clear_length) * 1000000)
+
     def punch(self):
+        """Punches a hole, and returns as soon as the carriage may move"""
+        with self.tracer.span('punch'):
+            self.__punch()
+
+    def __punch(self):
         # print(f"punch")
+        now = self.clock.time()
+        if self.ready_time > now:
+            self.metrics.observe('punch.wait', self.ready_time - now)
+            self.clock.sleep(self.ready_time - now)
         self.pi.write(self.pin, 1)
-        sleep(self.on_length)
+        self.clock.sleep(self.on_length)
         self.pi.write(self.pin, 0)
-        sleep(self.off_length)
+        self.ready_time = self.clock.time() + self.off_length
+        self.clock.sleep(self.clear_length)
+        self.metrics.count('holes')
+        self.metrics.observe('punch.sleep', self.on_length + self.clear_length)
 
     def reset(self):
         if self.pi.read(self.pin) == 1:
-            sleep(self.on_length)
+            self.clock.sleep(self.on_length)
             self.pi.write(self.pin, 0)
-        sleep(self.off_length)  # always wait, the puncher might still be in motion
+        self.clock.sleep(self.off_length)  # always wait, the puncher might still be in motion
 
 
 class Cutter:
-    def __init__(self, pi: pigpio.pi, config):
+    def __init__(self, pi: pigpio.pi, config, clock: Clock = SYSTEM_CLOCK, metrics: Metrics = NULL_METRICS,
+                 tracer: Tracer = NULL_TRACER):
         self.pi = pi
+        self.clock = clock
+        self.metrics = metrics
+        self.tracer = tracer
         self.pin = config['pin']
         self.on_length = config['on-length']
         self.off_length = config['off-length']
+        self.hardware_timed = config.get('hardware-timed', False)
         self.pi.set_mode(self.pin, pigpio.OUTPUT)
 
+    def pulses(self, offset_us: int) -> List[pigpio.pulse]:
+        """Returns the cut as pulses, to be appended to a waveform"""
+        return solenoid_pulses(self.pin, self.on_length, self.off_length, offset_us)
+
+    def duration_us(self) -> int:
+        return round(self.on_length * 1000000) + round(self.off_length * 1000000)
+
+    def earliest_start_us(self) -> int:
+        return 0
+
     def cut(self):
+        with self.tracer.span('cut'):
+            self.__cut()
+
+    def __cut(self):
         # print(f"cut")
         self.pi.write(self.pin, 1)
-        sleep(self.on_length)
+        self.clock.sleep(self.on_length)
         self.pi.write(self.pin, 0)
-        sleep(self.off_length)
+        self.clock.sleep(self.off_length)
+        self.metrics.count('cuts')
+        self.metrics.observe('cut.sleep', self.on_length + self.off_length)
 
 
 class Status(Enum):
@@ -308,29 +620,51 @@ class DummyStatusLed:
         pass
 
 
-def calculate_acceleration_profile(min_sps, max_sps, acceleration):
-    "Returns a list of delays in microseconds"
+def calculate_acceleration_profile(min_sps, max_sps, acceleration, jerk=None):
+    """
+    Returns a list of delays in microseconds. Without jerk, the speed increases with a constant acceleration. With a
+    jerk (steps per second per second per second), the acceleration itself increases and decreases linearly, so the
+    speed follows an S-curve that starts and ends without a sudden change of force.
+    """
+    if jerk is not None and jerk <= 0:
+        raise RuntimeError(f"Jerk must be positive, got {jerk}")
     profile = []
 
     sps = min_sps
+    current = acceleration if jerk is None else 0
     while sps < max_sps:
         profile.append(round(1000000 / sps))
-        sps += acceleration * (1 / sps)
+        if jerk is not None:
+            # decrease the acceleration in time to reach max_sps when it reaches zero
+            current = min(current + jerk / sps, acceleration, math.sqrt(2 * jerk * (max_sps - sps)))
+        sps += current * (1 / sps)
     return profile
 
 
 class PiGPIOStepperMotor(object):
 
-    def __init__(self, pi: pigpio.pi, config):
+    def __init__(self, pi: pigpio.pi, config, cache_size: int = 256, engine: str = 'pulses',
+                 clock: Clock = SYSTEM_CLOCK):
         self.pi = pi
+        self.clock = clock
         self.enable_pin = config['enable-pin']
         self.dir_pin = config['dir-pin']
         self.step_pin = config['step-pin']
         self.reverse = config['reverse-dir']
         self.acceleration_profile = calculate_acceleration_profile(config['min-sps'], config['max-sps'],
-                                                                   config['acceleration'])
+                                                                   config['acceleration'], config.get('jerk'))
         self.min_delay = 1 / config['max-sps']
         self.max_delay = 1 / config['min-sps']
+        self.waveform_cache = LRUCache(cache_size)
+        self.half_profile = array('I', [delay >> 1 for delay in self.acceleration_profile])
+        self.min_half_delay = round(self.min_delay * 1000000) >> 1
+        self.ramp_times = ramp_times(self.half_profile)
+        if engine == 'array':
+            self.create_waveform = self.create_move_array
+        elif engine == 'pulses':
+            self.create_waveform = self.create_move_waveform
+        else:
+            raise RuntimeError(f"Unknown waveform engine: {engine}")
 
         pi.set_mode(self.dir_pin, pigpio.OUTPUT)
         pi.set_mode(self.step_pin, pigpio.OUTPUT)
@@ -353,9 +687,9 @@ class PiGPIOStepperMotor(object):
 
     def __step(self, delay):
         self.pi.write(self.step_pin, 1)
-        sleep(delay / 2)
+        self.clock.sleep(delay / 2)
         self.pi.write(self.step_pin, 0)
-        sleep(delay / 2)
+        self.clock.sleep(delay / 2)
 
     def move_until(self, dir: int, condition):
         """Slowly moves the motor in the given direction (-1,+1) until the condition becomes true"""
@@ -364,6 +698,27 @@ class PiGPIOStepperMotor(object):
         while not condition():
             self.__step(self.max_delay)
 
+    def move_waveform(self, steps: int):
+        """
+        Returns the (cached) waveform for the given number of steps, created by the configured engine. Callers must
+        not modify the pulses.
+        """
+        return self.waveform_cache.get_or_create(steps, lambda: self.create_waveform(steps))
+
+    def move_duration_us(self, steps: int) -> int:
+        """Returns the length of the waveform for the given number of steps in microseconds, in constant time"""
+        return move_length(self.ramp_times, self.min_half_delay, abs(steps))
+
+    def create_move_array(self, steps: int) -> ArrayWaveform:
+        return create_array_waveform(self.half_profile, self.min_half_delay, self.step_pin, self.dir_pin,
+                                     self.__is_dir_enable(steps), steps)
+
+    def direction_bits(self, steps: int) -> Tuple[int, int]:
+        """Returns the (gpio_on, gpio_off) bits that set the direction for the given steps"""
+        if steps == 0:
+            return 0, 0
+        return (1 << self.dir_pin, 0) if self.__is_dir_enable(steps) else (0, 1 << self.dir_pin)
+
     def create_move_waveform(self, steps: int) -> List[pigpio.pulse]:
         # self.__set_dir(-1 if steps < 0 else 1)
         dir_enable = 0
@@ -398,85 +753,408 @@ class PiGPIOStepperMotor(object):
         return pulses
 
 
-class Steppers:
-    """Class for controlling synchronous movements of multiple stepper motors"""
+class WaveCompletion(object):
+    """
+    Waits for the end of a wave: sleeps until the expected end plus a margin, and then polls with an exponentially
+    growing interval while the wave is still busy. Optionally calibrates the offset between the locally expected end
+    and the end observed through pigpiod, which helps for remote hosts with network latency.
+    """
+
+    def __init__(self, config=None, clock: Clock = SYSTEM_CLOCK, metrics: Metrics = NULL_METRICS):
+        config = config or {}
+        self.clock = clock
+        self.metrics = metrics
+        self.margin = config.get('margin', 0.001)
+        self.poll_interval = config.get('poll-interval', 0.002)
+        self.max_poll_interval = config.get('max-poll-interval', 0.02)
+        self.calibrate = config.get('calibrate', False)
+        self.offset = 0.0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.overshoot = DurationStats()  # time between the expected end and detecting the end
+        self.polls = 0
+        self.late_waves = 0  # waves that were still busy after sleeping until the expected end
+
+    def wait(self, expected_end: float, is_busy):
+        now = self.clock.time()
+        target = expected_end + self.offset + self.margin
+        if target > now:
+            self.clock.sleep(target - now)
+
+        interval = self.poll_interval
+        late = False
+        while is_busy():
+            late = True
+            self.polls += 1
+            self.clock.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
+        done = self.clock.time()
+
+        self.overshoot.add(done - expected_end)
+        self.metrics.observe('wave.overshoot', done - expected_end)
+        if late:
+            self.late_waves += 1
+        if self.calibrate:
+            # Move the offset towards the observed lateness when late, and slowly back towards zero when not
+            observed = done - expected_end - self.margin if late else 0.0
+            self.offset = max(0.0, 0.8 * self.offset + 0.2 * observed)
+
+    def stats(self):
+        return {'overshoot': self.overshoot.as_dict(), 'polls': self.polls, 'late_waves': self.late_waves,
+                'offset': self.offset}
+
+
+class PreparedWave(NamedTuple):
+    ids: Tuple[int, ...]
+    length: float  # seconds
+    pulses: int
+    cbs: int  # DMA control blocks
+    chain: List[int] = None  # wave_chain data if the waves are sent as a chain
+
 
-    def __init__(self, pi: pigpio.pi, steppers: List[PiGPIOStepperMotor]):
+class Steppers:
+    """
+    Class for controlling synchronous movements of multiple stepper motors.
+
+    Waves are created as soon as they are prepared, so the next wave can be queued while the current one is sending.
+    Finished waves are deleted. pigpio only frees the id and memory of a deleted wave once all waves with a higher id
+    are deleted too, or reuses them for a new wave of exactly the same size, so the ids, pulses and control blocks of
+    all allocated waves are tracked the same way and kept within the limits of pigpio, waiting for sending waves when
+    needed. Waves are padded to slots of SLOT_PERCENT of the wave memory, so the slot of a finished wave is reused for
+    the next wave while the current one is sending. Moves of more than chain_pulses pulses are sent as a chain of small
+    repeated waves, which are not padded.
+    """
+
+    def __init__(self, pi: pigpio.pi, steppers: List[PiGPIOStepperMotor], cache_size: int = 256,
+                 completion: WaveCompletion = None, chain_pulses: int = 5000, clock: Clock = SYSTEM_CLOCK,
+                 metrics: Metrics = NULL_METRICS, tracer: Tracer = NULL_TRACER, packed_pulses: bool = False):
         self.pi = pi
+        self.clock = clock
+        self.metrics = metrics
+        self.tracer = tracer
         self.steppers = steppers
+        self.chain_pulses = chain_pulses
+        self.packed_pulses = packed_pulses  # add array waveforms with the private pigpio command, see wave_add_packed
+        self.waveform_cache = LRUCache(cache_size)
+        self.completion = completion or WaveCompletion(clock=clock)
+        self.max_pulses = pi.wave_get_max_pulses()
+        self.max_cbs = pi.wave_get_max_cbs()
+        self.allocated = []  # (pulses, control blocks) by wave id, including deleted waves that are not freed yet
+        self.deleted = set()  # ids of deleted waves that are still allocated
+        self.prepared = deque()  # created, but not sent yet
+        self.sending = deque()  # tuples of (PreparedWave, expected end time), in order of transmission
+        self.last_wave_end_time = None
+        self.gaps = DurationStats()  # host-side idle time between the end of a wave and sending the next
+        self.preloaded = {}  # synchronized waveforms of a compiled job, by steps
 
     def on(self):
+        self.gaps = DurationStats()
+        self.last_wave_end_time = None
+        self.completion.reset_stats()
         for stepper in self.steppers:
             stepper.on()
 
     def off(self):
+        self.__clear_waves()
+        self.preloaded = {}
         for stepper in self.steppers:
             stepper.off()
 
-    def prepare_waveform(self, steps: List[int]):
+    def prepare_waveform(self, steps: List[int], actions=(), waveforms=None):
         """
-           Prepares the next wave form. Can be called between create_and_send_wave and wait_for_wave in order to prepare
-           the next waveform while executing the previous one
+           Prepares and creates the next wave. Can be called between create_and_send_wave and wait_for_wave in order
+           to prepare the next waveform while executing the previous one.
+           The pulses of the given actions (like Puncher and Cutter) are appended to the move, so the move and the
+           actions are executed as one hardware-timed wave.
+           The waveforms of the move are built, unless they are given as built by build_waveforms.
         """
+        with self.tracer.span('prepare_waveform', steps=steps):
+            self.__prepare_waveform(steps, actions, waveforms)
+
+    def __prepare_waveform(self, steps: List[int], actions, waveforms):
         # print(f"Prepare waveforms for {steps}")
-        self.pi.wave_clear()
-        waves = [self.steppers[idx].create_move_waveform(s) for idx, s in enumerate(steps)]
-        self.prepared_wave_length = self.__synchronize(waves) / 1000000
+        if len(self.prepared) == 0 and len(self.sending) == 0:
+            self.__clear_waves()  # frees all wave memory, also of waves left by an interrupted card
+        if waveforms is None:
+            waveforms = self.build_waveforms(steps)
+        if isinstance(waveforms, ChainPlan):
+            self.__prepare_chain(waveforms, actions)
+            return
+
+        waves, length = waveforms
 
         for wave in waves:
             self.__add_wave(wave)
 
-    def create_and_send_wave(self):
-        id = self.pi.wave_create()
+        for action in actions:
+            # a wave with actions directly follows the wave of the previous action
+            length = max(length, action.earliest_start_us())
+            self.pi.wave_add_generic(action.pulses(length))
+            length += action.duration_us()
+        self.prepared_wave_length = length / 1000000
+
+        pulses = self.pi.wave_get_pulses()
+        cbs = self.pi.wave_get_cbs()
+        slot = self.__slot(pulses, cbs)
+        if slot is not None:
+            self.__reserve(*slot)
+            id = self.__create_wave(*slot, create=lambda: self.pi.wave_create_and_pad(SLOT_PERCENT))
+        else:
+            self.__reserve(pulses, cbs)
+            id = self.__create_wave(pulses, cbs)
+        self.prepared.append(PreparedWave((id,), self.prepared_wave_length, pulses, cbs))
+
+    def __prepare_chain(self, plan: ChainPlan, actions):
+        waves = [[wave] for wave in plan.waves]  # each wave is added as one or more lists of pulses
+        chain = list(plan.chain)
+        length = plan.length
+        if len(actions) > 0:
+            action_pulses = []
+            start = length
+            for action in actions:
+                length = max(length, action.earliest_start_us())
+                action_pulses.append(action.pulses(length - start))
+                length += action.duration_us()
+            waves.append(action_pulses)
+            chain.append((len(waves) - 1, 1))
+        self.prepared_wave_length = length / 1000000
+
+        # reserve room for the whole chain first, the waves of a chain can not be freed until it is sent
+        chain_pulses = sum(len(part) for parts in waves for part in parts)
+        self.__reserve(chain_pulses, CBS_PER_PULSE * chain_pulses, len(waves))
+        ids = []
+        total_pulses = 0
+        total_cbs = 0
+        for parts in waves:
+            for part in parts:
+                self.pi.wave_add_generic(part)
+            pulses = self.pi.wave_get_pulses()
+            cbs = self.pi.wave_get_cbs()
+            self.__reserve(pulses, cbs)
+            ids.append(self.__create_wave(pulses, cbs))
+            total_pulses += pulses
+            total_cbs += cbs
+
+        data = ChainPlan(plan.waves, chain, length).chain_data(ids)
+        self.prepared.append(PreparedWave(tuple(ids), self.prepared_wave_length, total_pulses, total_cbs, data))
+
+    def build_waveforms(self, steps):
+        """
+        Returns the pulses of a move without using pigpio, so they can be built on another thread: a ChainPlan if the
+        move is sent as a chain, or else the synchronized waves and their length in microseconds
+        """
+        if self.is_chained(steps):
+            return self.waveform_cache.get_or_create(('chain',) + tuple(steps), lambda: self.__chain_plan(steps))
+        return self.synchronized_waveforms(steps)
+
+    def move_duration_us(self, steps) -> int:
+        """Returns the length of the synchronized move in microseconds, without building its waveforms"""
+        if self.is_chained(steps):
+            master = max(range(len(steps)), key=lambda idx: abs(steps[idx]))
+            stepper = self.steppers[master]
+            return chain_length(stepper.half_profile, stepper.min_half_delay, abs(steps[master]))
+        return max(stepper.move_duration_us(s) for stepper, s in zip(self.steppers, steps))
+
+    def is_chained(self, steps) -> bool:
+        """Returns whether the move is sent as a chain of small waves"""
+        return 2 * sum(abs(s) for s in steps) > self.chain_pulses
+
+    def synchronized_waveforms(self, steps, metrics: Metrics = None) -> Tuple[list, int]:
+        """
+        Returns the preloaded or cached waves of a move, and their length in microseconds. Building them is recorded
+        in the given metrics, or in the metrics of the steppers.
+        """
+        key = tuple(steps)
+        if key in self.preloaded:
+            return self.preloaded[key]
+        metrics = self.metrics if metrics is None else metrics
+        return self.waveform_cache.get_or_create(key, lambda: self.__synchronized_waveforms(steps, metrics))
+
+    def preload(self, waveforms):
+        """Uses the given synchronized waveforms (by steps) until the steppers are switched off"""
+        self.preloaded = dict(waveforms)
+
+    def __chain_plan(self, steps: List[int]) -> ChainPlan:
+        master = max(range(len(steps)), key=lambda idx: abs(steps[idx]))
+        stepper = self.steppers[master]
+        slaves = [(abs(s), self.steppers[idx].step_pin) for idx, s in enumerate(steps) if idx != master]
+        dir_on = 0
+        dir_off = 0
+        for idx, s in enumerate(steps):
+            on, off = self.steppers[idx].direction_bits(s)
+            dir_on |= on
+            dir_off |= off
+        with self.metrics.timer('waveform.build'):
+            return create_chain_plan(stepper.half_profile, stepper.min_half_delay, abs(steps[master]),
+                                     stepper.step_pin, slaves, dir_on, dir_off)
+
+    def __slot(self, pulses: int, cbs: int) -> Optional[Tuple[int, int]]:
+        """Returns the pulses and control blocks of a padded wave, or None if the wave does not fit in a slot"""
+        if self.max_pulses < 0 or self.max_cbs < 0:
+            return None  # no limits to pad to
+        slot = (self.max_pulses * SLOT_PERCENT // 100, self.max_cbs * SLOT_PERCENT // 100)
+        return slot if pulses <= slot[0] and cbs <= slot[1] else None
+
+    def __create_wave(self, pulses: int, cbs: int, create: Callable[[], int] = None) -> int:
+        with self.metrics.timer('wave.create'):
+            id = (create or self.pi.wave_create)()
         if id < 0:
             raise RuntimeError(f"pigpio error on wave_create: {id}")
-        self.pi.wave_send_once(id)
-        self.expected_wave_end_time = time() + self.prepared_wave_length
+        if id < len(self.allocated):
+            self.deleted.discard(id)
+            self.allocated[id] = (pulses, cbs)
+        else:
+            self.allocated.append((pulses, cbs))
+        return id
+
+    def __delete_wave(self, id: int):
+        self.pi.wave_delete(id)
+        self.deleted.add(id)
+        while len(self.allocated) - 1 in self.deleted:
+            self.deleted.remove(len(self.allocated) - 1)
+            self.allocated.pop()
+
+    def __synchronized_waveforms(self, steps: List[int], metrics: Metrics) -> Tuple[list, int]:
+        with metrics.timer('waveform.build'):
+            waves = [self.steppers[idx].move_waveform(s) for idx, s in enumerate(steps)]
+            lengths = [self.steppers[idx].move_duration_us(s) for idx, s in enumerate(steps)]
+            return self.__synchronize(waves, lengths)
+
+    def cache_stats(self):
+        stats = {'synchronized': self.waveform_cache.stats()}
+        for idx, stepper in enumerate(self.steppers):
+            stats[f"stepper{idx}"] = stepper.waveform_cache.stats()
+        return stats
+
+    def create_and_send_wave(self):
+        """
+        Sends the oldest prepared wave. If another wave is still sending, the wave is queued to start as soon as that
+        wave ends. Chains can not be queued, so they wait for the previous waves to finish, and vice versa.
+        """
+        with self.tracer.span('create_and_send_wave'):
+            self.__send_wave()
+
+    def __send_wave(self):
+        wave = self.prepared.popleft()
+        if wave.chain is not None or (len(self.sending) > 0 and self.sending[-1][0].chain is not None):
+            while len(self.sending) > 0:
+                self.wait_for_wave()
+        now = self.clock.time()
+        if len(self.sending) > 0 and self.sending[-1][1] > now:
+            with self.metrics.timer('wave.send'):
+                self.pi.wave_send_using_mode(wave.ids[0], pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+            self.expected_wave_end_time = self.sending[-1][1] + wave.length
+            self.tracer.add('wave', self.sending[-1][1], self.expected_wave_end_time, WAVES, ids=wave.ids)
+            self.gaps.add(0.0)
+            self.metrics.observe('wave.gap', 0.0)
+        else:
+            with self.metrics.timer('wave.send'):
+                if wave.chain is not None:
+                    self.pi.wave_chain(wave.chain)
+                else:
+                    self.pi.wave_send_once(wave.ids[0])
+            self.expected_wave_end_time = now + wave.length
+            self.tracer.add('wave', now, self.expected_wave_end_time, WAVES, ids=wave.ids)
+            if self.last_wave_end_time is not None:
+                self.gaps.add(max(0.0, now - self.last_wave_end_time))
+                self.metrics.observe('wave.gap', max(0.0, now - self.last_wave_end_time))
+        self.sending.append((wave, self.expected_wave_end_time))
 
     def wait_for_wave(self):
-        now = time()
-        expected_end = self.expected_wave_end_time + 0.001
-        if expected_end > now:
-            sleep(expected_end - now)
-        while self.pi.wave_tx_busy():  # wait for waveform to be sent
-            sleep(0.1)  # it should be really exceptional to we arrive here
-
-    def __add_wave(self, pulses: List[pigpio.pulse]):
+        """Waits until the oldest sent wave is finished and deletes it"""
+        if len(self.sending) == 0:
+            return
+        with self.tracer.span('wait_for_wave'):
+            self.__wait_for_wave()
+
+    def __wait_for_wave(self):
+        wave, expected_wave_end_time = self.sending[0]
+        if len(self.sending) == 1:
+            self.completion.wait(expected_wave_end_time, self.pi.wave_tx_busy)
+        else:
+            # the next wave starts when this one is finished
+            self.completion.wait(expected_wave_end_time, lambda: self.pi.wave_tx_at() in wave.ids)
+        self.sending.popleft()
+        for id in wave.ids:
+            self.__delete_wave(id)
+        self.last_wave_end_time = expected_wave_end_time
+
+    def gap_stats(self) -> DurationStats:
+        return self.gaps
+
+    def __reserve(self, pulses: int, cbs: int, waves: int = 1):
+        """Waits for sending waves to finish until waves of the given total size fit in the pigpio wave memory"""
+        while not self.__fits(pulses, cbs, waves):
+            if len(self.sending) == 0:
+                raise RuntimeError(f"{waves} wave(s) of {pulses} pulses and {cbs} control blocks exceed the pigpio "
+                                   f"maximum of {MAX_WAVES - len(self.allocated)} more waves, {self.max_pulses} pulses "
+                                   f"and {self.max_cbs} control blocks")
+            self.metrics.count('wave.stalls')
+            self.wait_for_wave()
+
+    def __fits(self, pulses: int, cbs: int, waves: int) -> bool:
+        if waves == 1 and any(self.allocated[id] == (pulses, cbs) for id in self.deleted):
+            return True  # pigpio reuses a deleted wave of the same size
+        if len(self.allocated) + waves > MAX_WAVES:
+            return False
+        if self.max_pulses >= 0 and sum(p for p, _ in self.allocated) + pulses > self.max_pulses:
+            return False
+        if self.max_cbs >= 0 and sum(c for _, c in self.allocated) + cbs > self.max_cbs:
+            return False
+        return True
+
+    def __clear_waves(self):
+        self.prepared.clear()
+        self.sending.clear()
+        self.allocated = []
+        self.deleted = set()
+        self.pi.wave_clear()
+
+    def __add_wave(self, pulses):
+        if isinstance(pulses, ArrayWaveform):
+            pulses.add_to(self.pi, self.packed_pulses)
+            return
         delay = 0
         while len(pulses) > 0:
             # Submit long waves in parts to avoid hitting pigpio package size limits
             # This only marginally helps, because the next limit is total number of pulses
-            part = pulses[:5000]
-            pulses = pulses[5000:]
+            part = pulses[:PULSES_PER_PART]
+            pulses = pulses[PULSES_PER_PART:]
+            length = self.__wavelength(part)
             if delay > 0:
                 part.insert(0, pigpio.pulse(0, 0, delay))
-            delay += self.__wavelength(part[1:])
+            delay += length
             self.pi.wave_add_generic(part)
 
     def __wavelength(self, pulses):
+        if isinstance(pulses, ArrayWaveform):
+            return pulses.length()
         l = 0
         for pulse in pulses:
             l += pulse.delay
         return l
 
-    def __synchronize(self, waves: List[List[pigpio.pulse]]) -> int:
-        """Scales the wave to the longest to have the same length, and returns the length in microseconds"""
+    def __synchronize(self, waves: list, lengths: List[int]) -> Tuple[list, int]:
+        """
+        Scales the waves to the longest to have the same length, and returns the scaled waves and the length in
+        microseconds. The lengths of the waves are given, so the pulses are not summed. The given pulses are not
+        modified, scaled waves consist of new pulses.
+        """
 
-        filtered = [wave for wave in waves if wave != []]
+        filtered = [(wave, length) for wave, length in zip(waves, lengths) if len(wave) > 0]
         if len(filtered) == 0:
-            return 0
+            return [], 0
         if len(filtered) == 1:
-            return self.__wavelength(filtered[0])
+            return [filtered[0][0]], filtered[0][1]
 
         def scale(pulses, factor):
-            for pulse in pulses:
-                pulse.delay = round(pulse.delay * factor)
-
-        lengths = [self.__wavelength(wave) for wave in filtered]
-
-        maxlen = max(lengths)
-        for idx, wave in enumerate(filtered):
-            l = lengths[idx]
-            if l != maxlen:
-                scale(wave, maxlen / l)
-        return maxlen
+            if isinstance(pulses, ArrayWaveform):
+                return pulses.scaled(factor)
+            return [pigpio.pulse(pulse.gpio_on, pulse.gpio_off, round(pulse.delay * factor)) for pulse in pulses]
+
+        maxlen = max(length for _, length in filtered)
+        scaled = []
+        for wave, l in filtered:
+            scaled.append(wave if l == maxlen else scale(wave, maxlen / l))
+        return scaled, maxlen
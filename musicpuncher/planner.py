@@ -0,0 +1,168 @@
+from collections import deque
+from typing import Iterable, Iterator, List, NamedTuple, Tuple
+
+Step = Tuple[int, int]  # (feed steps, tone steps) to move before punching a hole
+
+
+class Chord(NamedTuple):
+    # The holes to punch after feeding 'delay' steps. Positions are absolute tone positions, sorted ascending
+
+    delay: int
+    positions: List[int]
+
+
+class PlanStats(object):
+    """Travel of the planned order compared to the greedy 'nearest end first' order"""
+
+    def __init__(self):
+        self.tone_travel = 0
+        self.wave_steps = 0
+        self.greedy_tone_travel = 0
+        self.greedy_wave_steps = 0
+        self.transitions = 0  # candidate orders the planner compared
+
+    def saved_tone_travel(self) -> int:
+        return self.greedy_tone_travel - self.tone_travel
+
+    def saved_wave_steps(self) -> int:
+        return self.greedy_wave_steps - self.wave_steps
+
+    def __repr__(self):
+        return f"tone travel: {self.tone_travel} steps (saved {self.saved_tone_travel()}), " \
+               f"wave length: {self.wave_steps} steps (saved {self.saved_wave_steps()})"
+
+
+def chord_cost(position: int, chord: Chord, ascending: bool) -> Tuple[int, int]:
+    """
+    Returns (wave steps, tone travel) to punch the chord starting at position. The duration of a synchronized move is
+    approximated by the step count of its longest axis.
+    """
+    first, last = (chord.positions[0], chord.positions[-1]) if ascending else (chord.positions[-1], chord.positions[0])
+    jump = abs(first - position)
+    span = abs(last - first)
+    return max(abs(chord.delay), jump) + span, jump + span
+
+
+def nearest_end_first(position: int, chord: Chord) -> bool:
+    """The greedy order: returns True if the chord should be punched in ascending order"""
+    return not abs(position - chord.positions[-1]) < abs(position - chord.positions[0])
+
+
+def chord_steps(position: int, chord: Chord, ascending: bool) -> List[Step]:
+    positions = chord.positions if ascending else list(reversed(chord.positions))
+    steps = []
+    delay = chord.delay
+    for target in positions:
+        step = (delay, target - position)
+        if step != (0, 0):
+            steps.append(step)
+        position = target
+        delay = 0
+    return steps
+
+
+class StepPlanner(object):
+    """Decides in which order the holes of each chord are punched"""
+
+    def __init__(self):
+        self.stats = PlanStats()
+
+    def plan(self, position: int, chords: Iterable[Chord]) -> Iterator[Step]:
+        """Yields the (feed, tone) steps for all chords, starting with the head at the given tone position"""
+        for steps in self.plan_chords(position, chords):
+            yield from steps
+
+    def plan_chords(self, position: int, chords: Iterable[Chord]) -> Iterator[List[Step]]:
+        """Yields the steps of every chord, which may be none if its holes are at the position of the head"""
+        self.stats = PlanStats()
+        greedy_position = position
+        for chord, ascending in self._orders(position, chords):
+            wave, travel = chord_cost(position, chord, ascending)
+            self.stats.wave_steps += wave
+            self.stats.tone_travel += travel
+
+            greedy_ascending = nearest_end_first(greedy_position, chord)
+            wave, travel = chord_cost(greedy_position, chord, greedy_ascending)
+            self.stats.greedy_wave_steps += wave
+            self.stats.greedy_tone_travel += travel
+            greedy_position = chord.positions[-1] if greedy_ascending else chord.positions[0]
+
+            yield chord_steps(position, chord, ascending)
+            position = chord.positions[-1] if ascending else chord.positions[0]
+
+    def _orders(self, position: int, chords: Iterable[Chord]) -> Iterator[Tuple[Chord, bool]]:
+        raise NotImplementedError()
+
+
+class GreedyPlanner(StepPlanner):
+    """Starts every chord at the end nearest to the current head position"""
+
+    def _orders(self, position: int, chords: Iterable[Chord]) -> Iterator[Tuple[Chord, bool]]:
+        for chord in chords:
+            ascending = nearest_end_first(position, chord)
+            yield chord, ascending
+            position = chord.positions[-1] if ascending else chord.positions[0]
+
+
+class LookaheadPlanner(StepPlanner):
+    """
+    Chooses the direction of each chord by minimizing the cost over the next 'depth' chords. Punching a chord
+    optimally always ends at one of its outer holes, so every chord has only two candidate orders and the search over
+    the window is a dynamic program of O(depth) per chord.
+    """
+
+    def __init__(self, depth: int = 8):
+        super().__init__()
+        if depth < 1:
+            raise RuntimeError(f"Planner depth must be at least 1, got {depth}")
+        self.depth = depth
+
+    def _orders(self, position: int, chords: Iterable[Chord]) -> Iterator[Tuple[Chord, bool]]:
+        window = deque()
+        for chord in chords:
+            window.append(chord)
+            if len(window) == self.depth:
+                chord = window.popleft()
+                ascending = self.__best_first_direction(position, chord, window)
+                yield chord, ascending
+                position = chord.positions[-1] if ascending else chord.positions[0]
+        while len(window) > 0:
+            chord = window.popleft()
+            ascending = self.__best_first_direction(position, chord, window)
+            yield chord, ascending
+            position = chord.positions[-1] if ascending else chord.positions[0]
+
+    def __best_first_direction(self, position: int, first: Chord, window: Iterable[Chord]) -> bool:
+        # Two states, one per end of the previous chord: accumulated (wave steps, tone travel), the end position
+        # and the direction of the first chord leading to that state
+        state_up = chord_cost(position, first, True) + (first.positions[-1], True)
+        state_down = chord_cost(position, first, False) + (first.positions[0], False)
+        self.stats.transitions += 2
+
+        for chord in window:
+            low, high = chord.positions[0], chord.positions[-1]
+            delay = abs(chord.delay)
+            span = high - low
+            next_states = []
+            for start, end in ((low, high), (high, low)):
+                best = None
+                for wave, travel, position, first_ascending in (state_up, state_down):
+                    jump = abs(start - position)
+                    candidate = (wave + max(delay, jump) + span, travel + jump + span, end, first_ascending)
+                    if best is None or candidate[:2] < best[:2]:
+                        best = candidate
+                self.stats.transitions += 2
+                next_states.append(best)
+            state_up, state_down = next_states
+
+        return state_up[3] if state_up[:2] <= state_down[:2] else state_down[3]
+
+
+def create_planner(config) -> StepPlanner:
+    """Creates the planner from the optional 'planner' config section, defaults to the greedy planner"""
+    strategy = config.get('strategy', 'greedy') if config else 'greedy'
+    if strategy == 'greedy':
+        return GreedyPlanner()
+    if strategy == 'lookahead':
+        return LookaheadPlanner(config.get('depth', 8))
+    raise RuntimeError(f"Unknown planner strategy: {strategy}")
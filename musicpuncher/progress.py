@@ -0,0 +1,92 @@
+from array import array
+from typing import NamedTuple
+
+from .clock import Clock, SYSTEM_CLOCK
+
+
+class Estimate(NamedTuple):
+    """The predicted machine time of a card before it is planned: per chord, and of the moves after the last step"""
+
+    times: array  # seconds per chord
+    holes: array  # steps per chord, which are fewer than its notes if a hole is at the position of the previous one
+    tail: float
+    total_feed: int  # sum of the feed steps of all steps
+
+    def steps(self) -> int:
+        return sum(self.holes)
+
+    def total(self) -> float:
+        return sum(self.times) + self.tail
+
+
+class ProgressModel(object):
+    """
+    The progress and remaining time of a card. The planner adds the predicted time of every step as it is planned,
+    which replace the estimated time and steps of a chord once the planner marks the chord as planned. The remaining
+    time is the predicted time of the remaining steps, corrected by the ratio of the measured and the predicted time of
+    the steps that are done. That ratio starts at 1, weighted as if 'prior' seconds were measured exactly as predicted,
+    so a few slow first steps do not throw the estimate off. Progress is the fraction of the elapsed and the remaining
+    time that has elapsed.
+    """
+
+    def __init__(self, estimate: Estimate, clock: Clock = SYSTEM_CLOCK, prior: float = 10.0):
+        self.estimate = estimate
+        self.times = array('d')  # predicted time of the planned steps
+        self.total = estimate.total()
+        self.steps = estimate.steps()  # exact once all chords are planned
+        self.chord = 0  # the chord that is being planned
+        self.chord_time = 0.0  # of its planned steps
+        self.chord_steps = 0
+        self.clock = clock
+        self.prior = prior
+        self.start = self.last = clock.time()
+        self.done = 0
+        self.predicted_done = 0.0
+        self.measured = 0.0
+
+    def planned(self, time: float):
+        """Adds the predicted time of the next step, a step must be planned before it is done"""
+        self.times.append(time)
+        self.chord_time += time
+        self.chord_steps += 1
+
+    def chord_planned(self):
+        """Replaces the estimate of the chord that is being planned by its planned steps"""
+        if self.chord < len(self.estimate.times):
+            self.total += self.chord_time - self.estimate.times[self.chord]
+            self.steps += self.chord_steps - self.estimate.holes[self.chord]
+            self.chord += 1
+        self.chord_time = 0.0
+        self.chord_steps = 0
+
+    def step_done(self):
+        now = self.clock.time()
+        if self.done < len(self.times):
+            self.predicted_done += self.times[self.done]
+        self.measured += now - self.last
+        self.last = now
+        self.done += 1
+
+    def correction(self) -> float:
+        if self.predicted_done + self.prior <= 0:
+            return 1.0
+        return (self.measured + self.prior) / (self.predicted_done + self.prior)
+
+    def elapsed(self) -> float:
+        return self.clock.time() - self.start
+
+    def remaining(self) -> float:
+        """Returns the remaining time in seconds, counting down while a step is in progress"""
+        correction = self.correction()
+        current = self.times[self.done] if self.done < len(self.times) else 0.0
+        after = max(0.0, self.total - self.predicted_done - current) * correction
+        return after + max(0.0, current * correction - (self.clock.time() - self.last))
+
+    def progress(self) -> float:
+        elapsed = self.elapsed()
+        total = elapsed + self.remaining()
+        return elapsed / total if total > 0 else 0.0
+
+    def __repr__(self):
+        return f"predicted {self.total:.1f}s, {self.done} steps took {self.measured:.1f}s " \
+               f"(predicted {self.predicted_done:.1f}s)"
@@ -1,8 +1,11 @@
 from time import time
 
 from .keyboard import Keyboard
-from .music import parse_midi, adjust, autotranspose, write_midi, print_notes, autofit, consolidate
+from .music import NoteStream, write_midi, print_notes
+from .clock import VirtualClock
+from .job import CompiledJob
 from .music_puncher import MusicPuncher
+from .simulator import SimulatedPi
 from .webserver import WebServer
 
 
@@ -11,14 +14,41 @@ def __get_keyboard(puncher_config) -> Keyboard:
     return Keyboard(puncher_config['keyboard'], reverse=reverse)
 
 
-def punch(file: str, adjustments: str, transpose_autofit: int, puncher_config, outfile: str = None):
+def __create_puncher(puncher_config, keyboard: Keyboard, simulate: bool) -> MusicPuncher:
+    if simulate:
+        clock = VirtualClock()
+        return MusicPuncher(puncher_config, keyboard, SimulatedPi(puncher_config, clock), clock)
+    return MusicPuncher(puncher_config, keyboard)
+
+
+def __print_simulation(puncher: MusicPuncher):
+    if isinstance(puncher.pi, SimulatedPi):
+        print(f"Simulation: {puncher.pi.report()}")
+
+
+def __run(puncher: MusicPuncher, run):
+    start_time = time()
+    try:
+        run()
+    except KeyboardInterrupt:
+        print("Interrupted!")
+        pass
+    end_time = time()
+    print(f"Done in {round(end_time - start_time)} seconds")
+    if puncher.metrics.enabled:
+        print(puncher.metrics.summary())
+    __print_simulation(puncher)
+
+
+def punch(file: str, adjustments: str, transpose_autofit: int, puncher_config, outfile: str = None,
+          simulate: bool = False, jobfile: str = None, waveforms: bool = False):
     keyboard = __get_keyboard(puncher_config)
 
-    notes = parse_midi(filename=file)
+    notes = NoteStream.midi(filename=file)
     # print("\nParsed:")
     # print_notes(notes)
 
-    notes = adjust(notes, adjustments)
+    notes = notes.adjust(adjustments)
     # print("\nAdjusted:")
     # print_notes(notes)
 
@@ -30,28 +60,35 @@ def punch(file: str, adjustments: str, transpose_autofit: int, puncher_config, o
     # print("\nAutofitted/transposed:")
     # print_notes(notes)
 
-    notes = consolidate(notes)
+    notes = notes.consolidate()
     # print("\nConsolidated:")
     # print_notes(notes)
 
     if outfile:
         write_midi(notes, filename=outfile)
+    elif jobfile:
+        # compiling does not use the hardware, so it also works without a pi
+        puncher = __create_puncher(puncher_config, keyboard, simulate=True)
+        job = puncher.compile(notes, waveforms)
+        job.save(jobfile)
+        print(f"Compiled {len(job.steps)} steps and {len(job.waveforms)} waveforms into {jobfile}")
     else:
-        puncher = MusicPuncher(puncher_config, keyboard)
-        start_time = time()
-        try:
-            puncher.run(notes)
-        except KeyboardInterrupt:
-            print("Interrupted!")
-            pass
-        end_time = time()
-        print(f"Done in {round(end_time - start_time)} seconds")
-
-
-def calibrate(puncher_config):
+        puncher = __create_puncher(puncher_config, keyboard, simulate)
+        __run(puncher, lambda: puncher.run(notes))
+
+
+def punch_job(jobfile: str, puncher_config, simulate: bool = False):
     keyboard = __get_keyboard(puncher_config)
-    puncher = MusicPuncher(puncher_config, keyboard)
+    job = CompiledJob.load(jobfile)
+    puncher = __create_puncher(puncher_config, keyboard, simulate)
+    __run(puncher, lambda: puncher.run_job(job))
+
+
+def calibrate(puncher_config, simulate: bool = False):
+    keyboard = __get_keyboard(puncher_config)
+    puncher = __create_puncher(puncher_config, keyboard, simulate)
     puncher.calibrate()
+    __print_simulation(puncher)
 
 
 def serve(puncher_config):
@@ -0,0 +1,283 @@
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate
+from operator import itemgetter
+
+import pigpio
+
+from .clock import VirtualClock
+
+AXES = ['feed', 'tone']
+MAX_WAVES = 250  # PI_MAX_WAVES of pigpio
+
+
+class SimulatedPi(object):
+    """
+    A deterministic stand-in for pigpio.pi that executes waves on a virtual clock. It counts the steps of both
+    steppers from the step and direction pins, the holes and cuts from the solenoid pins, and simulates the zero button
+    at a configured tone position. Waves are evaluated as a whole when they are sent, so positions are only up to
+    date between waves. Every on pulse of a step pin in a wave counts as a step.
+
+    Wave ids and memory are allocated like pigpio does: a new wave gets the next id and memory above all other waves,
+    unless a deleted wave of exactly the same size can be reused. Deleting a wave only frees its id and memory once
+    all waves with a higher id are deleted too. Padded waves take a percentage of the maximum pulses and control blocks.
+    """
+
+    def __init__(self, config, clock: VirtualClock):
+        self.clock = clock
+        self.connected = True
+        self.axes = {}  # step pin -> (axis, dir pin, reverse)
+        for axis in AXES:
+            stepper = config[f"{axis}-stepper"]
+            self.axes[stepper['step-pin']] = (axis, stepper['dir-pin'], stepper['reverse-dir'])
+        self.punch_bit = 1 << config['puncher']['pin']
+        self.cut_bit = 1 << config['cutter']['pin']
+        self.control_mask = self.punch_bit | self.cut_bit  # pins that are evaluated pulse by pulse
+        for _, dir_pin, _ in self.axes.values():
+            self.control_mask |= 1 << dir_pin
+        self.zero_pin = config['zero-button']['pin'] if 'zero-button' in config else None
+
+        simulator_config = config.get('simulator') or {}
+        self.zero_button_position = simulator_config.get('zero-button-position', -500)
+        self.max_pulses = simulator_config.get('max-pulses', 12000)
+        self.max_cbs = simulator_config.get('max-cbs', 25016)
+
+        self.levels = 0  # bit mask of the output levels
+        self.position = {axis: 0 for axis in AXES}
+        self.travel = {axis: 0 for axis in AXES}
+        self.holes = 0
+        self.cuts = 0
+        self.solenoids = []  # 'hole' and 'cut', in the order the solenoids fired
+        self.waves_sent = 0
+        self.wave_time_us = 0
+
+        self.pending = []  # (gpio_on, gpio_off, delays) of the pulses added since the last wave_create
+        self.created = {}
+        self.allocated = []  # (pulses, control blocks) by wave id, including deleted waves that are not freed yet
+        self.transmissions = []  # (wave_id, start, end)
+        self.start_time = clock.time()
+        self.wave_end_time = self.start_time
+
+    def report(self):
+        """Returns the simulated machine time in seconds, the time the waves were running, travel and counts"""
+        return {'machine_time': self.clock.time() - self.start_time, 'wave_time': self.wave_time_us / 1000000,
+                'waves': self.waves_sent, 'holes': self.holes, 'cuts': self.cuts, 'travel': dict(self.travel),
+                'position': dict(self.position)}
+
+    def set_mode(self, gpio, mode):
+        pass
+
+    def set_pull_up_down(self, gpio, pud):
+        pass
+
+    def set_PWM_dutycycle(self, gpio, dutycycle):
+        pass
+
+    def stop(self):
+        pass
+
+    def read(self, gpio):
+        if gpio == self.zero_pin:
+            return 1 if self.position['tone'] <= self.zero_button_position else 0
+        return (self.levels >> gpio) & 1
+
+    def write(self, gpio, level):
+        effect = Counter()
+        if level:
+            self.__apply(1 << gpio, 0, effect)
+        else:
+            self.__apply(0, 1 << gpio, effect)
+        self.__commit(effect)
+
+    def wave_tx_busy(self):
+        return self.clock.time() < self.wave_end_time
+
+    def wave_tx_at(self):
+        now = self.clock.time()
+        for wave_id, start, end in self.transmissions:
+            if start <= now < end:
+                return wave_id
+        return pigpio.NO_TX_WAVE
+
+    def wave_clear(self):
+        self.pending = []
+        self.created = {}
+        self.allocated = []
+
+    def wave_add_generic(self, pulses):
+        self.pending.append(([pulse.gpio_on for pulse in pulses], [pulse.gpio_off for pulse in pulses],
+                             [pulse.delay for pulse in pulses]))
+        return self.wave_get_pulses()
+
+    def wave_add_packed(self, data: bytes, count: int):
+        """Adds pulses in pigpio wire format, without converting them to pulse objects"""
+        words = array('I', data)
+        self.pending.append((words[0::3], words[1::3], words[2::3]))
+        return self.wave_get_pulses()
+
+    def wave_get_pulses(self):
+        return sum(len(delays) for _, _, delays in self.pending)
+
+    def wave_get_cbs(self):
+        return 2 * self.wave_get_pulses()
+
+    def wave_get_max_pulses(self):
+        return self.max_pulses
+
+    def wave_get_max_cbs(self):
+        return self.max_cbs
+
+    def wave_create(self):
+        return self.__create((self.wave_get_pulses(), self.wave_get_cbs()))
+
+    def wave_create_and_pad(self, percent):
+        size = (self.max_pulses * percent // 100, self.max_cbs * percent // 100)
+        if self.wave_get_pulses() > size[0]:
+            return pigpio.PI_TOO_MANY_OOL
+        if self.wave_get_cbs() > size[1]:
+            return pigpio.PI_TOO_MANY_CBS
+        return self.__create(size)
+
+    def __create(self, size):
+        reusable = [wave_id for wave_id, allocated in enumerate(self.allocated)
+                    if wave_id not in self.created and allocated == size]
+        if len(reusable) > 0:
+            wave_id = reusable[0]
+        else:
+            if len(self.allocated) >= MAX_WAVES:
+                return pigpio.PI_NO_WAVEFORM_ID
+            if sum(pulses for pulses, _ in self.allocated) + size[0] > self.max_pulses:
+                return pigpio.PI_TOO_MANY_OOL
+            if sum(cbs for _, cbs in self.allocated) + size[1] > self.max_cbs:
+                return pigpio.PI_TOO_MANY_CBS
+            wave_id = len(self.allocated)
+            self.allocated.append(size)
+        self.created[wave_id] = self.pending
+        self.pending = []
+        return wave_id
+
+    def wave_delete(self, wave_id):
+        del self.created[wave_id]
+        while len(self.allocated) > 0 and len(self.allocated) - 1 not in self.created:
+            self.allocated.pop()
+
+    def wave_send_once(self, wave_id):
+        return self.wave_send_using_mode(wave_id, pigpio.WAVE_MODE_ONE_SHOT)
+
+    def wave_send_using_mode(self, wave_id, mode):
+        start = self.clock.time()
+        if mode == pigpio.WAVE_MODE_ONE_SHOT_SYNC:
+            start = max(start, self.wave_end_time)
+        effect = Counter()
+        length = self.__run_wave(wave_id, effect)
+        self.__commit(effect)
+        self.__transmit(wave_id, start, length)
+        return 0
+
+    def wave_chain(self, data):
+        frames = [(0, Counter())]  # (start time, effect) of the chain and each open loop
+        length = 0
+        first = None
+        idx = 0
+        while idx < len(data):
+            if data[idx] == 255:
+                command = data[idx + 1]
+                if command == 0:
+                    frames.append((length, Counter()))
+                    idx += 2
+                elif command == 1:
+                    count = data[idx + 2] + 256 * data[idx + 3]
+                    start, effect = frames.pop()
+                    length = start + (length - start) * count
+                    frames[-1][1].update({key: value * count for key, value in effect.items()})
+                    idx += 4
+                elif command == 2:
+                    length += data[idx + 2] + 256 * data[idx + 3]
+                    idx += 4
+                else:
+                    raise RuntimeError(f"Unsupported chain command {command}")
+            else:
+                first = data[idx] if first is None else first
+                length += self.__run_wave(data[idx], frames[-1][1])
+                idx += 1
+        self.__commit(frames[0][1])
+        self.__transmit(first, self.clock.time(), length)
+        return 0
+
+    def __run_wave(self, wave_id, effect: Counter) -> int:
+        """Applies the pulses of the wave to the levels, adds the steps, holes and cuts to effect, returns its length"""
+        steps = {step_pin: [] for step_pin in self.axes}  # start times of the steps per step pin
+        controls = []  # (time, gpio_on, gpio_off) of the pulses that change a direction or solenoid pin
+        mask = self.control_mask
+        length = 0
+        for gpio_on, gpio_off, delays in self.created[wave_id]:
+            times = list(accumulate(delays, initial=0))
+            length = max(length, times[-1])
+            for step_pin, step_times in steps.items():
+                bit = 1 << step_pin
+                step_times += [time for time, on in zip(times, gpio_on) if on & bit]
+            controls += [(time, on & mask, off & mask) for time, on, off in zip(times, gpio_on, gpio_off)
+                         if (on | off) & mask]
+        controls.sort(key=itemgetter(0))
+
+        dir_changes = {step_pin: [(0, self.levels)] for step_pin in self.axes}  # (time, levels) per step pin
+        for time, on, off in controls:
+            levels = (self.levels | on) & ~off
+            rising = levels & ~self.levels
+            for step_pin, (_, dir_pin, _) in self.axes.items():
+                if (levels ^ self.levels) & (1 << dir_pin):
+                    dir_changes[step_pin].append((time, levels))
+            self.levels = levels
+            self.__fire(rising, effect)
+
+        for step_pin, step_times in steps.items():
+            if len(step_times) == 0:
+                continue
+            if len(self.created[wave_id]) > 1:
+                step_times.sort()
+            axis, dir_pin, reverse = self.axes[step_pin]
+            changes = dir_changes[step_pin]
+            for idx, (time, levels) in enumerate(changes):
+                first = bisect_left(step_times, time)
+                last = bisect_left(step_times, changes[idx + 1][0]) if idx + 1 < len(changes) else len(step_times)
+                forward = bool(levels & (1 << dir_pin)) != reverse
+                effect[axis] += (last - first) if forward else (first - last)
+            effect[f"{axis}-travel"] += len(step_times)
+        return length
+
+    def __apply(self, on: int, off: int, effect: Counter):
+        levels = (self.levels | on) & ~off
+        rising = levels & ~self.levels
+        self.levels = levels
+        if rising == 0:
+            return
+        for step_pin, (axis, dir_pin, reverse) in self.axes.items():
+            if rising & (1 << step_pin):
+                forward = bool(levels & (1 << dir_pin)) != reverse
+                effect[axis] += 1 if forward else -1
+                effect[f"{axis}-travel"] += 1
+        self.__fire(rising, effect)
+
+    def __fire(self, rising: int, effect: Counter):
+        if rising & self.punch_bit:
+            effect['holes'] += 1
+            self.solenoids.append('hole')
+        if rising & self.cut_bit:
+            effect['cuts'] += 1
+            self.solenoids.append('cut')
+
+    def __commit(self, effect: Counter):
+        for axis in AXES:
+            self.position[axis] += effect[axis]
+            self.travel[axis] += effect[f"{axis}-travel"]
+        self.holes += effect['holes']
+        self.cuts += effect['cuts']
+
+    def __transmit(self, wave_id, start, length_us):
+        self.waves_sent += 1
+        self.wave_time_us += length_us
+        self.wave_end_time = start + length_us / 1000000
+        now = self.clock.time()
+        self.transmissions = [tx for tx in self.transmissions if tx[2] > now]
+        self.transmissions.append((wave_id, start, self.wave_end_time))
@@ -1,4 +1,4 @@
-function start(test) {
+function start(action) {
     clearError()
     var input = document.getElementById('midiFileInput');
     if (!input.files[0]) {
@@ -6,72 +6,56 @@ function start(test) {
     } else {
         var file = input.files[0];
         var fileName = $('.custom-file-label').text()
-        var transpose = parseInt($('#transpose').val())
-        var autotranspose = $('#autotranspose').is(":checked")
-        var autofit = $('#autofit').is(":checked")
-        var fr = new FileReader();
-        fr.onload = function() {
-            base64String = fr.result
-                .replace('data:', '')
-                .replace(/^.+,/, '');
-            $.ajax(`../api/punch${test ? '?test=true' : ''}`, {
-                data: JSON.stringify({
-                    'midiFile': base64String,
-                    'filename': fileName,
-                    'autotranspose': autotranspose,
-                    'transpose': transpose,
-                    'autofit': autofit
-                }),
-                contentType: 'application/json',
-                success: test ? download : updateStatus,
-                error: errorhandler,
-                type: 'POST',
+        if (fileName.endsWith('.mpjob') && action != 'punch') {
+            setError('Compiled jobs can only be punched')
+            return
+        }
+        // the file is uploaded as is, the server detects compiled jobs
+        var form = new FormData()
+        form.append('file', file)
+        form.append('filename', fileName)
+        form.append('transpose', parseInt($('#transpose').val()))
+        form.append('autotranspose', $('#autotranspose').is(":checked"))
+        form.append('autofit', $('#autofit').is(":checked"))
+        fetch(`../api/punch${action != 'punch' ? `?${action}=true` : ''}`, {method: 'POST', body: form})
+            .then(response => {
+                if (!response.ok) {
+                    return response.text().then(message => setError(`Error ${response.status}: ${message}`))
+                } else if (action == 'punch') {
+                    updateStatus()
+                } else if (action == 'test') {
+                    return response.blob().then(blob => download(blob, 'puncher.mid'))
+                } else {
+                    return response.blob().then(blob => download(blob, fileName.replace(/\.midi?$/i, '') + '.mpjob'))
+                }
             })
-        };
-        fr.readAsDataURL(file);
+            .catch(error => setError(`Error: ${error}`))
     }
 }
 
 function punch() {
-    start(false)
+    start('punch')
 }
 
 function test() {
-    start(true)
+    start('test')
+}
+
+function compile() {
+    start('compile')
 }
 
-function download(base64String) {
-    const url = window.URL.createObjectURL(base64toBlob(base64String));
+function download(blob, filename) {
+    const url = window.URL.createObjectURL(blob);
     const a = document.createElement('a');
     a.style.display = 'none';
     a.href = url;
-    // the filename you want
-    a.download = 'puncher.mid';
+    a.download = filename;
     document.body.appendChild(a);
     a.click();
     window.URL.revokeObjectURL(url);
 }
 
-function base64toBlob(b64Data, contentType='', sliceSize=512) {
-    const byteCharacters = atob(b64Data);
-    const byteArrays = [];
-
-    for (let offset = 0; offset < byteCharacters.length; offset += sliceSize) {
-        const slice = byteCharacters.slice(offset, offset + sliceSize);
-
-        const byteNumbers = new Array(slice.length);
-        for (let i = 0; i < slice.length; i++) {
-            byteNumbers[i] = slice.charCodeAt(i);
-        }
-
-        const byteArray = new Uint8Array(byteNumbers);
-        byteArrays.push(byteArray);
-    }
-
-    const blob = new Blob(byteArrays, {type: contentType});
-    return blob;
-}
-
 function stop() {
     $.ajax("../api/stop", {
         type: 'POST'
@@ -83,7 +67,10 @@ const state = {
     status: 'Unknown',
     filename: null,
     progress: 0,
-    error: null
+    step: '',
+    remaining: '',
+    error: null,
+    queue: null
 }
 
 function statusChanged(model) {
@@ -99,10 +86,8 @@ function statusChanged(model) {
 
     if (model.status == 'Punching') {
         clearError()
-        $("#inputpane").collapse('hide')
         $("#progresspane").collapse('show')
     } else {
-        $("#inputpane").collapse('show')
         $("#progresspane").collapse('hide')
     }
 
@@ -119,10 +104,30 @@ function progressChanged(model) {
     progressbar.attr("aria-valuenow", model.progress)
 }
 
+function stepChanged(model) {
+    $("#step").text(model.step)
+}
+
+function remainingChanged(model) {
+    $("#remaining").text(model.remaining)
+}
+
+function formatDuration(seconds) {
+    seconds = Math.round(seconds)
+    const minutes = Math.floor(seconds / 60) % 60
+    const hours = Math.floor(seconds / 3600)
+    const mmss = `${minutes}:${String(seconds % 60).padStart(2, '0')}`
+    return hours > 0 ? `${hours}:${mmss.padStart(5, '0')}` : mmss
+}
+
 function errorChanged(model) {
     setError(model.error)
 }
 
+function queueChanged(model) {
+    updateQueue()
+}
+
 const modelProxy = new Proxy(state, {
     set: function (target, key, value) {
         if (target[key] != value) {
@@ -133,20 +138,100 @@ const modelProxy = new Proxy(state, {
     }
 });
 
+function updateQueue() {
+    $.ajax("../api/queue", {
+        success: function(data) {
+            $("#queuepane").collapse(data.jobs.length > 0 ? 'show' : 'hide')
+            $("#resumebutton").collapse(data.paused ? 'show' : 'hide')
+            const rows = data.jobs.map((job, idx) => $('<tr>').append(
+                $('<td>').text(job.filename),
+                $('<td>').text(job.error ? `${job.status}: ${job.error}` : job.status),
+                $('<td class="text-right">').append(
+                    $('<button type="button" class="btn btn-sm btn-secondary mr-1">&uarr;</button>')
+                        .prop('disabled', idx == 0 || job.status == 'punching')
+                        .click(() => moveJob(job.id, idx - 1)),
+                    $('<button type="button" class="btn btn-sm btn-danger">&times;</button>')
+                        .click(() => cancelJob(job.id)))))
+            $("#queue").empty().append(rows)
+        }
+    });
+}
+
+function moveJob(id, position) {
+    $.ajax(`../api/queue/${id}/move`, {
+        data: JSON.stringify({'position': position}),
+        contentType: 'application/json',
+        success: updateQueue,
+        error: errorhandler,
+        type: 'POST'
+    })
+}
+
+function cancelJob(id) {
+    $.ajax(`../api/queue/${id}`, {
+        success: updateQueue,
+        error: errorhandler,
+        type: 'DELETE'
+    })
+}
+
+function resumeQueue() {
+    $.ajax("../api/queue/resume", {
+        success: updateQueue,
+        error: errorhandler,
+        type: 'POST'
+    })
+}
+
+function applyStatus(data) {
+    modelProxy.filename = data.file
+    modelProxy.status = data.active ? 'Punching' : 'Idle'
+    modelProxy.progress = Math.round(data.progress * 100)
+    modelProxy.step = data.steps > 0 ? `${data.step} of ${data.steps}` : ''
+    modelProxy.remaining = data.remaining != null ? formatDuration(data.remaining) : ''
+    modelProxy.error = data.error
+    modelProxy.queue = data.queue  // the queue version, the queue is only fetched when it changed
+}
+
 function updateStatus() {
     $.ajax("../api/status", {
         error: function() {
             modelProxy.status = 'Error'
         },
-        success: function(data) {
-            modelProxy.filename = data.file
-            modelProxy.status = data.active ? 'Punching' : 'Idle'
-            modelProxy.progress = Math.round(data.progress * 100)
-            modelProxy.error = data.error
-        }
+        success: applyStatus
     });
 }
 
+var pollTimer = null
+
+function startPolling() {
+    if (pollTimer == null) {
+        updateStatus()
+        pollTimer = setInterval(updateStatus, 2000)
+    }
+}
+
+function stopPolling() {
+    if (pollTimer != null) {
+        clearInterval(pollTimer)
+        pollTimer = null
+    }
+}
+
+function listenStatus() {
+    if (!window.EventSource) {
+        startPolling()
+        return
+    }
+    // the server pushes every status change, poll only while the stream is down (the browser reconnects by itself)
+    const source = new EventSource("../api/status/stream")
+    source.onopen = stopPolling
+    source.onerror = startPolling
+    source.onmessage = function(event) {
+        applyStatus(JSON.parse(event.data))
+    }
+}
+
 function clearError() {
     $("#error").collapse('hide')
 }
@@ -173,4 +258,4 @@ $('#midiFileInput').on('change', function() {
 $("input[type='number']").inputSpinner()
 
 updateStatus();
-setInterval(updateStatus, 2000);
\ No newline at end of file
+listenStatus();
\ No newline at end of file
@@ -0,0 +1,85 @@
+from bisect import bisect_left
+
+
+class DurationStats(object):
+    """Aggregates durations in seconds: count, total, mean, minimum and maximum"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, duration: float):
+        self.count += 1
+        self.total += duration
+        self.minimum = duration if self.minimum is None else min(self.minimum, duration)
+        self.maximum = duration if self.maximum is None else max(self.maximum, duration)
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def as_dict(self):
+        return {'count': self.count, 'total': self.total, 'mean': self.mean(), 'min': self.minimum,
+                'max': self.maximum}
+
+    def __repr__(self):
+        if self.count == 0:
+            return "no samples"
+        return f"{self.count} samples, total {self.total:.3f}s, mean {self.mean() * 1000:.2f}ms, " \
+               f"min {self.minimum * 1000:.2f}ms, max {self.maximum * 1000:.2f}ms"
+
+
+class Histogram(DurationStats):
+    """DurationStats with the number of durations per bucket, the buckets grow roughly by a factor 3"""
+
+    BOUNDS = [0.0001, 0.0003, 0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0]
+
+    def __init__(self):
+        super().__init__()
+        self.buckets = [0] * (len(self.BOUNDS) + 1)  # the last bucket counts everything above the last bound
+
+    def add(self, duration: float):
+        super().add(duration)
+        self.buckets[bisect_left(self.BOUNDS, duration)] += 1
+
+    def as_dict(self):
+        result = super().as_dict()
+        labels = [f"<={bound}" for bound in self.BOUNDS] + [f">{self.BOUNDS[-1]}"]
+        result['buckets'] = {label: count for label, count in zip(labels, self.buckets) if count > 0}
+        return result
+
+
+class BufferStats(object):
+    """
+    The depth of a prefetch buffer each time its consumer takes an item, and how often and how long the consumer
+    waited for an empty buffer (starved). Waiting for the very first item is not counted as starving.
+    """
+
+    def __init__(self):
+        self.takes = 0
+        self.depth_total = 0
+        self.min_depth = None
+        self.starved = 0
+        self.waits = DurationStats()
+
+    def take(self, depth: int, waited: float):
+        if self.takes > 0 and depth == 0:
+            self.starved += 1
+            self.waits.add(waited)
+        self.takes += 1
+        self.depth_total += depth
+        self.min_depth = depth if self.min_depth is None else min(self.min_depth, depth)
+
+    def mean_depth(self) -> float:
+        return self.depth_total / self.takes if self.takes > 0 else 0.0
+
+    def as_dict(self):
+        return {'takes': self.takes, 'mean_depth': self.mean_depth(), 'min_depth': self.min_depth,
+                'starved': self.starved, 'waits': self.waits.as_dict()}
+
+    def __repr__(self):
+        if self.takes == 0:
+            return "not used"
+        return f"{self.takes} items, mean depth {self.mean_depth():.1f}, min depth {self.min_depth}, " \
+               f"starved {self.starved} times ({self.waits.total:.3f}s)"
@@ -0,0 +1,46 @@
+import json
+import threading
+from typing import Callable, Iterator
+
+from .clock import Clock, SYSTEM_CLOCK
+
+
+class StatusNotifier(object):
+    """A version number of a status, that threads can wait on until it changes"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.version = 0
+
+    def notify(self):
+        with self.condition:
+            self.version += 1
+            self.condition.notify_all()
+
+    def wait(self, version: int, timeout: float) -> int:
+        """Waits until the version differs from the given version, or the timeout passes, and returns the version"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+def status_events(get_status: Callable[[], dict], notifier: StatusNotifier, max_rate: float = 5.0,
+                  keepalive: float = 15.0, clock: Clock = SYSTEM_CLOCK) -> Iterator[str]:
+    """
+    Yields the status as server-sent events: the current status first, and then every change. Changes are coalesced
+    to at most max_rate events per second, every event has the latest status. Without changes, a comment is sent
+    every keepalive seconds to detect closed connections.
+    """
+    version = -1
+    last = None
+    while True:
+        changed = notifier.wait(version, keepalive)
+        if changed == version:
+            yield ": keepalive\n\n"
+            continue
+        version = changed
+        status = get_status()
+        if status != last:
+            last = status
+            yield f"data: {json.dumps(status)}\n\n"
+            clock.sleep(1 / max_rate)
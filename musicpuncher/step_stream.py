@@ -0,0 +1,85 @@
+import queue
+import threading
+from time import perf_counter
+from typing import Callable, Iterable, Iterator
+
+from .planner import Step
+from .progress import ProgressModel
+from .stats import BufferStats
+
+_END = object()
+
+
+class _Failure(object):
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+class Prefetcher(object):
+    """
+    Iterates the items of a producer that runs ahead in its own thread, through a bounded buffer. Errors of the
+    producer are raised by the consumer. A prefetcher can be iterated once. Close it when the consumer stops early,
+    to stop the producer.
+    """
+
+    def __init__(self, produce: Callable[[], Iterable], buffer: int = 256, stats: BufferStats = None):
+        self.buffer = queue.Queue(max(buffer, 1))
+        self.stats = stats if stats is not None else BufferStats()
+        self.closed = False
+        self.produced = 0  # items given to the buffer, without the end
+        self.taken = 0
+        self.thread = threading.Thread(target=self.__produce, args=(produce,), daemon=True)
+        self.thread.start()
+
+    def __produce(self, produce: Callable[[], Iterable]):
+        try:
+            for item in produce():
+                self.produced += 1
+                if not self.__put(item):
+                    return
+            self.__put(_END)
+        except Exception as e:
+            self.__put(_Failure(e))
+
+    def __put(self, item) -> bool:
+        """Puts the item in the buffer as soon as there is room, returns False if the prefetcher is closed first"""
+        while not self.closed:
+            try:
+                self.buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self) -> Iterator:
+        while True:
+            depth = min(self.produced - self.taken, self.buffer.maxsize)
+            start = perf_counter()
+            item = self.buffer.get()
+            if item is _END or self.closed:
+                return
+            self.taken += 1
+            self.stats.take(depth, perf_counter() - start)
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+
+    def close(self):
+        self.closed = True
+        try:
+            self.buffer.put_nowait(_END)  # wakes a consumer that is waiting for an item
+        except queue.Full:
+            pass  # a waiting consumer is woken by the items in the buffer
+
+
+class StepStream(Prefetcher):
+    """
+    The steps of a card, planned by a producer thread while the card is already punching. The totals that punching
+    needs up front come from the estimate of a cheap pre-pass over the chords, so nothing waits for the whole plan.
+    The producer adds the predicted time of every step to the progress model as it plans it, and corrects the
+    estimated step count of every planned chord.
+    """
+
+    def __init__(self, plan: Callable[[], Iterable[Step]], progress: ProgressModel, buffer: int = 256):
+        self.progress = progress  # the total feed of its estimate is exact, the steps are counted as they are planned
+        super().__init__(plan, buffer)
@@ -0,0 +1,104 @@
+import json
+
+from .clock import Clock, SYSTEM_CLOCK
+
+HOST = 1  # track of the phases on the host
+WAVES = 2  # track of the waves that pigpio is sending
+PLANNER = 3  # track of the planner, that plans the steps while the card is punching
+LOOKAHEAD = 4  # track of the waveforms that are built ahead of the waves
+TRACKS = {HOST: 'host', WAVES: 'waves', PLANNER: 'planner', LOOKAHEAD: 'lookahead'}
+
+
+class Tracer(object):
+    """
+    Records the phases of a run on a timeline, and writes them in the Chrome trace format, which can be opened in
+    chrome://tracing or https://ui.perfetto.dev. The host phases and the waves are on separate tracks, which shows
+    whether the next wave is prepared while the current one is sending. Times come from the clock of the puncher, so
+    a simulated run has a simulated timeline.
+    """
+
+    enabled = True
+
+    def __init__(self, filename: str, clock: Clock = SYSTEM_CLOCK):
+        self.filename = filename
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        self.start = self.clock.time()
+        self.events = []
+
+    def add(self, name: str, start: float, end: float, track: int = HOST, **args):
+        """Adds a phase from start to end, in seconds of the clock"""
+        event = {'name': name, 'ph': 'X', 'pid': 1, 'tid': track, 'ts': round((start - self.start) * 1000000, 1),
+                 'dur': round((end - start) * 1000000, 1)}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def span(self, name: str, **args):
+        """Returns a context manager that adds its block as a phase"""
+        return _Span(self, name, args)
+
+    def as_dict(self):
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': track, 'args': {'name': name}}
+                    for track, name in TRACKS.items()]
+        return {'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms'}
+
+    def save(self):
+        with open(self.filename, 'w') as file:
+            json.dump(self.as_dict(), file)
+        print(f"Wrote trace of {len(self.events)} phases to {self.filename}")
+
+
+class NullTracer(Tracer):
+    """A tracer that is disabled: every call does nothing"""
+
+    enabled = False
+
+    def __init__(self):
+        self.events = []
+
+    def reset(self):
+        pass
+
+    def add(self, name: str, start: float, end: float, track: int = HOST, **args):
+        pass
+
+    def span(self, name: str, **args):
+        return _NULL_SPAN
+
+    def save(self):
+        pass
+
+
+class _Span(object):
+    __slots__ = ['tracer', 'name', 'args', 'start']
+
+    def __init__(self, tracer: Tracer, name: str, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = self.tracer.clock.time()
+
+    def __exit__(self, *exc):
+        self.tracer.add(self.name, self.start, self.tracer.clock.time(), **self.args)
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+NULL_TRACER = NullTracer()
+
+
+def create_tracer(filename: str, clock: Clock = SYSTEM_CLOCK) -> Tracer:
+    """Returns a tracer that writes to filename, or a disabled tracer if there is no filename"""
+    return Tracer(filename, clock) if filename else NULL_TRACER
@@ -0,0 +1,293 @@
+import math
+from array import array
+from fractions import Fraction
+from typing import List, NamedTuple, Tuple
+
+import pigpio
+
+PULSES_PER_PART = 5000  # Submit long waves in parts to avoid hitting pigpio package size limits
+
+# Sending packed pulses uses private names of the pigpio module, which is pinned in requirements.txt for that reason.
+# It is only used when enabled with the packed-pulses option, otherwise the pulses are added with wave_add_generic.
+PACKED_COMMAND = all(hasattr(pigpio, name) for name in ['_u2i', '_pigpio_command_ext', '_PI_CMD_WVAG'])
+
+
+class ArrayWaveform(object):
+    """
+    A waveform stored as packed arrays of (gpio_on, gpio_off, delay) instead of a list of pigpio.pulse objects.
+    Length, scaling and slicing are bulk operations on the arrays, pulses are only packed into the pigpio wire format
+    when the wave is added.
+    """
+
+    __slots__ = ['gpio_on', 'gpio_off', 'delays']
+
+    def __init__(self, gpio_on: array, gpio_off: array, delays: array):
+        self.gpio_on = gpio_on
+        self.gpio_off = gpio_off
+        self.delays = delays
+
+    def __len__(self):
+        return len(self.delays)
+
+    def __getitem__(self, item: slice) -> 'ArrayWaveform':
+        return ArrayWaveform(self.gpio_on[item], self.gpio_off[item], self.delays[item])
+
+    def length(self) -> int:
+        """Returns the length in microseconds"""
+        return sum(self.delays)
+
+    def scaled(self, factor: float) -> 'ArrayWaveform':
+        """Returns a new waveform with all delays multiplied by factor, sharing the gpio arrays"""
+        return ArrayWaveform(self.gpio_on, self.gpio_off, array('I', map(round, map(factor.__mul__, self.delays))))
+
+    def pulses(self) -> List[pigpio.pulse]:
+        return [pigpio.pulse(on, off, delay) for on, off, delay in zip(self.gpio_on, self.gpio_off, self.delays)]
+
+    def pack(self, start_delay: int = 0) -> bytes:
+        """Returns the pulses in pigpio wire format, optionally preceded by an empty pulse of start_delay"""
+        count = len(self.delays)
+        data = array('I', [0]) * (3 * count)
+        data[0::3] = self.gpio_on
+        data[1::3] = self.gpio_off
+        data[2::3] = self.delays
+        if start_delay > 0:
+            data = array('I', [0, 0, start_delay]) + data
+        return data.tobytes()
+
+    def add_to(self, pi: pigpio.pi, packed_command: bool = False):
+        """Adds the waveform to the wave under construction of pi, in parts of PULSES_PER_PART pulses"""
+        delay = 0
+        for start in range(0, len(self.delays), PULSES_PER_PART):
+            part = self[start:start + PULSES_PER_PART]
+            wave_add_packed(pi, part.pack(delay), len(part) + (1 if delay > 0 else 0), packed_command)
+            delay += part.length()
+
+
+def create_array_waveform(half_profile: array, min_half_delay: int, step_pin: int, dir_pin: int,
+                          dir_enable: bool, steps: int) -> ArrayWaveform:
+    """
+    Creates the same waveform as PiGPIOStepperMotor.create_move_waveform from the halved acceleration profile: the
+    ramp up and ramp down are slices of the profile and the cruise part is a repeated constant.
+    """
+    count = abs(steps)
+    proflen = len(half_profile)
+    accelerate = min(proflen, (count + 1) // 2)
+    decelerate = min(proflen, count - accelerate)
+    cruise = count - accelerate - decelerate
+
+    halves = half_profile[:accelerate] + array('I', [min_half_delay]) * cruise
+    if decelerate > 0:
+        halves += half_profile[decelerate - 1::-1]
+
+    delays = array('I', [0]) * (2 * count)
+    delays[0::2] = halves
+    delays[1::2] = halves
+    step_bit = 1 << step_pin
+    gpio_on = array('I', [step_bit, 0]) * count
+    gpio_off = array('I', [0, step_bit]) * count
+    if count > 0:
+        if dir_enable:
+            gpio_on[0] |= 1 << dir_pin
+        else:
+            gpio_off[0] = 1 << dir_pin
+    return ArrayWaveform(gpio_on, gpio_off, delays)
+
+
+def ramp_times(half_profile: array) -> array:
+    """Returns the cumulative times of the acceleration ramp: element n is the length of its first n steps in us"""
+    times = array('Q', [0]) * (len(half_profile) + 1)
+    total = 0
+    for idx, half_delay in enumerate(half_profile):
+        total += 2 * half_delay
+        times[idx + 1] = total
+    return times
+
+
+def move_length(ramp_times: array, min_half_delay: int, count: int) -> int:
+    """Returns the length in microseconds of the waveform of count steps, without creating it"""
+    proflen = len(ramp_times) - 1
+    accelerate = min(proflen, (count + 1) // 2)
+    decelerate = min(proflen, count - accelerate)
+    cruise = count - accelerate - decelerate
+    return ramp_times[accelerate] + ramp_times[decelerate] + 2 * min_half_delay * cruise
+
+
+def wave_add_packed(pi: pigpio.pi, data: bytes, count: int, packed_command: bool = False) -> int:
+    """
+    Adds count pulses in pigpio wire format to the wave under construction. A connected pigpio.pi only gets them as is
+    when packed_command is set, because that uses private names of pigpio.
+    """
+    if packed_command and PACKED_COMMAND and hasattr(pi, 'sl'):
+        # A connected pigpio.pi: same command as wave_add_generic, without packing the pulses one by one
+        return pigpio._u2i(pigpio._pigpio_command_ext(pi.sl, pigpio._PI_CMD_WVAG, 0, 0, count * 12, [data]))
+    if hasattr(pi, 'wave_add_packed'):
+        # A simulator that takes the wire format as is
+        return pi.wave_add_packed(data, count)
+    words = array('I', data)
+    return pi.wave_add_generic(ArrayWaveform(words[0::3], words[1::3], words[2::3]).pulses())
+
+
+class ChainPlan(NamedTuple):
+    """A long move as a few small waves, and a chain that repeats them with wave_chain loops"""
+
+    waves: List[List[pigpio.pulse]]
+    chain: List[Tuple[int, int]]  # (index in waves, repeat count)
+    length: int  # microseconds
+
+    def pulses(self) -> int:
+        return sum(len(wave) for wave in self.waves)
+
+    def chain_data(self, wave_ids: List[int]) -> List[int]:
+        """Returns the data for pigpio.pi.wave_chain, given the ids of the created waves"""
+        data = []
+        for idx, count in self.chain:
+            if count == 1:
+                data.append(wave_ids[idx])
+            else:
+                data += [255, 0, wave_ids[idx], 255, 1, count & 255, count >> 8]
+        return data
+
+
+MAX_CHAIN_LOOP = 65535
+
+
+def plateaus(half_profile: List[int], min_half_delay: int, count: int, per_ramp: int) -> List[Tuple[int, int]]:
+    """
+    Returns the move as a list of (half delay, steps) runs of constant speed. The acceleration and deceleration
+    ramps are approximated by at most per_ramp plateaus with the slowest delay of the steps they replace: the first
+    step when accelerating and, mirrored, the last step when decelerating, so no step is faster than the profile.
+    """
+    proflen = len(half_profile)
+    accelerate = min(proflen, (count + 1) // 2)
+    decelerate = min(proflen, count - accelerate)
+    cruise = count - accelerate - decelerate
+
+    def ramp(steps):
+        runs = []
+        size = max(1, math.ceil(steps / per_ramp))
+        for start in range(0, steps, size):
+            halves = half_profile[start:min(steps, start + size)]
+            runs.append((max(halves), len(halves)))
+        return runs
+
+    runs = ramp(accelerate)
+    if cruise > 0:
+        runs.append((min_half_delay, cruise))
+    runs += reversed(ramp(decelerate))
+    return runs
+
+
+def chain_length(half_profile: List[int], min_half_delay: int, count: int, per_ramp: int = 8) -> int:
+    """Returns the length in microseconds of the chain that create_chain_plan plans, without planning it"""
+    return sum(2 * half_delay * steps for half_delay, steps in plateaus(half_profile, min_half_delay, count, per_ramp))
+
+
+def constant_speed_wave(half_delay: int, steps: int, step_pin: int, slaves: List[Tuple[int, int]],
+                        dir_on: int, dir_off: int) -> List[pigpio.pulse]:
+    """
+    Returns the pulses for steps at a constant speed on step_pin, with the (count, step_pin) slaves spread evenly
+    over the same time. The direction bits are set at the start of the wave.
+    """
+    events = {}  # time -> [on, off]
+
+    def add(t, on, off):
+        event = events.setdefault(t, [0, 0])
+        event[0] |= on
+        event[1] |= off
+
+    step_bit = 1 << step_pin
+    for step in range(steps):
+        add(2 * half_delay * step, step_bit, 0)
+        add(2 * half_delay * step + half_delay, 0, step_bit)
+
+    length = 2 * half_delay * steps
+    for count, pin in slaves:
+        if count == 0:
+            continue
+        interval = length / count
+        width = min(half_delay, round(interval / 2))
+        for step in range(count):
+            start = math.floor(step * interval)
+            add(start, 1 << pin, 0)
+            add(start + width, 0, 1 << pin)
+
+    add(0, dir_on, dir_off)
+    times = sorted(events)
+    pulses = []
+    for idx, t in enumerate(times):
+        end = times[idx + 1] if idx + 1 < len(times) else length
+        pulses.append(pigpio.pulse(events[t][0], events[t][1], end - t))
+    return pulses
+
+
+def block_size(steps: int, slave_counts: List[int], minimum: int, max_denominator: int = 256) -> int:
+    """
+    Returns the number of master steps for a repeated block, such that the slave steps per block approximate the
+    ratio of the run, the block has at least 'minimum' steps and the number of repeats fits in a chain loop.
+    """
+    leading = max(slave_counts, default=0)
+    if leading > 0:
+        # slow slaves need a block of at least one slave step, but the block must still repeat a few times
+        denominator = min(max_denominator, max(32, min(math.ceil(steps / leading), steps // 4)))
+        size = Fraction(leading, steps).limit_denominator(denominator).denominator
+    else:
+        size = minimum
+    return size * max(1, math.ceil(minimum / size), math.ceil(steps / (MAX_CHAIN_LOOP * size)))
+
+
+def create_chain_plan(half_profile: List[int], min_half_delay: int, count: int, step_pin: int,
+                      slaves: List[Tuple[int, int]], dir_on: int, dir_off: int,
+                      per_ramp: int = 8, block: int = 16) -> ChainPlan:
+    """
+    Plans a move of count steps on step_pin, with the slaves (count, step_pin) moving proportionally, as a chain of
+    small constant-speed waves. Every run of constant speed is a block repeated with a chain loop, followed by a
+    wave with the last block and the remaining steps. The rounding error of the slave steps in a run is carried over
+    to the next run, so all axes arrive at the same time. A run never gets more slave steps than its target, so the
+    carried error can not become negative. pigpio supports about 20 loop counters per chain, the
+    default of 8 plateaus per ramp uses at most 17.
+    """
+    waves = []
+    wave_index = {}
+    chain = []
+    slave_pins = [pin for _, pin in slaves]
+
+    def wave(half_delay, steps, slave_counts):
+        key = (half_delay, steps, tuple(slave_counts))
+        if key not in wave_index:
+            wave_index[key] = len(waves)
+            waves.append(constant_speed_wave(half_delay, steps, step_pin, list(zip(slave_counts, slave_pins)),
+                                             dir_on, dir_off))
+        return wave_index[key]
+
+    runs = plateaus(half_profile, min_half_delay, count, per_ramp)
+    position = 0
+    done = [0] * len(slaves)  # slave steps planned so far
+    length = 0
+    for idx, (half_delay, steps) in enumerate(runs):
+        position += steps
+        targets = [max(0, round(position * total / count) - done[slave]) for slave, (total, _) in enumerate(slaves)]
+
+        size = block_size(steps, targets, block)
+        repeat = steps // size - 1  # the last block is sent together with the remaining steps
+        if repeat > 1:
+            block_slaves = [min(round(target * size / steps), target // repeat) for target in targets]
+            chain.append((wave(half_delay, size, block_slaves), repeat))
+            length += repeat * 2 * half_delay * size
+            for slave, block_slave in enumerate(block_slaves):
+                done[slave] += repeat * block_slave
+            tail = steps - repeat * size
+        else:
+            tail = steps
+
+        if idx == len(runs) - 1:
+            tail_slaves = [total - done[slave] for slave, (total, _) in enumerate(slaves)]
+        elif repeat > 1:
+            tail_slaves = [min(round(target * tail / steps), target - repeat * block_slave)
+                           for target, block_slave in zip(targets, block_slaves)]
+        else:
+            tail_slaves = targets
+        chain.append((wave(half_delay, tail, tail_slaves), 1))
+        length += 2 * half_delay * tail
+        for slave, tail_slave in enumerate(tail_slaves):
+            done[slave] += tail_slave
+    return ChainPlan(waves, chain, length)
@@ -1,13 +1,16 @@
 import base64
-import threading
 from io import BytesIO
 
-from flask import Flask, redirect, request, jsonify
+from flask import Flask, Response, redirect, request, jsonify
 from waitress import serve
 
+from .job import MAGIC as JOB_MAGIC
+from .job_queue import JobQueue
 from .keyboard import Keyboard, TransposeError
-from .music import parse_midi, autofit, consolidate, write_midi, autotranspose, apply_transposition, get_notes
+from .midi_cache import MidiCache
+from .music import write_midi
 from .music_puncher import MusicPuncher
+from .status_stream import status_events
 
 app = Flask(__name__)
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
@@ -21,48 +24,78 @@ def hello_world():
 
 @app.route('/api/punch', methods=['POST'])
 def punch():
-    if instance.puncher.active:
-        raise RuntimeError("Puncher is still active!")
-
-    instance.puncher.clearError()
-    content = request.json
-    instance.currentFile = content['filename']
-    midiBase64 = content['midiFile']
-    doAutotranspose = content['autotranspose']
-    transposition = content['transpose']
-    doAutofit = content['autofit']
+    """
+    Adds the file to the job queue, or returns the result as a MIDI file (test) or a compiled job (compile). The file
+    is either the raw request body (like audio/midi) with the settings as query parameters, a multipart upload with
+    the settings as form fields, or base64 encoded in a JSON body. Results of JSON requests are base64 encoded too.
+    """
+    try:
+        filename, data, settings = __read_upload()
+    except ValueError as error:
+        return f"Invalid upload: {error}", 400
     test = request.args.get('test') == 'true'
+    doCompile = request.args.get('compile') == 'true'
 
-    midiBytes = base64.b64decode(midiBase64)
-
-    file = BytesIO(midiBytes)
-    notes = parse_midi(file=file)
-
-    if doAutotranspose:
+    if settings is None:
+        if test or doCompile:
+            return 'Compiled jobs can only be punched', 400
         try:
-            notes = autotranspose(notes, instance.keyboard, best_effort=doAutofit)
-        except TransposeError as error:
+            instance.queue.add(filename, data)
+        except (RuntimeError, ValueError) as error:
             return str(error), 400
-    else:
-        notes = apply_transposition(notes, transposition)
-
-    if doAutofit:
-        notes = autofit(notes, instance.keyboard)
-    elif not instance.keyboard.does_fit(get_notes(notes)):
-        return str('Notes do not fit on the keyboard, try autofit'), 400
+        return "ok"
 
-    notes = consolidate(notes)
+    if not test and not doCompile:
+        try:
+            instance.queue.add(filename, data, settings)
+        except (TransposeError, RuntimeError, ValueError) as error:
+            return str(error), 400
+        return "ok"
 
+    try:
+        notes = instance.midi_cache.prepare(data, **settings)
+    except (TransposeError, RuntimeError, ValueError) as error:
+        return str(error), 400
 
-    if test:
+    if doCompile:
+        result = instance.puncher.compile(notes, waveforms=True).to_bytes()
+        mimetype = 'application/octet-stream'
+        download = 'puncher.mpjob'
+    else:
         outfile = BytesIO()
         write_midi(notes, file=outfile)
-        outBase64 = base64.b64encode(outfile.getbuffer())
-        return outBase64
+        result = outfile.getvalue()
+        mimetype = 'audio/midi'
+        download = 'puncher.mid'
+
+    if request.is_json:
+        return base64.b64encode(result)
+    return Response(result, mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename="{download}"'})
+
+
+def __read_upload():
+    """Returns the filename, the uploaded bytes and the settings of the upload, settings are None for a compiled job"""
+    if request.is_json:
+        content = request.json
+        if 'job' in content:
+            return content['filename'], base64.b64decode(content['job']), None
+        settings = {'transposition': content['transpose'], 'autotranspose': content['autotranspose'],
+                    'autofit': content['autofit']}
+        return content['filename'], base64.b64decode(content['midiFile']), settings
+
+    if 'file' in request.files:
+        file = request.files['file']
+        data = file.read()
+        filename = request.values.get('filename', file.filename)
     else:
-        x = threading.Thread(target=punch_function, args=[notes], daemon=True)
-        x.start()
-        return "ok"
+        data = request.get_data(cache=False)
+        filename = request.args.get('filename', 'upload.mid')
+    if data.startswith(JOB_MAGIC):
+        return filename, data, None
+    values = request.values
+    settings = {'transposition': int(values.get('transpose', 0)),
+                'autotranspose': values.get('autotranspose') == 'true', 'autofit': values.get('autofit') == 'true'}
+    return filename, data, settings
 
 
 @app.route('/api/stop', methods=['POST'])
@@ -72,16 +105,68 @@ def stop():
     return "ok"
 
 
-def punch_function(notes):
-    instance.puncher.run(notes)
-
-
 @app.route('/api/status')
 def status():
+    return jsonify(__status())
+
+
+@app.route('/api/status/stream')
+def status_stream():
+    """Streams the status as server-sent events whenever it changes"""
+    events = status_events(__status, instance.puncher.notifier, instance.config.get('status-rate', 5))
+    return Response(events, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+def __status():
     status = instance.puncher.status()
-    if status['active']:
-        status['file'] = instance.currentFile
-    return jsonify(status)
+    current = instance.queue.current
+    if status['active'] and current is not None:
+        status['file'] = current.filename
+    status['queue'] = instance.queue.version
+    return status
+
+
+@app.route('/api/queue')
+def queue():
+    return jsonify(instance.queue.list())
+
+
+@app.route('/api/queue/<id>/move', methods=['POST'])
+def move_job(id):
+    try:
+        instance.queue.move(id, request.json['position'])
+    except KeyError as error:
+        return str(error), 404
+    except RuntimeError as error:
+        return str(error), 400
+    return "ok"
+
+
+@app.route('/api/queue/<id>', methods=['DELETE'])
+def cancel_job(id):
+    try:
+        instance.queue.cancel(id)
+    except KeyError as error:
+        return str(error), 404
+    return "ok"
+
+
+@app.route('/api/queue/resume', methods=['POST'])
+def resume_queue():
+    instance.queue.resume()
+    return "ok"
+
+
+@app.route('/api/metrics')
+def metrics():
+    """Returns the counters and durations of the phases of the current or last card, and the waveform lookahead"""
+    puncher = instance.puncher
+    return jsonify(dict(puncher.metrics.as_dict(), lookahead=puncher.lookahead_stats.as_dict()))
+
+
+@app.route('/api/cache')
+def cache():
+    return jsonify(instance.midi_cache.stats())
 
 
 class WebServer(object):
@@ -90,8 +175,12 @@ class WebServer(object):
         self.keyboard = keyboard
         self.puncher = puncher
         self.config = config
+        self.midi_cache = MidiCache(keyboard, config.get('midi-cache-size', 16))
+        self.queue = JobQueue(puncher, self.midi_cache, config.get('queue-dir', 'queue'), config.get('precompile', 2))
         global instance
         instance = self
 
     def run(self):
-        serve(app, host=self.config['host'], port=self.config['port'])
+        self.queue.start()
+        # every open status stream holds a thread
+        serve(app, host=self.config['host'], port=self.config['port'], threads=self.config.get('threads', 8))
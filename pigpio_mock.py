@@ -12,6 +12,10 @@ PUD_UP = pigpio.PUD_UP
 
 pulse = pigpio.pulse
 
+WAVE_MODE_ONE_SHOT = pigpio.WAVE_MODE_ONE_SHOT
+WAVE_MODE_ONE_SHOT_SYNC = pigpio.WAVE_MODE_ONE_SHOT_SYNC
+NO_TX_WAVE = pigpio.NO_TX_WAVE
+
 
 class pi():
     def __init__(self,
@@ -19,7 +23,9 @@ class pi():
                  port=8888,
                  show_errors=True):
         self.connected = True
-        self.waves = []
+        self.waves = []  # pulses added since the last wave_create
+        self.created = {}
+        self.transmissions = []  # (wave_id, start, end)
         self.wave_end_time = time()
 
     def set_mode(self, gpio, mode):
@@ -40,33 +46,101 @@ class pi():
     def wave_tx_busy(self):
         return time() < self.wave_end_time
 
+    def wave_tx_at(self):
+        now = time()
+        for wave_id, start, end in self.transmissions:
+            if start <= now < end:
+                return wave_id
+        return NO_TX_WAVE
+
     def wave_clear(self):
         self.waves = []
+        self.created = {}
 
     def wave_add_generic(self, pulses):
         self.waves.append(pulses)
 
+    def wave_get_pulses(self):
+        return sum(len(pulses) for pulses in self.waves)
+
+    def wave_get_cbs(self):
+        return 2 * self.wave_get_pulses()
+
     def wave_create(self):
-        return randint(0, 100)
+        wave_id = 0
+        while wave_id in self.created:
+            wave_id += 1
+        self.created[wave_id] = self.waves
+        self.waves = []
+        return wave_id
+
+    def wave_create_and_pad(self, percent):
+        return self.wave_create()
 
     def wave_delete(self, wave_id):
-        pass
+        del self.created[wave_id]
 
     def wave_send_once(self, wave_id):
+        return self.wave_send_using_mode(wave_id, WAVE_MODE_ONE_SHOT)
+
+    def wave_send_using_mode(self, wave_id, mode):
+        start = time()
+        if mode == WAVE_MODE_ONE_SHOT_SYNC:
+            start = max(start, self.wave_end_time)
+        self.__transmit(wave_id, start, self.__wave_length(wave_id, True))
+        print()
+        return 0
+
+    def wave_chain(self, data):
+        print(f"Chain: {data}")
         totaltime_us = 0
-        print(f"{len(self.waves)} wave(s)")
-        for pulses in self.waves:
+        loops = []  # start time of the open loops
+        first = None
+        idx = 0
+        while idx < len(data):
+            if data[idx] == 255:
+                command = data[idx + 1]
+                if command == 0:
+                    loops.append(totaltime_us)
+                    idx += 2
+                elif command == 1:
+                    start = loops.pop()
+                    totaltime_us = start + (totaltime_us - start) * (data[idx + 2] + 256 * data[idx + 3])
+                    idx += 4
+                elif command == 2:
+                    totaltime_us += data[idx + 2] + 256 * data[idx + 3]
+                    idx += 4
+                else:
+                    raise RuntimeError(f"Unsupported chain command {command}")
+            else:
+                first = data[idx] if first is None else first
+                totaltime_us += self.__wave_length(data[idx], False)
+                idx += 1
+        self.__transmit(first, time(), totaltime_us)
+        print()
+        return 0
+
+    def __wave_length(self, wave_id, verbose):
+        waves = self.created[wave_id]
+        totaltime_us = 0
+        if verbose:
+            print(f"{len(waves)} wave(s)")
+        for pulses in waves:
             wavetime_us = 0
             for pulse in pulses:
                 wavetime_us += pulse.delay
-            on = self.__bits_set(pulses[0].gpio_on)
-            off = self.__bits_set(pulses[0].gpio_off)
-            print(f"  Wave, on: {on}, off: {off}, length: {len(pulses)} ({round(wavetime_us / 1000)} ms)")
+            if verbose:
+                on = self.__bits_set(pulses[0].gpio_on)
+                off = self.__bits_set(pulses[0].gpio_off)
+                print(f"  Wave, on: {on}, off: {off}, length: {len(pulses)} ({round(wavetime_us / 1000)} ms)")
             if wavetime_us > totaltime_us:
                 totaltime_us = wavetime_us
-        self.wave_end_time = time() + totaltime_us / 1000000
-        print()
-        return 0
+        return totaltime_us
+
+    def __transmit(self, wave_id, start, totaltime_us):
+        self.wave_end_time = start + totaltime_us / 1000000
+        self.transmissions = [tx for tx in self.transmissions if tx[2] > time()]
+        self.transmissions.append((wave_id, start, self.wave_end_time))
 
     def wave_get_max_pulses(self):
         return -1
@@ -0,0 +1,31 @@
+from io import BytesIO
+
+from musicpuncher.clock import VirtualClock
+from musicpuncher.keyboard import Keyboard
+from musicpuncher.music import write_midi
+from musicpuncher.music_puncher import MusicPuncher
+from musicpuncher.simulator import SimulatedPi
+
+# The configuration of a simulated puncher, shared by the tests. Tests that need a variant use dict(CONFIG, **{...}).
+STEPPER_CONFIG = {'enable-pin': 9, 'min-sps': 1000, 'max-sps': 3000, 'acceleration': 1000, 'reverse-dir': False}
+CONFIG = {
+    'idle-position': 10, 'row0': 100, 'tone-steps': 100.5, 'feed-steps': 100, 'minimal-feed': 50,
+    'cutter-position': -3000, 'end-feed': 5000,
+    'feed-stepper': dict(STEPPER_CONFIG, **{'dir-pin': 17, 'step-pin': 18}),
+    'tone-stepper': dict(STEPPER_CONFIG, **{'dir-pin': 22, 'step-pin': 23}),
+    'puncher': {'pin': 11, 'on-length': 0.2, 'off-length': 0.3},
+    'cutter': {'pin': 25, 'on-length': 0.2, 'off-length': 0.3},
+}
+KEYS = [48, 50, 52, 53, 55, 57, 59, 60]
+
+
+def simulated_puncher(config=CONFIG, keyboard: Keyboard = None) -> MusicPuncher:
+    """Returns a puncher on a SimulatedPi with its own VirtualClock, as puncher.pi and puncher.clock"""
+    clock = VirtualClock()
+    return MusicPuncher(config, keyboard or Keyboard(KEYS), SimulatedPi(config, clock), clock)
+
+
+def midi_bytes(noteseq) -> bytes:
+    file = BytesIO()
+    write_midi(noteseq, file=file)
+    return file.getvalue()
@@ -0,0 +1,52 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from musicpuncher.job import CompiledJob
+from musicpuncher.music import DelayNotes
+from tests.helpers import CONFIG, simulated_puncher
+
+CONFIG = dict(CONFIG, **{'waveform-engine': 'array'})
+NOTES = [DelayNotes(0, [48, 60]), DelayNotes(0.5, [50]), DelayNotes(40, [52, 53, 55]), DelayNotes(1, [60]),
+         DelayNotes(0.25, [48])]
+
+
+def test_compiled_job_survives_serialization():
+    job = simulated_puncher(CONFIG).compile(NOTES, waveforms=True)
+
+    loaded = CompiledJob.from_bytes(job.to_bytes())
+
+    assert loaded.fingerprint == job.fingerprint
+    assert loaded.feed_steps == job.feed_steps
+    assert loaded.steps == job.steps
+    assert loaded.waveforms.keys() == job.waveforms.keys()
+    for step, (waves, length) in job.waveforms.items():
+        loaded_waves, loaded_length = loaded.waveforms[step]
+        assert loaded_length == length
+        assert [wave.pack() for wave in loaded_waves] == [wave.pack() for wave in waves]
+
+
+def test_punching_a_job_is_the_same_as_punching_the_notes():
+    puncher = simulated_puncher(CONFIG)
+    puncher.run(NOTES)
+    expected = puncher.pi.report()
+
+    for waveforms in [False, True]:
+        job = CompiledJob.from_bytes(simulated_puncher(CONFIG).compile(NOTES, waveforms).to_bytes())
+        puncher = simulated_puncher(CONFIG)
+        puncher.run_job(job)
+        assert puncher.pi.report() == expected
+
+
+def test_job_of_another_configuration_is_rejected():
+    job = simulated_puncher(CONFIG).compile(NOTES)
+    puncher = simulated_puncher(dict(CONFIG, **{'tone-steps': 101}))
+
+    with pytest.raises(RuntimeError):
+        puncher.run_job(job)
+    assert 'compile it again' in puncher.error
+
+    with pytest.raises(RuntimeError):
+        CompiledJob.from_bytes(b'MThd' + job.to_bytes())
@@ -0,0 +1,94 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from musicpuncher.job_queue import JobQueue
+from musicpuncher.keyboard import Keyboard, TransposeError
+from musicpuncher.midi_cache import MidiCache
+from musicpuncher.music import DelayNotes
+from tests.helpers import CONFIG, KEYS, midi_bytes, simulated_puncher
+
+KEYBOARD = Keyboard(KEYS)
+SETTINGS = {'transposition': 0, 'autotranspose': False, 'autofit': False}
+
+
+def create_queue(directory) -> JobQueue:
+    return JobQueue(simulated_puncher(keyboard=KEYBOARD), MidiCache(KEYBOARD), str(directory))
+
+
+def test_queue_punches_all_cards_in_order(tmp_path):
+    queue = create_queue(tmp_path)
+    first = queue.add('first.mid', midi_bytes([DelayNotes(0, [48])]), SETTINGS)
+    second = queue.add('second.mid', midi_bytes([DelayNotes(0, [50]), DelayNotes(1, [52])]), SETTINGS)
+    third = queue.add('third.mid', midi_bytes([DelayNotes(0, [53]), DelayNotes(1, [55]), DelayNotes(1, [57])]),
+                      SETTINGS)
+    queue.move(third.id, 0)
+    queue.cancel(second.id)
+    assert [job['filename'] for job in queue.list()['jobs']] == ['third.mid', 'first.mid']
+
+    queue.start()
+
+    assert queue.join(timeout=10)
+    assert queue.list() == {'paused': False, 'jobs': []}
+    assert queue.puncher.pi.report()['holes'] == 4
+    assert queue.puncher.pi.report()['cuts'] == 2
+    assert os.listdir(tmp_path) == ['queue.json']
+
+
+def test_queue_is_restored_after_a_restart(tmp_path):
+    queue = create_queue(tmp_path)
+    queue.add('first.mid', midi_bytes([DelayNotes(0, [48])]), SETTINGS)
+    queue.add('second.mid', midi_bytes([DelayNotes(0, [50])]), SETTINGS)
+
+    restored = create_queue(tmp_path)
+
+    assert [job['filename'] for job in restored.list()['jobs']] == ['first.mid', 'second.mid']
+    restored.start()
+    assert restored.join(timeout=10)
+    assert restored.puncher.pi.report()['holes'] == 2
+
+
+def test_queue_rejects_notes_that_do_not_fit(tmp_path):
+    queue = create_queue(tmp_path)
+
+    with pytest.raises(TransposeError):
+        queue.add('wrong.mid', midi_bytes([DelayNotes(0, [49])]), SETTINGS)
+    assert queue.list()['jobs'] == []
+
+
+def test_card_that_is_cancelled_while_starting_is_not_punched(tmp_path):
+    queue = create_queue(tmp_path)
+    entry = queue.add('first.mid', midi_bytes([DelayNotes(0, [48]), DelayNotes(1, [50])]), SETTINGS)
+    on = queue.puncher.on
+    queue.puncher.on = lambda: (queue.cancel(entry.id), on())  # the cancel comes just before the puncher starts
+
+    queue.start()
+
+    assert queue.join(timeout=10)
+    assert queue.puncher.pi.report()['holes'] == 0
+    assert queue.list() == {'paused': True, 'jobs': []}
+
+
+def test_jobs_without_their_file_fail_after_a_restart(tmp_path):
+    queue = create_queue(tmp_path)
+    first = queue.add('first.mid', midi_bytes([DelayNotes(0, [48])]), SETTINGS)
+    queue.add('second.mid', midi_bytes([DelayNotes(0, [50])]), SETTINGS)
+    os.remove(tmp_path / first.data_file())
+
+    restored = create_queue(tmp_path)
+
+    assert [(job['filename'], job['status']) for job in restored.list()['jobs']] == [('first.mid', 'error'),
+                                                                                     ('second.mid', 'queued')]
+    restored.start()
+    assert restored.join(timeout=10)
+    assert restored.puncher.pi.report()['holes'] == 1
+
+
+def test_compiling_records_no_metrics():
+    puncher = simulated_puncher(dict(CONFIG, metrics=True), KEYBOARD)
+
+    puncher.compile([DelayNotes(0, [48]), DelayNotes(1, [50])], waveforms=True)
+
+    assert puncher.metrics.as_dict()['durations'] == {}
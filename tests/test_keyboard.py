@@ -3,7 +3,7 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import pytest
-from musicpuncher.keyboard import Keyboard, TransposeError
+from musicpuncher.keyboard import Keyboard, TransposeError, note_mask
 
 C_MAJOR_SINGLE = [60, 62, 64, 65, 67, 69, 71, 72]
 
@@ -71,3 +71,41 @@ def test_get_index_respects_keyboard_order():
     assert keyboard.get_index(62) == 6
     assert keyboard.get_index(71) == 1
     assert keyboard.get_index(72) == 0
+
+
+def test_rank_transpositions_lists_unmapped_notes_per_transposition():
+    keyboard = Keyboard(C_MAJOR_SINGLE, reverse=False)
+
+    ranking = keyboard.rank_transpositions({60, 61, 64})
+
+    by_transposition = {tp.transposition: tp for tp in ranking}
+    assert by_transposition[0].unmapped_notes() == {61}
+    assert by_transposition[0].unmapped_count == 1
+    assert by_transposition[1].unmapped_notes() == {60}
+    assert by_transposition[2].unmapped_notes() == {61, 64}
+    assert [tp.rank() for tp in ranking] == sorted(tp.rank() for tp in ranking)
+    assert keyboard.calculate_transposition({60, 61, 64}, best_effort=True) == ranking[0].transposition
+
+
+def test_rank_transpositions_is_cached_per_note_set():
+    keyboard = Keyboard(C_MAJOR_SINGLE, reverse=False)
+
+    assert keyboard.rank_transpositions({60, 64}) is keyboard.rank_transpositions({64, 60})
+
+
+def test_rank_transpositions_skips_notes_outside_the_midi_range():
+    keyboard = Keyboard(C_MAJOR_SINGLE, reverse=False)
+
+    assert note_mask({-1, 0, 128}) == 1
+    ranking = keyboard.rank_transpositions({-2, 60, 61})
+
+    assert len(ranking) > 0
+    assert all(tp.unmapped_notes() <= {60, 61} for tp in ranking)
+
+
+def test_notes_outside_the_midi_range_do_not_fit():
+    keyboard = Keyboard(C_MAJOR_SINGLE)
+
+    assert keyboard.does_fit({60, 72})
+    assert not keyboard.does_fit({60, -1})
+    assert not keyboard.does_fit({128})
@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from musicpuncher.lru import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_get_or_create_counts_hits_and_misses():
+    cache = LRUCache(10)
+    created = []
+
+    def factory():
+        created.append(1)
+        return len(created)
+
+    assert cache.get_or_create('x', factory) == 1
+    assert cache.get_or_create('x', factory) == 1
+    assert cache.get_or_create('y', factory) == 2
+
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 2
+    assert len(cache) == 2
+
+
+def test_zero_size_disables_caching():
+    cache = LRUCache(0)
+    cache.put('a', 1)
+    assert cache.get('a') is None
@@ -0,0 +1,62 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from musicpuncher.metrics import Metrics, NULL_METRICS
+from musicpuncher.music import DelayNotes
+from tests.helpers import CONFIG, KEYS, simulated_puncher
+
+CONFIG = dict(CONFIG, metrics=True)
+
+
+def test_metrics_count_and_time_the_phases_of_a_card():
+    puncher = simulated_puncher(CONFIG)
+
+    puncher.run([DelayNotes(0, [48, 60]), DelayNotes(0.5, [50]), DelayNotes(40, [52])])
+
+    metrics = puncher.metrics.as_dict()
+    report = puncher.pi.report()
+    assert metrics['counters'] == {'steps.feed': report['travel']['feed'], 'steps.tone': report['travel']['tone'],
+                                   'holes': 4, 'cuts': 1}
+    durations = metrics['durations']
+    assert durations['punch.sleep']['count'] == 4
+    assert durations['punch.sleep']['buckets'] == {'<=1.0': 4}  # on-length and clear-length
+    assert durations['wave.overshoot']['count'] == durations['wave.send']['count']
+    assert durations['card']['count'] == 1
+    assert 'waveform.build' in durations and 'wave.create' in durations and 'wave.gap' in durations
+
+
+def test_disabled_metrics_record_nothing():
+    NULL_METRICS.count('holes')
+    NULL_METRICS.observe('card', 1.0)
+    with NULL_METRICS.timer('wave.send'):
+        pass
+
+    assert NULL_METRICS.as_dict() == {'enabled': False}
+    metrics = Metrics()
+    with metrics.timer('wave.send'):
+        pass
+    assert metrics.as_dict()['durations']['wave.send']['count'] == 1
+
+
+def test_hardware_timed_holes_are_counted_when_their_wave_is_done():
+    config = dict(CONFIG, **{'puncher': dict(CONFIG['puncher'], **{'hardware-timed': True}),
+                             'cutter': dict(CONFIG['cutter'], **{'hardware-timed': True})})
+    notes = [DelayNotes(0.5, [KEYS[idx % len(KEYS)]]) for idx in range(10)]
+    for stop_at in [None, 4]:
+        puncher = simulated_puncher(config)
+        notify = puncher.notifier.notify
+
+        def stop_after_step():
+            if puncher.step == stop_at:
+                puncher.stopRequested = True
+            notify()
+
+        puncher.notifier.notify = stop_after_step
+        puncher.run(notes)
+
+        counters = puncher.metrics.as_dict()['counters']
+        report = puncher.pi.report()
+        assert (counters['holes'], counters.get('cuts', 0)) == (report['holes'], report['cuts'])
+        assert report['holes'] == (10 if stop_at is None else stop_at + 2)  # the wave of the next step was running
@@ -0,0 +1,42 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from musicpuncher.keyboard import Keyboard, TransposeError
+from musicpuncher.midi_cache import MidiCache
+from musicpuncher.music import DelayNotes, NoteStream
+from tests.helpers import midi_bytes
+
+C_MAJOR_SINGLE = [60, 62, 64, 65, 67, 69, 71, 72]
+
+
+def test_prepare_matches_note_stream_and_reuses_parsed_notes():
+    keyboard = Keyboard(C_MAJOR_SINGLE)
+    cache = MidiCache(keyboard)
+    data = midi_bytes([DelayNotes(1, [61]), DelayNotes(1, [64, 65]), DelayNotes(1, [67, 70])])
+
+    autofitted = cache.prepare(data, transposition=3, autofit=True)
+    expected = NoteStream.midi(data=data).transpose(3).autofit(keyboard).consolidate()
+    assert autofitted == list(expected)
+
+    transposed = cache.prepare(data, autotranspose=True, autofit=True)
+    expected = NoteStream.midi(data=data).autotranspose(keyboard, best_effort=True).autofit(keyboard).consolidate()
+    assert transposed == list(expected)
+
+    assert cache.prepare(data, transposition=3, autofit=True) is autofitted
+    stats = cache.stats()
+    assert stats['parsed']['misses'] == 1 and stats['parsed']['hits'] == 2
+    assert stats['results']['misses'] == 2 and stats['results']['hits'] == 1
+
+
+def test_prepare_rejects_notes_that_do_not_fit():
+    cache = MidiCache(Keyboard(C_MAJOR_SINGLE))
+    data = midi_bytes([DelayNotes(1, [61])])
+
+    with pytest.raises(TransposeError):
+        cache.prepare(data, transposition=0)
+    assert [list(chord.notes) for chord in cache.prepare(data, transposition=1)] == [[62]]
+    with pytest.raises(TransposeError):
+        cache.prepare(data, transposition=-70)
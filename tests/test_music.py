@@ -1,8 +1,12 @@
 import os
 import sys
+from io import BytesIO
+
+import pytest
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from musicpuncher import music
 from musicpuncher.music import *
 
 C_MAJOR_SINGLE = [60, 62, 64, 65, 67, 69, 71, 72]
@@ -29,3 +33,112 @@ def test_consolidate():
     assert noteseq == [DelayNotes(1, [64]), DelayNotes(1, []), DelayNotes(1, [67])]
 
     assert result == [DelayNotes(1, [64]), DelayNotes(2, [67])]
+
+
+def mido_parse_midi(file):
+    # The original implementation on top of mido, as a reference for the streaming midi reader
+    notes = []
+    with MidiFile(file=file) as mid:
+        notes_on = set()
+        delta = 0
+        for msg in mid:
+            if msg.time != 0:
+                if len(notes_on) > 0:
+                    notes.append(DelayNotes(delta, list(notes_on)))
+                    delta = 0
+                delta += msg.time
+                notes_on.clear()
+            if msg.type == 'note_on' and msg.velocity >= MIN_VELOCITY:
+                notes_on.add(msg.note)
+    return notes
+
+
+def multi_track_midi() -> bytes:
+    mid = MidiFile(ticks_per_beat=96)
+    melody = MidiTrack()
+    melody.append(MetaMessage('set_tempo', tempo=400000))
+    for idx in range(40):
+        melody.append(Message('note_on', note=60 + idx % 12, velocity=10 + idx * 3, time=24 if idx % 3 else 0))
+        melody.append(Message('note_off', note=60 + idx % 12, time=12))
+    melody.append(MetaMessage('set_tempo', tempo=900000, time=5))
+    melody.append(Message('note_on', note=72, velocity=80, time=7))
+    bass = MidiTrack()
+    bass.append(Message('program_change', program=3))
+    for idx in range(10):
+        bass.append(Message('note_on', channel=1, note=36 + idx, velocity=90, time=36))
+        bass.append(Message('control_change', channel=1, control=64, value=127))
+    bass.append(MetaMessage('end_of_track', time=500))
+    mid.tracks += [melody, bass]
+    file = BytesIO()
+    mid.save(file=file)
+    return file.getvalue()
+
+
+def test_streaming_reader_matches_mido():
+    data = multi_track_midi()
+    with open(os.path.join(os.path.dirname(__file__), '..', 'example.mid'), 'rb') as file:
+        example = file.read()
+
+    for midi in [data, example]:
+        assert parse_midi(file=BytesIO(midi)) == mido_parse_midi(BytesIO(midi))
+
+
+def test_truncated_midi_names_the_bad_chunk():
+    data = multi_track_midi()
+    for length in range(len(data)):
+        with pytest.raises(ValueError, match='MThd|MTrk'):
+            list(iter_midi(data=data[:length]))
+
+
+def test_stream_keeps_only_the_last_stage(monkeypatch):
+    keyboard = Keyboard(C_MAJOR_SINGLE)
+    notes = consolidate(autofit(apply_transposition(parse_midi(file=BytesIO(multi_track_midi())), 2), keyboard))
+    parses = []
+    read_midi_events = music.read_midi_events
+    monkeypatch.setattr(music, 'read_midi_events', lambda data: parses.append(data) or read_midi_events(data))
+    transposed = NoteStream.midi(data=multi_track_midi()).transpose(2)
+    fitted = transposed.autofit(keyboard)
+    stream = fitted.consolidate()
+
+    assert list(stream) == notes
+    assert list(stream) == notes
+    assert get_notes(stream) <= set(C_MAJOR_SINGLE)
+    assert minimum_same_pitch_delta(stream) == minimum_same_pitch_delta(notes)
+    assert len(parses) == 2  # the pre-scan of autofit and the first iteration
+    assert transposed.notes is None and fitted.notes is None
+
+
+def random_notes(count, seed=1):
+    from random import Random
+    random = Random(seed)
+    return [DelayNotes(random.choice([0, 0.125, 0.5, 1]), random.sample(range(55, 75), random.choice([0, 1, 1, 3])))
+            for _ in range(count)]
+
+
+def test_note_array_behaves_like_list():
+    noteseq = random_notes(200)
+    notes = NoteArray.of(noteseq)
+
+    assert len(notes) == 200
+    assert notes == noteseq
+    assert list(notes) == noteseq
+    assert notes[3] == noteseq[3]
+    assert notes[-1] == noteseq[-1]
+    assert notes[10:20] == noteseq[10:20]
+    assert notes[10:20][2:4] == noteseq[12:14]
+    assert notes[::7] == noteseq[::7]
+    assert notes[50:10] == []
+    assert NoteArray.of(noteseq[10:20]) == notes[10:20]
+
+
+def test_note_array_bulk_operations_match_list_operations():
+    keyboard = Keyboard(C_MAJOR_SINGLE)
+    noteseq = random_notes(500)
+    notes = NoteArray.of(noteseq)
+
+    assert get_notes(notes) == get_notes(noteseq)
+    assert apply_transposition(notes, 3) == apply_transposition(noteseq, 3)
+    assert consolidate(notes) == consolidate(noteseq)
+    assert autofit(notes, keyboard) == autofit(noteseq, keyboard)
+    assert adjust(notes, '60+,62--') == adjust(noteseq, '60+,62--')
+    assert isinstance(consolidate(autofit(notes, keyboard)), NoteArray)
@@ -0,0 +1,54 @@
+import os
+import sys
+from random import Random
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from musicpuncher.planner import Chord, GreedyPlanner, LookaheadPlanner, create_planner
+
+
+def random_chords(count, seed=1):
+    random = Random(seed)
+    return [Chord(random.randint(0, 200), sorted(random.sample(range(100, 3000, 100), random.randint(1, 4))))
+            for _ in range(count)]
+
+
+def test_greedy_starts_at_nearest_end():
+    planner = GreedyPlanner()
+
+    assert list(planner.plan(14, [Chord(10, [10, 20]), Chord(10, [0])])) == [(10, -4), (0, 10), (10, -20)]
+
+
+def test_lookahead_considers_next_chord():
+    planner = LookaheadPlanner(2)
+
+    assert list(planner.plan(14, [Chord(10, [10, 20]), Chord(10, [0])])) == [(10, 6), (0, -10), (10, -10)]
+    assert planner.stats.tone_travel == 26
+    assert planner.stats.greedy_tone_travel == 34
+    assert planner.stats.saved_tone_travel() == 8
+
+
+def test_lookahead_is_never_worse_than_greedy():
+    chords = random_chords(1000)
+    planner = LookaheadPlanner(8)
+
+    steps = list(planner.plan(0, chords))
+
+    assert planner.stats.saved_wave_steps() >= 0
+    assert sum(abs(step[1]) for step in steps) == planner.stats.tone_travel
+    assert sum(step[0] for step in steps) == sum(chord.delay for chord in chords)
+
+
+def test_lookahead_work_is_linear_in_chords_and_depth():
+    chords = random_chords(10000)
+    planner = LookaheadPlanner(8)
+
+    list(planner.plan(0, chords))
+
+    # two orders for the first chord and two candidates for both ends of every other chord in the window
+    assert planner.stats.transitions <= len(chords) * (2 + 4 * 7)
+
+
+def test_create_planner():
+    assert isinstance(create_planner(None), GreedyPlanner)
+    assert isinstance(create_planner({'strategy': 'lookahead', 'depth': 4}), LookaheadPlanner)
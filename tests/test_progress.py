@@ -0,0 +1,86 @@
+import os
+import sys
+from array import array
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from musicpuncher.clock import VirtualClock
+from musicpuncher.music import DelayNotes
+from musicpuncher.progress import Estimate, ProgressModel
+from tests.helpers import CONFIG, simulated_puncher
+
+
+def test_remaining_time_is_corrected_by_the_measured_time():
+    clock = VirtualClock()
+    model = ProgressModel(Estimate(array('d', [1.0, 1.0, 2.0]), array('I', [1, 1, 1]), 1.0, 0), clock, prior=0.0)
+    for time in [1.0, 1.0, 2.0]:
+        model.planned(time)
+        model.chord_planned()
+    assert model.remaining() == 5.0
+
+    clock.sleep(0.5)
+    assert model.remaining() == 4.5  # counts down during a step
+    clock.sleep(1.5)  # the first step takes twice the predicted time
+    model.step_done()
+
+    assert model.correction() == 2.0
+    assert model.remaining() == 2 * 4.0
+    assert model.progress() == 2.0 / 10.0
+
+
+def test_prior_damps_the_first_corrections():
+    clock = VirtualClock()
+    model = ProgressModel(Estimate(array('d', [1.0] * 10), array('I', [1] * 10), 0.0, 0), clock, prior=10.0)
+    for _ in range(10):
+        model.planned(1.0)
+        model.chord_planned()
+
+    clock.sleep(3.0)
+    model.step_done()
+
+    assert model.remaining() == 9.0 * 13.0 / 11.0
+
+
+def test_planned_steps_replace_the_estimate_of_their_chord():
+    model = ProgressModel(Estimate(array('d', [3.0, 1.0]), array('I', [2, 1]), 0.5, 0), VirtualClock())
+    assert model.remaining() == 4.5
+
+    model.planned(1.0)
+    assert model.remaining() == 4.5  # the chord is not planned completely
+    model.planned(0.5)
+    model.chord_planned()
+    assert model.remaining() == 3.0
+    model.chord_planned()  # a chord without steps, its hole is at the position of the previous one
+    assert model.remaining() == 2.0
+    assert model.steps == 2
+
+
+def test_status_predicts_the_time_of_a_simulated_card():
+    notes = [DelayNotes(0, [48, 60]), DelayNotes(0.5, [50, 57]), DelayNotes(20, [52, 53, 55]), DelayNotes(5, [60])]
+    puncher = simulated_puncher()
+    statuses = []
+    notify = puncher.notifier.notify
+    puncher.notifier.notify = lambda: (notify(), statuses.append(puncher.status()))
+
+    puncher.run(notes)
+
+    punching = [status for status in statuses if status['remaining'] is not None]
+    first, last = punching[0], punching[-1]
+    assert first['elapsed'] == 0.0
+    assert abs(first['remaining'] - last['elapsed']) < 0.05 * last['elapsed']
+    assert [status['progress'] for status in punching] == sorted(status['progress'] for status in punching)
+    assert puncher.status()['remaining'] is None
+
+
+def test_steps_of_chords_with_repeated_positions_are_counted_like_the_planner():
+    # with less than a tone step per key, neighbouring keys share a position, which is punched once
+    notes = [DelayNotes(0, [48, 50]), DelayNotes(0.5, [52, 53, 57]), DelayNotes(1, [60])]
+    puncher = simulated_puncher(dict(CONFIG, **{'tone-steps': 0.4}))
+    statuses = []
+    notify = puncher.notifier.notify
+    puncher.notifier.notify = lambda: (notify(), statuses.append(puncher.status()))
+
+    puncher.run(notes)
+
+    assert puncher.pi.report()['holes'] == 4
+    assert {status['steps'] for status in statuses if status['remaining'] is not None} == {4}
@@ -0,0 +1,149 @@
+import os
+import sys
+
+import pigpio
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from musicpuncher.clock import VirtualClock
+from musicpuncher.music import DelayNotes
+from musicpuncher.simulator import SimulatedPi
+from tests.helpers import CONFIG, KEYS, simulated_puncher
+
+CONFIG = dict(CONFIG, **{
+    'tone-stepper': dict(CONFIG['tone-stepper'], **{'reverse-dir': True}),
+    'zero-button': {'pin': 24},
+    'puncher': dict(CONFIG['puncher'], **{'clear-length': 0.1}),
+    'simulator': {'zero-button-position': -700},
+})
+
+
+def simulate(notes, config=CONFIG):
+    puncher = simulated_puncher(config)
+    puncher.run(notes)
+    return puncher.pi.report()
+
+
+def test_virtual_clock_advances_by_sleeping():
+    clock = VirtualClock(10.0)
+    clock.sleep(1.5)
+    clock.sleep(-1)
+
+    assert clock.time() == 11.5
+
+
+def test_simulated_run_counts_holes_and_travel():
+    notes = [DelayNotes(0, [48, 60]), DelayNotes(0.5, [50]), DelayNotes(40, [52, 53, 55]), DelayNotes(1, [60])]
+
+    report = simulate(notes)
+
+    assert report['holes'] == 7
+    assert report['cuts'] == 1
+    assert report['position'] == {'feed': 4150 + 5000, 'tone': -700 + 10}
+    assert report['travel']['feed'] == 4150 + 5000
+    assert report['machine_time'] > report['wave_time'] > 4150 / 3000
+    assert simulate(notes) == report
+
+
+def test_simulated_run_with_hardware_timed_actions():
+    config = dict(CONFIG, puncher=dict(CONFIG['puncher'], **{'hardware-timed': True}),
+                  cutter=dict(CONFIG['cutter'], **{'hardware-timed': True}))
+    notes = [DelayNotes(0, [48]), DelayNotes(60, [57]), DelayNotes(0.1, [50])]
+
+    report = simulate(notes, config)
+
+    assert report['holes'] == 3
+    assert report['cuts'] == 1
+    assert report['position'] == {'feed': 6010 + 5000, 'tone': -700 + 10}
+
+
+def test_streamed_run_punches_like_a_compiled_job():
+    notes = [DelayNotes(0, [48, 60]), DelayNotes(0.5, [50, 57]), DelayNotes(20, [52, 53, 55]), DelayNotes(25, [60])]
+    config = dict(CONFIG, **{'step-buffer': 1})
+    puncher = simulated_puncher(config)
+    pi = puncher.pi
+    job = puncher.compile(notes)
+
+    puncher.run_job(job)
+    from_job = pi.report()
+    puncher.run(notes)
+
+    assert pi.report()['holes'] == 2 * from_job['holes'] == 2 * 8
+    assert pi.report()['cuts'] == 2
+    assert puncher.status()['steps'] == len(job.steps)
+    assert simulate(notes, config) == from_job
+
+
+def test_streamed_run_rejects_empty_chords_before_moving():
+    puncher = simulated_puncher(CONFIG)
+
+    with pytest.raises(RuntimeError, match='Empty note set'):
+        puncher.run([DelayNotes(0, [48]), DelayNotes(1, [])])
+
+    assert puncher.pi.report()['holes'] == 0
+
+
+def test_waveforms_built_ahead_punch_like_waveforms_built_in_place():
+    notes = [DelayNotes(0, [48, 60]), DelayNotes(0.5, [50, 57]), DelayNotes(40, [52, 53, 55]), DelayNotes(1, [60])]
+    config = dict(CONFIG, **{'waveform-lookahead': 2})
+    puncher = simulated_puncher(config)
+
+    puncher.run(notes)
+
+    assert puncher.lookahead_stats.takes == puncher.status()['steps'] == 8
+    assert simulate(notes, config) == simulate(notes, dict(CONFIG, **{'waveform-lookahead': 0}))
+
+
+def test_wave_memory_is_freed_like_pigpio():
+    pi = SimulatedPi(CONFIG, VirtualClock())
+    for pulses in [3, 4, 5]:
+        pi.wave_add_generic([pigpio.pulse(0, 0, 10)] * pulses)
+        pi.wave_create()
+
+    pi.wave_delete(1)
+    assert len(pi.allocated) == 3  # not freed while wave 2 exists
+    pi.wave_add_generic([pigpio.pulse(0, 0, 10)] * 4)
+    assert pi.wave_create() == 1  # same size, reused
+    pi.wave_delete(1)
+    pi.wave_delete(2)
+    assert len(pi.allocated) == 1
+
+
+def test_long_card_does_not_run_out_of_wave_ids():
+    notes = [DelayNotes(0.5 + (idx % 7) * 0.1, [KEYS[idx * 5 % len(KEYS)]]) for idx in range(400)]
+
+    report = simulate(notes)
+
+    assert report['holes'] == 400
+    assert report['position']['tone'] == -700 + 10
+
+
+@pytest.mark.parametrize('hardware_timed', [False, True])
+def test_long_card_never_waits_for_wave_memory(hardware_timed):
+    notes = [DelayNotes(0.5 + (idx % 7) * 0.1, [KEYS[idx * 5 % len(KEYS)]]) for idx in range(400)]
+    puncher = simulated_puncher(dict(CONFIG, **{
+        'metrics': True, 'puncher': dict(CONFIG['puncher'], **{'hardware-timed': hardware_timed})}))
+
+    puncher.run(notes)
+
+    assert puncher.pi.report()['waves'] == 402
+    assert puncher.metrics.as_dict()['counters'].get('wave.stalls', 0) == 0
+
+
+def test_cut_follows_the_punch_of_its_step():
+    notes = [DelayNotes(0.5, [KEYS[idx % len(KEYS)]]) for idx in range(20)]
+    orders = []
+    for timed in [False, True]:
+        config = dict(CONFIG, **{'puncher': dict(CONFIG['puncher'], **{'hardware-timed': timed}),
+                                 'cutter': dict(CONFIG['cutter'], **{'hardware-timed': timed})})
+        puncher = simulated_puncher(config)
+        puncher.run(notes)
+        orders.append(puncher.pi.solenoids)
+
+    software, hardware = orders
+    assert software.count('cut') == 1 and software.index('cut') > 0 and software[software.index('cut') - 1] == 'hole'
+    assert hardware == software
+
+    with pytest.raises(RuntimeError, match='hardware-timed'):
+        simulated_puncher(dict(CONFIG, **{'cutter': dict(CONFIG['cutter'], **{'hardware-timed': True})}))
@@ -0,0 +1,27 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from musicpuncher.clock import VirtualClock
+from musicpuncher.status_stream import StatusNotifier, status_events
+
+
+def test_status_events_coalesce_changes():
+    status = {'progress': 0.0}
+    notifier = StatusNotifier()
+    clock = VirtualClock()
+    events = status_events(lambda: dict(status), notifier, max_rate=4, keepalive=0.01, clock=clock)
+
+    assert json.loads(next(events)[len('data: '):]) == {'progress': 0.0}
+
+    for progress in [0.1, 0.2, 0.3]:
+        status['progress'] = progress
+        notifier.notify()
+    assert json.loads(next(events)[len('data: '):]) == {'progress': 0.3}
+    assert clock.time() == 0.25  # waited before the next event
+
+    assert next(events) == ": keepalive\n\n"
+    notifier.notify()  # without a change of the status
+    assert next(events) == ": keepalive\n\n"
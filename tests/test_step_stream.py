@@ -0,0 +1,94 @@
+import os
+import sys
+import threading
+import time
+from array import array
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from musicpuncher.music import DelayNotes
+from musicpuncher.progress import Estimate, ProgressModel
+from musicpuncher.step_stream import Prefetcher, StepStream
+from tests.helpers import CONFIG, simulated_puncher
+
+
+def test_streams_all_steps_in_order_through_a_small_buffer():
+    steps = [(i, -i) for i in range(100)]
+
+    estimate = Estimate(array('d', [0.1] * 100), array('I', [1] * 100), 0.0, 4950)
+    stream = StepStream(lambda: iter(steps), ProgressModel(estimate), buffer=2)
+
+    assert list(stream) == steps
+    assert stream.progress.estimate.total_feed == 4950
+
+
+def test_planner_errors_are_raised_by_the_consumer():
+    def plan():
+        yield (1, 2)
+        raise RuntimeError("planner failed")
+
+    stream = Prefetcher(plan)
+
+    with pytest.raises(RuntimeError, match='planner failed'):
+        list(stream)
+
+
+def test_close_stops_the_producer():
+    planned = []
+
+    def plan():
+        for i in range(1000):
+            planned.append(i)
+            yield (i, 0)
+
+    stream = Prefetcher(plan, buffer=2)
+    assert next(iter(stream)) == (0, 0)
+    stream.close()
+    stream.thread.join(1)
+
+    assert not stream.thread.is_alive()
+    assert len(planned) < 10
+
+
+def test_counts_starvation_when_the_producer_is_slow():
+    def produce():
+        for i in range(5):
+            time.sleep(0.01)
+            yield i
+
+    prefetcher = Prefetcher(produce, buffer=4)
+
+    assert list(prefetcher) == [0, 1, 2, 3, 4]
+    assert prefetcher.stats.takes == 5
+    assert prefetcher.stats.starved == 4  # waiting for the first item is not starving
+    assert prefetcher.stats.waits.total > 0
+
+
+def test_close_wakes_a_waiting_consumer():
+    blocked = threading.Event()
+
+    def produce():
+        blocked.wait(5)
+        yield 1
+
+    prefetcher = Prefetcher(produce)
+    consumer = threading.Thread(target=lambda: list(prefetcher))
+    consumer.start()
+    prefetcher.close()
+    consumer.join(1)
+    blocked.set()
+
+    assert not consumer.is_alive()
+
+
+def test_step_count_of_the_progress_matches_the_streamed_steps():
+    # with less than a tone step per key, neighbouring keys share a position, which is punched once
+    config = dict(CONFIG, **{'tone-steps': 0.4, 'planner': {'strategy': 'lookahead', 'depth': 3}})
+    notes = [DelayNotes(0, [48, 50]), DelayNotes(0.5, [52, 53, 57]), DelayNotes(1, [48, 60]), DelayNotes(1, [55])]
+    puncher = simulated_puncher(config)
+
+    puncher.run(notes)
+
+    assert puncher.progress_model.steps == puncher.pi.report()['holes'] == 6
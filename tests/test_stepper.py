@@ -1,9 +1,17 @@
 import os
 import sys
+from array import array
+from time import time
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from musicpuncher.music_puncher import calculate_acceleration_profile
+import pigpio
+import pigpio_mock
+from musicpuncher import waveform
+from musicpuncher.waveform import create_chain_plan
+from musicpuncher.music_puncher import calculate_acceleration_profile, PiGPIOStepperMotor, Steppers, Puncher, \
+    WaveCompletion
+from tests.helpers import CONFIG
 
 
 def test_calculate_acceleration_profile1():
@@ -23,3 +31,211 @@ def test_calculate_acceleration_profile2():
     for delay in profile:
         print("%0.2fs: %0.3f %3.0f" % (total, delay, 1 / delay))
         total += delay
+
+
+FEED_CONFIG = CONFIG['feed-stepper']
+TONE_CONFIG = CONFIG['tone-stepper']
+
+
+def test_synchronization_does_not_modify_cached_waveforms():
+    pi = pigpio_mock.pi()
+    feed = PiGPIOStepperMotor(pi, FEED_CONFIG)
+    tone = PiGPIOStepperMotor(pi, TONE_CONFIG)
+    steppers = Steppers(pi, [feed, tone])
+
+    short = [pulse.delay for pulse in feed.move_waveform(10)]
+    steppers.prepare_waveform([10, 100])
+    steppers.prepare_waveform([10, 100])
+
+    assert [pulse.delay for pulse in feed.move_waveform(10)] == short
+    assert steppers.waveform_cache.stats()['hits'] == 1
+    assert feed.waveform_cache.stats()['misses'] == 1
+    lengths = [sum(pulse.delay for pulse in wave) for wave in pi.created[steppers.prepared[-1].ids[0]]]
+    assert abs(lengths[0] - lengths[1]) < 100
+
+
+def test_array_engine_creates_same_pulses():
+    pi = pigpio_mock.pi()
+    stepper = PiGPIOStepperMotor(pi, dict(FEED_CONFIG, **{'max-sps': 1200}), engine='array')
+
+    for steps in [1, 2, 3, 10, 399, 400, 401, 1000, -1, -7, -1000]:
+        expected = [(p.gpio_on, p.gpio_off, p.delay) for p in stepper.create_move_waveform(steps)]
+        actual = [(p.gpio_on, p.gpio_off, p.delay) for p in stepper.create_move_array(steps).pulses()]
+        assert actual == expected
+
+
+def test_array_engine_packs_wire_format():
+    pi = pigpio_mock.pi()
+    stepper = PiGPIOStepperMotor(pi, FEED_CONFIG, engine='array')
+    wave = stepper.create_move_array(3)
+
+    words = array('I', wave.pack(100))
+    assert list(words[:3]) == [0, 0, 100]
+    assert list(words[3:]) == [value for pulse in wave.pulses() for value in
+                               (pulse.gpio_on, pulse.gpio_off, pulse.delay)]
+    assert wave.scaled(2.0).length() == wave.length() * 2
+
+
+def test_packed_pulses_fall_back_to_wave_add_generic(monkeypatch):
+    class Connected(pigpio_mock.pi):
+        sl = None  # like a connected pigpio.pi
+
+    pi = Connected()
+    wave = PiGPIOStepperMotor(pi, FEED_CONFIG, engine='array').create_move_array(3)
+    commands = []
+    monkeypatch.setattr(pigpio, '_pigpio_command_ext', lambda *args: commands.append(args) or 0)
+
+    waveform.wave_add_packed(pi, wave.pack(), len(wave))  # not enabled
+    monkeypatch.setattr(waveform, 'PACKED_COMMAND', False)
+    waveform.wave_add_packed(pi, wave.pack(), len(wave), packed_command=True)  # private names missing
+
+    assert pi.wave_get_pulses() == 2 * len(wave)
+    assert commands == []
+
+
+def test_engines_split_long_waves_the_same_way():
+    created = []
+    for engine in ['pulses', 'array']:
+        pi = pigpio_mock.pi()
+        steppers = Steppers(pi, [PiGPIOStepperMotor(pi, FEED_CONFIG, engine=engine)], chain_pulses=100000)
+        steppers.prepare_waveform([3000])
+        created.append([[(p.gpio_on, p.gpio_off, p.delay) for p in part]
+                        for part in pi.created[steppers.prepared[-1].ids[0]]])
+
+    pulses, arrays = created
+    assert [len(part) for part in pulses] == [5000, 1001]
+    assert pulses[1][0] == (0, 0, sum(delay for _, _, delay in pulses[0]))  # the second part starts after the first
+    assert pulses == arrays
+
+
+def test_actions_are_appended_to_the_move():
+    pi = pigpio_mock.pi()
+    feed = PiGPIOStepperMotor(pi, FEED_CONFIG)
+    steppers = Steppers(pi, [feed])
+    puncher = Puncher(pi, {'pin': 11, 'on-length': 0.2, 'off-length': 0.3, 'hardware-timed': True})
+
+    steppers.prepare_waveform([10])
+    move_length = round(steppers.prepared_wave_length * 1000000)
+    steppers.prepare_waveform([10], [puncher])
+
+    assert round(steppers.prepared_wave_length * 1000000) == move_length + 500000
+    assert [(p.gpio_on, p.gpio_off, p.delay) for p in pi.created[steppers.prepared[-1].ids[0]][-1]] == \
+           [(0, 0, move_length), (1 << 11, 0, 200000), (0, 1 << 11, 300000)]
+
+
+def test_finished_waves_are_deleted_and_next_wave_is_queued():
+    pi = pigpio_mock.pi()
+    steppers = Steppers(pi, [PiGPIOStepperMotor(pi, FEED_CONFIG)])
+    steppers.on()
+
+    steppers.prepare_waveform([10])
+    steppers.create_and_send_wave()
+    steppers.prepare_waveform([20])
+    steppers.create_and_send_wave()  # queued behind the first wave
+
+    assert len(pi.created) == 2
+    steppers.wait_for_wave()
+    assert len(pi.created) == 1
+    steppers.wait_for_wave()
+    assert len(pi.created) == 0
+    assert steppers.gap_stats().count == 1
+    assert steppers.gap_stats().maximum == 0.0
+
+
+def test_wave_completion_polls_until_done_and_records_overshoot():
+    completion = WaveCompletion({'margin': 0.0, 'poll-interval': 0.001, 'max-poll-interval': 0.004,
+                                 'calibrate': True})
+    answers = [True, True, True, False]
+
+    completion.wait(time(), lambda: answers.pop(0))
+
+    assert completion.polls == 3
+    assert completion.late_waves == 1
+    assert completion.overshoot.count == 1
+    assert completion.overshoot.maximum >= 0.001 + 0.002 + 0.004
+    assert completion.offset > 0
+
+
+def test_long_moves_are_sent_as_chain():
+    pi = pigpio_mock.pi()
+    feed = PiGPIOStepperMotor(pi, FEED_CONFIG)
+    tone = PiGPIOStepperMotor(pi, TONE_CONFIG)
+    steppers = Steppers(pi, [feed, tone], chain_pulses=5000)
+
+    steppers.prepare_waveform([20000, -7001])
+    wave = steppers.prepared[-1]
+
+    assert wave.chain is not None
+    assert wave.pulses < 1000
+    assert set(wave.ids) == set(pi.created.keys())
+
+
+def test_chain_plan_moves_all_steps():
+    profile = [delay >> 1 for delay in calculate_acceleration_profile(1000, 3000, 1000)]
+
+    for count, slave in [(30, 7), (5000, 0), (20000, 19999), (1000000, 3), (15030, 101), (15030, 402), (9000, 35)]:
+        plan = create_chain_plan(profile, 166, count, 18, [(slave, 23)], 1 << 17, 1 << 22)
+
+        steps = {18: 0, 23: 0}
+        length = 0
+        for idx, repeat in plan.chain:
+            for pin in steps:
+                steps[pin] += repeat * sum(1 for pulse in plan.waves[idx] if pulse.gpio_on & (1 << pin))
+            length += repeat * sum(pulse.delay for pulse in plan.waves[idx])
+        assert steps == {18: count, 23: slave}
+        assert length == plan.length
+        assert sum(1 for _, repeat in plan.chain if repeat > 1) <= 20  # pigpio loop counters
+
+
+def test_chain_plateaus_never_step_faster_than_the_profile():
+    profile = [delay >> 1 for delay in calculate_acceleration_profile(1000, 3000, 1000)]
+
+    for count in [1, 30, 2 * len(profile) - 1, 2 * len(profile) + 500]:
+        halves = []
+        for half_delay, steps in waveform.plateaus(profile, 166, count, 8):
+            halves += [half_delay] * steps
+        assert len(halves) == count
+        for step, half_delay in enumerate(halves):
+            ramp_step = min(step, count - 1 - step)
+            assert half_delay >= (profile[ramp_step] if ramp_step < len(profile) else 166)
+
+
+def test_move_durations_are_looked_up_without_building_pulses():
+    pi = pigpio_mock.pi()
+    feed = PiGPIOStepperMotor(pi, FEED_CONFIG)
+    tone = PiGPIOStepperMotor(pi, dict(TONE_CONFIG, **{'jerk': 5000}))
+    steppers = Steppers(pi, [feed, tone], chain_pulses=5000)
+
+    for steps in [0, 1, 2, 3, 10, 3999, 4000, 4001, 8001, -1, -9000]:
+        for stepper in [feed, tone]:
+            assert stepper.move_duration_us(steps) == sum(pulse.delay for pulse in stepper.create_move_waveform(steps))
+    for steps in [[10, 0], [0, -10], [300, 20], [-20, 2400], [20000, -7001]]:
+        steppers.prepare_waveform(steps)
+        assert round(steppers.prepared[-1].length * 1000000) == steppers.move_duration_us(steps)
+
+
+def test_s_curve_profile_eases_in_and_out():
+    linear = calculate_acceleration_profile(1000, 3000, 1000)
+    s_curve = calculate_acceleration_profile(1000, 3000, 1000, jerk=2000)
+
+    assert s_curve[0] == linear[0] == 1000
+    assert s_curve == sorted(s_curve, reverse=True)
+    assert s_curve[-1] == linear[-1] == 333
+    assert len(s_curve) > len(linear)
+    # the speed changes less over the first and the last 200 steps than with a constant acceleration
+    def speedup(profile, start, end):
+        return 1000000 / profile[end] - 1000000 / profile[start]
+
+    assert speedup(s_curve, 0, 200) < speedup(linear, 0, 200) / 2
+    assert speedup(s_curve, -200, -1) < speedup(linear, -200, -1) / 2
+
+
+def test_next_punch_waits_for_off_length():
+    pi = pigpio_mock.pi()
+    steppers = Steppers(pi, [PiGPIOStepperMotor(pi, FEED_CONFIG)])
+    puncher = Puncher(pi, {'pin': 11, 'on-length': 0.2, 'off-length': 0.3, 'clear-length': 0.1})
+
+    assert puncher.duration_us() == 300000
+    steppers.prepare_waveform([1], [puncher])  # a short move, shorter than off-length - clear-length
+
+    assert round(steppers.prepared_wave_length * 1000000) == 200000 + 300000
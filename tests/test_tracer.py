@@ -0,0 +1,27 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from musicpuncher.music import DelayNotes
+from musicpuncher.tracer import HOST, WAVES
+from tests.helpers import CONFIG, simulated_puncher
+
+
+def test_trace_of_a_run(tmp_path):
+    config = dict(CONFIG, trace=str(tmp_path / 'trace.json'))
+    puncher = simulated_puncher(config)
+
+    puncher.run([DelayNotes(0, [48, 60]), DelayNotes(0.5, [50]), DelayNotes(40, [52])])
+
+    with open(tmp_path / 'trace.json') as file:
+        events = [event for event in json.load(file)['traceEvents'] if event['ph'] == 'X']
+    host = [event['name'] for event in events if event['tid'] == HOST]
+    assert {'reset', 'calculate steps', 'prepare_waveform', 'create_and_send_wave', 'wait_for_wave', 'punch', 'cut',
+            'move'} == set(host)
+    assert host.count('punch') == 4
+    waves = sorted((event for event in events if event['tid'] == WAVES), key=lambda event: event['ts'])
+    assert len(waves) == host.count('create_and_send_wave')
+    for wave, next_wave in zip(waves, waves[1:]):
+        assert wave['ts'] + wave['dur'] <= next_wave['ts'] + 0.1  # one wave at a time
@@ -0,0 +1,81 @@
+import base64
+import os
+import sys
+from io import BytesIO
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from musicpuncher.keyboard import Keyboard
+from musicpuncher.music import DelayNotes, parse_midi
+from musicpuncher.webserver import WebServer, app
+from tests.helpers import KEYS, midi_bytes, simulated_puncher
+
+KEYBOARD = Keyboard(KEYS)
+
+
+def create_client(directory):
+    server = WebServer(KEYBOARD, simulated_puncher(keyboard=KEYBOARD), {'queue-dir': str(directory)})
+    return server, app.test_client()
+
+
+MIDI = midi_bytes([DelayNotes(0, [49]), DelayNotes(1, [51])])
+EXPECTED = [[50], [52]]  # transposed by one
+
+
+def notes_of(midi: bytes):
+    return [list(delayNotes.notes) for delayNotes in parse_midi(file=BytesIO(midi))]
+
+
+def test_test_mode_accepts_raw_multipart_and_json_uploads(tmp_path):
+    _, client = create_client(tmp_path)
+
+    raw = client.post('/api/punch?test=true&transpose=1', data=MIDI, content_type='audio/midi')
+    assert raw.status_code == 200 and raw.mimetype == 'audio/midi'
+    assert notes_of(raw.data) == EXPECTED
+
+    form = {'file': (BytesIO(MIDI), 'song.mid'), 'transpose': '1', 'autotranspose': 'false', 'autofit': 'false'}
+    multipart = client.post('/api/punch?test=true', data=form, content_type='multipart/form-data')
+    assert notes_of(multipart.data) == EXPECTED
+
+    content = {'filename': 'song.mid', 'midiFile': base64.b64encode(MIDI).decode(), 'transpose': 1,
+               'autotranspose': False, 'autofit': False}
+    assert notes_of(base64.b64decode(client.post('/api/punch?test=true', json=content).data)) == EXPECTED
+
+    assert client.post('/api/punch?test=true', data=MIDI, content_type='audio/midi').status_code == 400
+
+
+def test_uploads_are_queued(tmp_path):
+    server, client = create_client(tmp_path)
+    version = client.get('/api/status').json['queue']
+    notified = server.puncher.notifier.version
+
+    assert client.post('/api/punch?filename=song.mid&transpose=1', data=MIDI, content_type='audio/midi').data == b'ok'
+    job = client.post('/api/punch?compile=true&transpose=1', data=MIDI, content_type='audio/midi').data
+    assert client.post('/api/punch?filename=song.mpjob', data=job, content_type='application/octet-stream').data == b'ok'
+
+    assert [job['filename'] for job in client.get('/api/queue').json['jobs']] == ['song.mid', 'song.mpjob']
+    assert client.get('/api/status').json['queue'] > version  # clients fetch the queue when the version changes
+    assert server.puncher.notifier.version > notified
+    server.queue.start()
+    assert server.queue.join(timeout=10)
+    assert server.puncher.pi.report()['holes'] == 4
+
+
+def test_invalid_uploads_are_rejected(tmp_path):
+    _, client = create_client(tmp_path)
+
+    for query in ['test=true&', 'compile=true&', '']:
+        assert client.post(f'/api/punch?{query}transpose=up', data=MIDI, content_type='audio/midi').status_code == 400
+        assert client.post(f'/api/punch?{query}', data=MIDI[:-5], content_type='audio/midi').status_code == 400
+    assert client.get('/api/queue').json['jobs'] == []
+
+
+def test_status_stream_starts_with_the_current_status(tmp_path):
+    _, client = create_client(tmp_path)
+
+    response = client.get('/api/status/stream', buffered=False)
+
+    assert response.mimetype == 'text/event-stream'
+    event = next(response.response)
+    assert event.startswith(b'data: ') and b'"active": false' in event
+    response.close()